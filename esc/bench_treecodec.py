@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+# compare the pickle and flat (dump_tree/load_tree) cache formats end to end:
+# parse_files and parse_file over common/ and history/ against a warm cache,
+# for each cache backend. Every format gets its own cache directory, filled
+# by a cold pass first, so that no hit is served in the other format. Lazy
+# trees are decoded only as they are walked, which these timings leave out.
+
+import pathlib
+import sys
+import tempfile
+import time
+from ck2parser import rootpath, SimpleParser
+from print_time import print_time
+
+GLOBS = ['common/**/*.txt', 'history/**/*.txt']
+
+FORMATS = [('pickle', 'pickle', False),
+           ('flat', 'flat', False),
+           ('flat lazy', 'flat', True)]
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return time.perf_counter() - start, result
+
+def cache_size(cachedir):
+    return sum(p.stat().st_size for p in cachedir.rglob('*') if p.is_file())
+
+def bench(moddirs, backend, cache_format, lazy, cachedir):
+    parser = SimpleParser(*moddirs)
+    parser.cachedir = cachedir
+    parser.cachedir.mkdir(parents=True)
+    parser.cache_backend = backend
+    parser.cache_format = cache_format
+    parser.lazy_load = lazy
+    parse_files = lambda: [path for glob in GLOBS
+                           for path, _ in parser.parse_files(glob)]
+    cold_time, paths = timed(parse_files)
+    parser.cache_hits = parser.cache_misses = 0
+    files_time, _ = timed(parse_files)
+    file_time, _ = timed(lambda: [parser.parse_file(p) for p in paths])
+    # every tree of both warm passes should have come from the cache
+    assert parser.cache_misses == 0, parser.cache_misses
+    if parser._cachestore is not None:
+        parser._cachestore.db.close()
+    return (len(paths), cache_size(cachedir), cold_time, files_time,
+            file_time)
+
+@print_time
+def main():
+    moddirs = [rootpath / d for d in sys.argv[1:]]
+    with tempfile.TemporaryDirectory() as tmp:
+        for backend in ['files', 'sqlite']:
+            for name, cache_format, lazy in FORMATS:
+                cachedir = pathlib.Path(tmp, backend, name.replace(' ', '_'))
+                count, size, cold, files, file = bench(
+                    moddirs, backend, cache_format, lazy, cachedir)
+                print('{:>6} {:>9}: {} files, {:>10} bytes, cold {:.2f} s, '
+                      'warm parse_files {:.2f} s, warm parse_file {:.2f} s'
+                      .format(backend, name, count, size, cold, files, file))
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,30 @@
 #!/usr/bin/env python3
 
-import collections
+import array
+import concurrent.futures
 import csv
 import functools
 import hashlib
+import itertools
 import operator
 import os
 import pathlib
 import pickle
 import re
+import sqlite3
+import struct
 import sys
 import time
 import traceback
-from operator import attrgetter
+import weakref
 
-from funcparserlib.lexer import make_tokenizer, Token
+from funcparserlib.lexer import make_tokenizer, Token, LexerError
 from funcparserlib.parser import (some, a, maybe, many, finished, skip,
                                   oneplus, forward_decl, NoParseError)
 from localpaths import rootpath, vanilladir, cachedir
+import vfs
+from locindex import compile_index
+from timeline import Timeline
 from functools import total_ordering
 
 try:
@@ -26,7 +33,7 @@ try:
 except ImportError:
     git_present = False
 
-VERSION = 3
+VERSION = 6
 
 csv.register_dialect('ckii', delimiter=';', doublequote=False,
                      quotechar='\0', quoting=csv.QUOTE_NONE, strict=True)
@@ -43,11 +50,7 @@ def csv_rows(path, linenum=False, comments=False):
 # give mod dirs in descending lexicographical order of mod name (Z-A),
 # modified for dependencies as necessary.
 def files(glob, moddirs=(), basedir=vanilladir, reverse=False):
-    result_paths = {p.relative_to(d): p
-                    for d in (basedir,) + tuple(moddirs) for p in d.glob(glob)}
-    for _, p in sorted(result_paths.items(), key=lambda t: t[0].parts,
-                       reverse=reverse):
-        yield p
+    yield from vfs.shared(basedir, *moddirs).glob(glob, reverse)
 
 def get_cultures(parser, groups=True):
     cultures = []
@@ -56,26 +59,31 @@ def get_cultures(parser, groups=True):
         for n, v in tree:
             culture_groups.append(n.val)
             cultures.extend(n2.val for n2, v2 in v
-                            if n2.val not in ['graphical_cultures',
+                            if n2.val not in {'graphical_cultures',
                                               'unit_graphical_cultures',
-                                              'alternate_start'])
+                                              'alternate_start'})
     return (cultures, culture_groups) if groups else cultures
 
 def get_religions(parser, groups=True):
     religions = []
     religion_groups = []
     for _, tree in parser.parse_files('common/religions/*.txt'):
-        for n, v in tree:
-            if n.val == 'secret_religion_visibility_trigger':
-                continue
-            religion_groups.append(n.val)
-            religions.extend(n2.val for n2, v2 in v
-                             if (isinstance(v2, Obj) and
-                                 n2.val not in ['color', 'male_names',
-                                                'female_names',
-                                                'interface_skin']))
+        add_religions(tree, religions, religion_groups)
     return (religions, religion_groups) if groups else religions
 
+# the religions and religion groups of one file, for scripts that stream the
+# religion files themselves (see pipeline.py)
+def add_religions(tree, religions, religion_groups):
+    for n, v in tree:
+        if n.val == 'secret_religion_visibility_trigger':
+            continue
+        religion_groups.append(n.val)
+        religions.extend(n2.val for n2, v2 in v
+                         if (isinstance(v2, Obj) and
+                             n2.val not in {'color', 'male_names',
+                                            'female_names',
+                                            'interface_skin'}))
+
 def get_province_id_name_map(parser):
     defs = parser.parse_file('map/default.map')['definitions'].val
     id_name_map = {}
@@ -99,13 +107,17 @@ def get_provinces(parser):
                 continue
             yield number, title, tree
 
+def csv_entries(path):
+    return [(row[0], row[1]) for row in csv_rows(path)]
+
+# read-only and compiled into cachedir; the first value of a key wins.
+# Iterates in file order, so ordered is only kept for compatibility
 def get_localisation(moddirs=(), basedir=vanilladir, ordered=False):
-    locs = collections.OrderedDict() if ordered else {}
-    for path in files('localisation/*.csv', moddirs, basedir=basedir):
-        for row in csv_rows(path):
-            if row[0] not in locs:
-                locs[row[0]] = row[1]
-    return locs
+    dirs = [str(d) for d in (basedir,) + tuple(moddirs)]
+    name = hashlib.md5('\n'.join(dirs).encode()).hexdigest()
+    return compile_index(cachedir / 'locindex' / ('ck2-english-' + name),
+                         list(files('localisation/*.csv', moddirs, basedir)),
+                         csv_entries)
 
 def first_post_comment(item):
     if item.post_comment:
@@ -182,14 +194,122 @@ class Comment:
 
 
 class Stringifiable:
-    pass
+    __slots__ = ()
+
+
+class Contents(list):
+    """The items of a TopLevel or Obj. Holds the key indexes built by
+    ContainerMixin and drops them when changed in place, along with the
+    recursive indexes and timelines of the containers above it which cover
+    it. Renaming a key or replacing a value in place isn't tracked."""
+
+    _keys = None
+    _recursive_keys = None
+    _timeline = None
+    # weak references to the Contents of containers above this one whose
+    # recursive indexes or timelines cover it, by id, as lists aren't
+    # hashable
+    _watchers = None
+
+    def _changed(self):
+        self._keys = None
+        self._recursive_keys = None
+        self._timeline = None
+        if self._watchers is not None:
+            watchers, self._watchers = self._watchers, None
+            for ref in watchers.values():
+                contents = ref()
+                if contents is not None:
+                    contents._recursive_keys = None
+                    contents._timeline = None
+
+    def _watch(self, contents):
+        """have the recursive indexes and timeline of contents dropped when
+        this changes"""
+        if self._watchers is None:
+            self._watchers = {}
+        self._watchers[id(contents)] = weakref.ref(contents)
+
+    def __reduce__(self):
+        return Contents, (list(self),)
+
+    def key_index(self):
+        """(multimap, dictionary) where multimap maps each key to its pairs
+        in order and dictionary maps each key to its first value. The keys of
+        dictionary are in reverse order of their last pair, as they always
+        were, which merge_parse relies on.
+
+        >>> tree = SimpleParser().parse('a = 1 b = 2 c = 3 a = 4')
+        >>> [(k, v.val) for k, v in tree.dictionary.items()]
+        [('a', 1), ('c', 3), ('b', 2)]
+        """
+        if self._keys is None:
+            multimap = {}
+            for item in self:
+                if isinstance(item, Pair):
+                    key = item.key.val
+                    if key in multimap:
+                        multimap[key].append(item)
+                    else:
+                        multimap[key] = [item]
+            dictionary = {}
+            for item in reversed(self):
+                if isinstance(item, Pair):
+                    dictionary[item.key.val] = item.value
+            self._keys = multimap, dictionary
+        return self._keys
+
+
+def _mutator(name):
+    method = getattr(list, name)
+    def mutate(self, *args, **kwargs):
+        self._changed()
+        return method(self, *args, **kwargs)
+    mutate.__name__ = name
+    return mutate
+
+for name in ['__setitem__', '__delitem__', '__iadd__', '__imul__', 'append',
+             'extend', 'insert', 'pop', 'remove', 'clear', 'reverse', 'sort']:
+    setattr(Contents, name, _mutator(name))
+del name
+
+
+def _index_recursively(container, index, outer_keys, root):
+    # a pair is found by find_all_recursively unless it's inside a pair with
+    # the same key. Every Contents below root is watched by it, even those
+    # without pairs, which may get some.
+    if not container.has_pairs:
+        return
+    for item in container.contents:
+        if isinstance(item, Pair):
+            key, value = item.key.val, item.value
+            if key not in outer_keys:
+                index.setdefault(key, []).append(value)
+            if isinstance(value, ContainerMixin):
+                value.contents._watch(root)
+                outer_keys[key] = outer_keys.get(key, 0) + 1
+                _index_recursively(value, index, outer_keys, root)
+                if outer_keys[key] == 1:
+                    del outer_keys[key]
+                else:
+                    outer_keys[key] -= 1
 
 
 class ContainerMixin:
     """Common code for TopLevel and Obj"""
 
-    contents = None
-    _dictionary = None
+    @property
+    def contents(self):
+        return self._contents
+
+    @contents.setter
+    def contents(self, value):
+        # the old items are gone, as if they had been cleared
+        old = getattr(self, '_contents', None)
+        if old is not None:
+            old._changed()
+        self._contents = (value if type(value) is Contents else
+                          Contents(value))
 
     def __len__(self):
         return len(self.contents)
@@ -219,28 +339,66 @@ class ContainerMixin:
 
     @property
     def dictionary(self):
-        if self._dictionary is None:
-            self._dictionary = {k.val: v for k, v in reversed(self.contents)}
-        return self._dictionary
+        return self.contents.key_index()[1]
 
     def find_all(self, key):
         """get a list of values which have the given key"""
-        return [(v.val if hasattr(v, 'val') else v) for k, v in self.contents if k.val == key]
+        pairs = self.contents.key_index()[0].get(key, ())
+        return [(v.val if hasattr(v, 'val') else v) for k, v in pairs]
 
     def find_all_recursively(self, search_key):
-        """Like find_all, but searches the whole Tree recursively"""
-        results = []
-        if self.has_pairs:
-            for element in self.contents:
-                if isinstance(element, Pair):
-                    k,v = element
-                    if k.val == search_key:
-                        results.append(v.val if hasattr(v, 'val') else v)
-                    elif isinstance(v, ContainerMixin):
-                        results.extend(v.find_all_recursively(search_key))
-                else:  # not every element might be a pair
-                    continue
-        return results
+        """Like find_all, but searches the whole Tree recursively. Values
+        inside a pair with search_key aren't searched. The first call indexes
+        every key in the tree, until some Contents in it changes.
+
+        >>> tree = SimpleParser().parse('a = { b = 1 } b = 2')
+        >>> tree.find_all_recursively('b')
+        [1, 2]
+        >>> tree['a'].contents.append(Pair('b', '3'))
+        >>> tree.find_all_recursively('b')
+        [1, '3', 2]
+        >>> index = tree.contents._recursive_keys
+        >>> _ = SimpleParser().parse('b = 4')
+        >>> tree.find_all_recursively('b')
+        [1, '3', 2]
+        >>> tree.contents._recursive_keys is index
+        True
+        """
+        contents = self.contents
+        index = contents._recursive_keys
+        if index is None:
+            index = {}
+            _index_recursively(self, index, {}, contents)
+            contents._recursive_keys = index
+        return [(v.val if hasattr(v, 'val') else v)
+                for v in index.get(search_key, ())]
+
+    @property
+    def timeline(self):
+        """Timeline of this history, rebuilt once it or one of its dated
+        blocks changes
+
+        >>> tree = SimpleParser().parse('a = 1 1066.1.1 = { a = 2 }')
+        >>> timeline = tree.timeline
+        >>> [p.value.val for p in tree.at_time(Date('1066.1.1')).contents]
+        [2]
+        >>> tree.timeline is timeline
+        True
+        >>> tree.contents[1].value.contents.append(Pair('a', '3'))
+        >>> tree.timeline is timeline
+        False
+        >>> tree.timeline.value('a', (1066, 1, 1)).val
+        '3'
+        """
+        contents = self.contents
+        timeline = contents._timeline
+        if timeline is None:
+            timeline = contents._timeline = Timeline(self)
+            for item in contents:
+                if (isinstance(item, Pair) and
+                        isinstance(item.value, ContainerMixin)):
+                    item.value.contents._watch(contents)
+        return timeline
 
     def get_sorted_entries_with_date(self, default_date=(1, 1, 1), ignore_entries_after=(1444, 11, 11)):
         """create a list of entries for each date and use default_date for entries without a date,
@@ -283,12 +441,11 @@ class ContainerMixin:
                     special_handlers[k] = append
 
         result = {}
-        for date, entries in self.get_sorted_entries_with_date().items():
-            for k, v in entries:
-                if k.val in special_handlers:
-                    result[k.val] = special_handlers[k.val](v, result.get(k.val))
-                else:
-                    result[k.val] = v
+        for k, v in self.timeline.entries_until(date):
+            if k.val in special_handlers:
+                result[k.val] = special_handlers[k.val](v, result.get(k.val))
+            else:
+                result[k.val] = v
         return result
 
 class TopLevel(ContainerMixin, Stringifiable):
@@ -303,7 +460,6 @@ class TopLevel(ContainerMixin, Stringifiable):
             self.post_comments = []
         else:
             self.post_comments = [Comment(s) for s in post_comments]
-        self._dictionary = None
 
     @property
     def pre_comments(self):
@@ -341,16 +497,18 @@ class TopLevel(ContainerMixin, Stringifiable):
             del c_list[0]
 
     def str(self, parser, indent=0):
-        s = ''
+        return ''.join(self.iter_str(parser, indent))
+
+    def iter_str(self, parser, indent=0):
+        """str in pieces, one or two per item"""
         for i, item in enumerate(self):
-            s += item.str(parser, indent)
+            yield item.str(parser, indent)
             if indent <= parser.newlines_to_depth:
                 if (i < len(self) - 1 and (isinstance(item.value, Obj) or
                     isinstance(self.contents[i + 1].value, Obj))):
-                    s += '\n'
+                    yield '\n'
         if self.post_comments:
-            s += comments_to_str(parser, self.post_comments, indent)
-        return s
+            yield comments_to_str(parser, self.post_comments, indent)
 
     def _add_pair_to_result_dict(self, pair, result, keys_which_can_appear_more_than_once):
         if pair.key.val in keys_which_can_appear_more_than_once:
@@ -371,19 +529,8 @@ class TopLevel(ContainerMixin, Stringifiable):
         @return: TopLevel
         """
         result_dict = {}
-        dated_items = []
-        for pair in self.contents:
-            if isinstance(pair.key, Date):
-                if pair.key <= date:
-                    dated_items.append(pair)
-                else:  # ignore dated entries past the date we are looking for
-                    pass
-            else:
-                self._add_pair_to_result_dict(pair, result_dict, keys_which_can_appear_more_than_once)
-
-        for date, date_pairs in sorted(dated_items, key=attrgetter('key')):
-            for pair in date_pairs:
-                self._add_pair_to_result_dict(pair, result_dict, keys_which_can_appear_more_than_once)
+        for pair in self.timeline.entries_until(date.val):
+            self._add_pair_to_result_dict(pair, result_dict, keys_which_can_appear_more_than_once)
         result_list = []
         for pair in result_dict.values():
             if isinstance(pair, list):
@@ -394,6 +541,7 @@ class TopLevel(ContainerMixin, Stringifiable):
 
 
 class Commented(Stringifiable):
+    __slots__ = 'pre_comments', 'val', 'post_comment'
 
     def __init__(self, *args):
         super().__init__()
@@ -427,6 +575,12 @@ class Commented(Stringifiable):
         s = self.val_str()
         return s, col + chars(s, parser)
 
+    def oneline_col(self, parser, indent=0, col=0):
+        """the column inline_str would end at if it doesn't break the line,
+        else None, without building the string. Only for nodes without
+        comments."""
+        return col + chars(self.val_str(), parser)
+
     def str(self, parser, indent=0):
         s = ''
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
@@ -472,6 +626,7 @@ class Commented(Stringifiable):
 
 @total_ordering
 class String(Commented):
+    __slots__ = 'force_quote',
 
     def __init__(self, *args):
         super().__init__(*args)
@@ -509,6 +664,7 @@ class String(Commented):
 
 @total_ordering
 class Number(Commented):
+    __slots__ = ()
 
     def str_to_val(self, string):
         try:
@@ -548,6 +704,7 @@ class Number(Commented):
 
 @total_ordering
 class Date(Commented):
+    __slots__ = ()
 
     def __init__(self, *args):
         if len(args) == 3 and isinstance(args[0], int) and isinstance(args[1], int) and isinstance(args[2], int):
@@ -583,10 +740,106 @@ class Date(Commented):
 
 
 class Op(Commented):
-    pass
+    __slots__ = ()
+
+
+class _NoComments:
+    """stands in for a comment slot of a lean node. Assigning comments
+    turns the node into its full class in place."""
+
+    def __init__(self, default):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, node, cls=None):
+        return self.default
+
+    def __set__(self, node, value):
+        if node.full_class is None:
+            raise AttributeError('shared {!r} node cannot hold comments'
+                                 .format(node.val))
+        node.__class__ = node.full_class
+        node.pre_comments = []
+        node.post_comment = None
+        setattr(node, self.name, value)
+
+
+class Lean:
+    """Mixin for the comment-free leaves built by SimpleParser. They have
+    no __dict__ and leave the comment slots unset."""
+    __slots__ = ()
+    pre_comments = _NoComments(())
+    post_comment = _NoComments(None)
+    lean_slots = 'val',
+
+    def __getstate__(self):
+        return None, {name: getattr(self, name) for name in self.lean_slots}
+
+
+class SimpleString(Lean, String):
+    __slots__ = ()
+    full_class = String
+    lean_slots = 'val', 'force_quote'
+
+    def __init__(self, val):
+        self.val = val
+        self.force_quote = False
+
+
+class SimpleNumber(Lean, Number):
+    __slots__ = ()
+    full_class = Number
+
+    def __init__(self, string):
+        self.val = self.str_to_val(string)
+
+
+class SimpleDate(Lean, Date):
+    __slots__ = ()
+    full_class = Date
+
+    def __init__(self, string):
+        self.val = self.str_to_val(string)
+
+
+class SimpleOp(Lean, Op):
+    """Shared between all pairs and objects, see simple_op. Pair.op, Obj.kel
+    and Obj.ker hand out an _OwnedOp copy instead, which can take comments"""
+    __slots__ = ()
+    full_class = None
+
+    def __init__(self, val):
+        self.val = val
+
+    def __reduce__(self):
+        return simple_op, (self.val,)
+
+
+class _OwnedOp(SimpleOp):
+    """a SimpleOp which belongs to one pair or object. It becomes an Op when
+    comments are assigned, and is shared again once pickled"""
+    __slots__ = ()
+    full_class = Op
+
+
+def _owned(op):
+    return _OwnedOp(op.val) if op.__class__ is SimpleOp else op
+
+
+_simple_ops = {}
+
+def simple_op(val):
+    """the shared SimpleOp for an operator or brace"""
+    try:
+        return _simple_ops[val]
+    except KeyError:
+        return _simple_ops.setdefault(val, SimpleOp(val))
 
 
 class Pair(Stringifiable):
+    __slots__ = 'key', '_op', 'value'
 
     def __init__(self, *args):
         super().__init__()
@@ -618,6 +871,30 @@ class Pair(Stringifiable):
         yield self.key
         yield self.value
 
+    @property
+    def op(self):
+        """the operator. A shared SimpleOp is first replaced by a copy of this
+        pair's own, so that comments can be assigned to it, as they can to
+        the braces of an Obj
+
+        >>> parser = SimpleParser()
+        >>> tree = parser.parse('a = { b = 1 } c = 2')
+        >>> tree.contents[0].value.post_comment = Comment('x')
+        >>> tree.contents[1].op.post_comment = Comment('y')
+        >>> print(tree.str(parser), end='')
+        a = { b = 1 } # x
+        c = # y
+        2
+        >>> print(parser.parse('d = { e = 3 }').str(parser), end='')
+        d = { e = 3 }
+        """
+        op = self._op = _owned(self._op)
+        return op
+
+    @op.setter
+    def op(self, value):
+        self._op = value
+
     @property
     def pre_comments(self):
         return self.key.pre_comments
@@ -636,7 +913,7 @@ class Pair(Stringifiable):
 
     @property
     def has_comments(self):
-        return any(x.has_comments for x in (self.key, self.op, self.value))
+        return any(x.has_comments for x in (self.key, self._op, self.value))
 
     def str(self, parser, indent=0):
         indent_str = '\t' if parser.tab_indents else ' ' * parser.indent_width
@@ -652,8 +929,21 @@ class Pair(Stringifiable):
             s += self_is + '\n'
         return s
 
+    def oneline_col(self, parser, indent=0, col=0):
+        """see Commented.oneline_col"""
+        if (isinstance(self.key, String) and self.key.val in parser.fq_keys
+            and isinstance(self.value, String)):
+            self.value.force_quote = True
+        col = self.key.oneline_col(parser, indent, col) + 1
+        col_op = self._op.oneline_col(parser, indent, col)
+        if (col > indent * parser.indent_width and
+            col_op > parser.chars_per_line):
+            return None
+        return self.value.oneline_col(parser, indent, col_op + 1)
+
     def inline_str(self, parser, indent=0, col=0):
-        if isinstance(self.key, String) and self.key.val in parser.fq_keys:
+        if (isinstance(self.key, String) and self.key.val in parser.fq_keys
+            and isinstance(self.value, String)):
             self.value.force_quote = True
         s = ''
         nl = 0
@@ -664,12 +954,12 @@ class Pair(Stringifiable):
         if not s[-1].isspace():
             s += ' '
             col += 1
-        op_is, (nl_op, col_op) = self.op.inline_str(parser, indent, col)
+        op_is, (nl_op, col_op) = self._op.inline_str(parser, indent, col)
         if (col > indent * parser.indent_width and
             col_op > parser.chars_per_line):
             if not s[-2].isspace():
                 s = s[:-1]
-            op_s = self.op.str(parser, indent)
+            op_s = self._op.str(parser, indent)
             s += '\n' + op_s
             nl += 1 + op_s.count('\n')
             col = indent * parser.indent_width
@@ -705,11 +995,29 @@ class Obj(ContainerMixin, Stringifiable):
             self.kel = kel
             self.contents = contents
             self.ker = ker if ker is not None else Op('}')
-        self._dictionary = None
+
+    # like Pair.op, the braces are made the object's own when handed out
+    @property
+    def kel(self):
+        kel = self._kel = _owned(self._kel)
+        return kel
+
+    @kel.setter
+    def kel(self, value):
+        self._kel = value
+
+    @property
+    def ker(self):
+        ker = self._ker = _owned(self._ker)
+        return ker
+
+    @ker.setter
+    def ker(self, value):
+        self._ker = value
 
     @property
     def pre_comments(self):
-        return self.kel.pre_comments
+        return self._kel.pre_comments
 
     @pre_comments.setter
     def pre_comments(self, value):
@@ -717,7 +1025,7 @@ class Obj(ContainerMixin, Stringifiable):
 
     @property
     def post_comment(self):
-        return self.ker.post_comment
+        return self._ker.post_comment
 
     @post_comment.setter
     def post_comment(self, value):
@@ -725,7 +1033,7 @@ class Obj(ContainerMixin, Stringifiable):
 
     @property
     def has_comments(self):
-        return (self.kel.has_comments or self.ker.has_comments or
+        return (self._kel.has_comments or self._ker.has_comments or
                 any(x.has_comments for x in self))
 
     def str(self, parser, indent=0):
@@ -743,7 +1051,7 @@ class Obj(ContainerMixin, Stringifiable):
         return s
 
     def might_fit_on_line(self, parser, indent):
-        if self.kel.has_comments or self.ker.pre_comments:
+        if self._kel.has_comments or self._ker.pre_comments:
             return False
         if self.contents and isinstance(self.contents[0], Pair):
             return (len(self) == 1 and not self.contents[0].has_comments and
@@ -752,10 +1060,23 @@ class Obj(ContainerMixin, Stringifiable):
         return all(isinstance(x, Commented) and not x.has_comments
                    for x in self)
 
+    def oneline_col(self, parser, indent=0, col=0):
+        """see Commented.oneline_col"""
+        col = self._kel.oneline_col(parser, indent, col)
+        if not self.might_fit_on_line(parser, indent):
+            return None
+        for item in self:
+            col = item.oneline_col(parser, indent, 1 + col)
+            if col is None or col + 2 > parser.chars_per_line:
+                return None
+        if self.contents:
+            col += 1
+        return self._ker.oneline_col(parser, indent, col)
+
     def inline_str(self, parser, indent=0, col=0):
         s = ''
         nl = 0
-        kel_is, (nl_kel, col_kel) = self.kel.inline_str(parser, indent, col)
+        kel_is, (nl_kel, col_kel) = self._kel.inline_str(parser, indent, col)
         s += kel_is
         nl += nl_kel
         col = col_kel
@@ -763,17 +1084,19 @@ class Obj(ContainerMixin, Stringifiable):
             # attempt one line object
             s_oneline, col_oneline = s, col
             for item in self:
-                item_is, (nl_item, col_item) = item.inline_str(parser, indent,
-                                                               1 + col_oneline)
+                # measure first: rendering an item that turns out not to fit
+                # only to render it again below is exponential in the depth
+                col_item = item.oneline_col(parser, indent, 1 + col_oneline)
+                if col_item is None or col_item + 2 > parser.chars_per_line:
+                    break
+                item_is, _ = item.inline_str(parser, indent, 1 + col_oneline)
                 s_oneline += ' ' + item_is
                 col_oneline = col_item
-                if nl_item > 0 or col_oneline + 2 > parser.chars_per_line:
-                    break
             else:
                 if self.contents:
                     s_oneline += ' '
                     col_oneline += 1
-                ker_is, (nl_ker, col_ker) = self.ker.inline_str(parser, indent,
+                ker_is, (nl_ker, col_ker) = self._ker.inline_str(parser, indent,
                                                                 col_oneline)
                 if nl_ker == 0 or (chars(ker_is.splitlines()[0], parser) <=
                                    parser.chars_per_line):
@@ -829,13 +1152,262 @@ class Obj(ContainerMixin, Stringifiable):
                 s += '\n' + indent * indent_str
                 nl += 1
                 col = indent * parser.indent_width
-        ker_is, (nl_ker, col_ker) = self.ker.inline_str(parser, indent, col)
+        ker_is, (nl_ker, col_ker) = self._ker.inline_str(parser, indent, col)
         s += ker_is
         nl += nl_ker
         col = col_ker
         return s, (nl, col)
 
 
+# Compact serialization of parse trees. A tree becomes one flat int array in
+# preorder plus a table of interned strings:
+#   TopLevel  K_TOPLEVEL n_items items... n_post post_comment_strs...
+#   Obj       K_OBJ n_items ker_offset kel items... ker
+#   Pair      K_PAIR key op value
+#   String    K_STRING str           (| F_FORCE_QUOTE)
+#   Number    K_INT int  or  K_NUMBER str
+#   Date      K_DATE n_parts parts...
+#   Op        K_OP str
+# A leaf with F_COMMENTS set is followed by n_pre pre_comment_strs...
+# post_comment_str (-1 for none); F_LEAN marks the Simple* classes.
+# ker_offset lets a reader skip an Obj.
+
+(K_TOPLEVEL, K_OBJ, K_PAIR, K_STRING, K_INT, K_NUMBER, K_DATE,
+ K_OP) = range(8)
+F_COMMENTS = 0x10
+F_FORCE_QUOTE = 0x20
+F_LEAN = 0x40
+TREE_MAGIC = b'CK2T'
+_tree_header = struct.Struct('<4sHII')
+
+def dump_tree(tree):
+    """serialize a TopLevel to bytes, see load_tree"""
+    codes = array.array('i')
+    emit = codes.append
+    strings = {}
+
+    def intern(s):
+        try:
+            return strings[s]
+        except KeyError:
+            strings[s] = len(strings)
+            return strings[s]
+
+    def comments(node, kind):
+        if isinstance(node, Lean):
+            emit(kind | F_LEAN)
+            return False
+        if node.pre_comments or node.post_comment:
+            emit(kind | F_COMMENTS)
+            return True
+        emit(kind)
+        return False
+
+    def dump(node):
+        if isinstance(node, Pair):
+            emit(K_PAIR)
+            dump(node.key)
+            dump(node._op)
+            dump(node.value)
+            return
+        if isinstance(node, Obj):
+            emit(K_OBJ)
+            emit(len(node.contents))
+            i = len(codes)
+            emit(0)
+            dump(node._kel)
+            for item in node.contents:
+                dump(item)
+            codes[i] = len(codes)
+            dump(node._ker)
+            return
+        if isinstance(node, String):
+            flags = F_FORCE_QUOTE if node.force_quote else 0
+            commented = comments(node, K_STRING | flags)
+            emit(intern(node.val))
+        elif isinstance(node, Number):
+            if (isinstance(node.val, int) and
+                -0x80000000 <= node.val < 0x80000000):
+                commented = comments(node, K_INT)
+                emit(node.val)
+            else:
+                commented = comments(node, K_NUMBER)
+                emit(intern(repr(node.val)))
+        elif isinstance(node, Date):
+            commented = comments(node, K_DATE)
+            emit(len(node.val))
+            codes.extend(node.val)
+        elif isinstance(node, Op):
+            commented = comments(node, K_OP)
+            emit(intern(node.val))
+        else:
+            raise TypeError('cannot serialize {!r}'.format(node))
+        if commented:
+            emit(len(node.pre_comments))
+            codes.extend(intern(c.val) for c in node.pre_comments)
+            emit(intern(node.post_comment.val) if node.post_comment else -1)
+
+    emit(K_TOPLEVEL)
+    emit(len(tree.contents))
+    for item in tree.contents:
+        dump(item)
+    emit(len(tree.post_comments))
+    codes.extend(intern(c.val) for c in tree.post_comments)
+    lengths = array.array('I', map(len, strings))
+    text = ''.join(strings).encode('utf-8', 'surrogatepass')
+    return b''.join([_tree_header.pack(TREE_MAGIC, VERSION, len(lengths),
+                                       len(codes)),
+                     lengths.tobytes(), codes.tobytes(), text])
+
+def load_tree(data, lazy=False):
+    """deserialize bytes from dump_tree into the usual node classes, or with
+    lazy=True into LazyObj nodes which decode their contents only when they
+    are first accessed. Returns None for data written under another
+    VERSION."""
+    magic, version, n_strings, n_codes = _tree_header.unpack_from(data)
+    if magic != TREE_MAGIC:
+        raise ValueError('not a serialized parse tree')
+    if version != VERSION:
+        return None
+    pos = _tree_header.size
+    lengths = array.array('I')
+    lengths.frombytes(data[pos:pos + 4 * n_strings])
+    pos += 4 * n_strings
+    codes = array.array('i')
+    codes.frombytes(data[pos:pos + codes.itemsize * n_codes])
+    pos += codes.itemsize * n_codes
+    text = data[pos:].decode('utf-8', 'surrogatepass')
+    strings = []
+    end = 0
+    for length in lengths:
+        strings.append(text[end:end + length])
+        end += length
+    return _TreeLoader(codes.tolist(), strings, lazy).toplevel()
+
+
+class _TreeLoader:
+    """builds nodes without running their constructors, so the strings
+    come back exactly as stored"""
+
+    def __init__(self, codes, strings, lazy):
+        self.codes = codes
+        self.strings = strings
+        self.lazy = lazy
+
+    def comment(self, i):
+        comment = Comment.__new__(Comment)
+        comment.val = self.strings[i]
+        return comment
+
+    def toplevel(self):
+        codes = self.codes
+        contents, pos = self.items(2, codes[1])
+        tree = TopLevel(contents)
+        n_post = codes[pos]
+        tree.post_comments = [self.comment(i)
+                              for i in codes[pos + 1:pos + 1 + n_post]]
+        tree.version = VERSION
+        return tree
+
+    def items(self, pos, n):
+        node = self.node
+        items = []
+        for _ in range(n):
+            item, pos = node(pos)
+            items.append(item)
+        return items, pos
+
+    def node(self, pos):
+        codes = self.codes
+        strings = self.strings
+        code = codes[pos]
+        kind = code & 0xf
+        if kind == K_PAIR:
+            pair = Pair.__new__(Pair)
+            pair.key, pos = self.node(pos + 1)
+            pair._op, pos = self.node(pos)
+            pair.value, pos = self.node(pos)
+            return pair, pos
+        if kind == K_OBJ:
+            n, ker_pos = codes[pos + 1], codes[pos + 2]
+            kel, pos = self.node(pos + 3)
+            ker, end = self.node(ker_pos)
+            if self.lazy:
+                obj = LazyObj(kel, functools.partial(self.items, pos, n), ker)
+            else:
+                obj = Obj(kel, self.items(pos, n)[0], ker)
+            return obj, end
+        lean = code & F_LEAN
+        if kind == K_STRING:
+            cls = SimpleString if lean else String
+            node = cls.__new__(cls)
+            node.val = strings[codes[pos + 1]]
+            node.force_quote = bool(code & F_FORCE_QUOTE)
+            pos += 2
+        elif kind == K_INT:
+            cls = SimpleNumber if lean else Number
+            node = cls.__new__(cls)
+            node.val = codes[pos + 1]
+            pos += 2
+        elif kind == K_NUMBER:
+            cls = SimpleNumber if lean else Number
+            node = cls.__new__(cls)
+            node.val = node.str_to_val(strings[codes[pos + 1]])
+            pos += 2
+        elif kind == K_DATE:
+            cls = SimpleDate if lean else Date
+            node = cls.__new__(cls)
+            n = codes[pos + 1]
+            node.val = tuple(codes[pos + 2:pos + 2 + n])
+            pos += 2 + n
+        elif kind == K_OP:
+            if lean:
+                return simple_op(strings[codes[pos + 1]]), pos + 2
+            node = Op.__new__(Op)
+            node.val = strings[codes[pos + 1]]
+            pos += 2
+        else:
+            raise ValueError('bad node kind {} at {}'.format(kind, pos))
+        if code & F_COMMENTS:
+            n_pre = codes[pos]
+            node.pre_comments = [self.comment(i)
+                                 for i in codes[pos + 1:pos + 1 + n_pre]]
+            pos += 1 + n_pre
+            post = codes[pos]
+            node.post_comment = self.comment(post) if post >= 0 else None
+            pos += 1
+        elif not lean:
+            node.pre_comments = []
+            node.post_comment = None
+        return node, pos
+
+
+class LazyObj(Obj):
+    """Obj from load_tree(..., lazy=True) whose contents are decoded on first
+    access. It pickles as a plain Obj."""
+
+    def __init__(self, kel, load_contents, ker):
+        self.kel = kel
+        self.ker = ker
+        self._load_contents = load_contents
+        self._contents = None
+
+    @property
+    def contents(self):
+        if self._load_contents is not None:
+            self._contents = Contents(self._load_contents()[0])
+            self._load_contents = None
+        return self._contents
+
+    @contents.setter
+    def contents(self, value):
+        ContainerMixin.contents.fset(self, value)
+        self._load_contents = None
+
+    def __reduce__(self):
+        return Obj, (self._kel, self.contents, self._ker)
+
+
 class SimpleTokenizer:
     specs = [
         ('Comment', (r'#.*',)),
@@ -886,12 +1458,338 @@ class FullTokenizer(SimpleTokenizer):
     t = staticmethod(make_tokenizer(specs))
 
 
+def _place(m, lines=0):
+    string = m.string
+    pos = m.start(m.lastgroup)
+    line = string.count('\n', 0, pos) + 1
+    col = pos - string.rfind('\n', 0, pos)
+    return lines + line, col
+
+
+class SimpleScanner:
+    """Single-pass replacement for SimpleTokenizer plus the funcparserlib
+    grammar of SimpleParser. The tokenizer specs are folded into one
+    alternation, tried in the same order, and the tree is built as the
+    tokens come in, so the result is identical to the combinator parse."""
+
+    token_re = re.compile(r'''
+        (?:\#.*|\s+)*
+        (?:
+        (?P<kel>\{) |
+        (?P<ker>\}) |
+        (?P<op>[<=>]=?) |
+        "(?P<string>(?s:.*?)(?<!\\))" |
+        (?P<date>-?\d*\.\d*\.\d*(?![^\s"\#<=>{}])) |
+        (?P<number>[-+]?\d+(?:\.\d+)?(?![^\s"\#<=>{}])) |
+        (?P<name>[^\s"\#<=>{}]+) |
+        (?P<error>(?s:.)) |
+        \Z)
+        ''', re.VERBOSE)
+    leaves = {'date': SimpleDate, 'number': SimpleNumber, 'name': SimpleString,
+              'string': SimpleString}
+
+    def __init__(self, strict=True):
+        self.strict = strict
+
+    def tokens(self, chunks):
+        """tokenize an iterable of text chunks, which may split the text
+        anywhere. Only matches ending before the last newline of the buffer
+        are final: anything after it may still grow (or, for an unterminated
+        string, stop being an error) once the next chunk arrives."""
+        # whitespace (and in SimpleScanner comments) is skipped by the regex
+        # itself; the empty match at the end has no lastgroup
+        buf = ''
+        pos = 0
+        lines = 0
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is None:
+                limit = len(buf) + 1
+            else:
+                buf += chunk
+                limit = buf.rfind('\n') + 1
+            for m in self.token_re.finditer(buf, pos):
+                if m.end() >= limit:
+                    break
+                kind = m.lastgroup
+                if kind is not None:
+                    if kind == 'error':
+                        if chunk is not None and m.group(kind) == '"':
+                            break
+                        line, col = _place(m, lines)
+                        raise LexerError((line, col),
+                                         buf.splitlines()[line - lines - 1])
+                    yield kind, m.group(kind), m, lines
+                pos = m.end()
+            # keep the buffer starting at a line start for error positions
+            cut = buf.rfind('\n', 0, pos) + 1
+            lines += buf.count('\n', 0, cut)
+            buf = buf[cut:]
+            pos -= cut
+
+    @staticmethod
+    def unexpected(tok):
+        if tok is None:
+            return NoParseError('got unexpected end of file', None)
+        kind, val, m, lines = tok
+        return NoParseError('got unexpected token: {} {!r} at {},{}'.format(
+                            kind, val, *_place(m, lines)), None)
+
+    def parse(self, string):
+        return TopLevel(list(self.iter_pairs([string])))
+
+    @staticmethod
+    def drain(tokens):
+        # funcparserlib tokenizes everything before parsing, so a lexer error
+        # anywhere in the input takes precedence over a parse error
+        for _ in tokens:
+            pass
+
+    def iter_pairs(self, chunks):
+        leaves = self.leaves
+        tokens = self.tokens(chunks)
+        try:
+            for tok in tokens:
+                if tok[0] not in leaves:
+                    raise self.unexpected(tok)
+                key = leaves[tok[0]](tok[1])
+                tok = next(tokens, None)
+                if tok is None or tok[0] != 'op':
+                    raise self.unexpected(tok)
+                yield Pair(key, simple_op(tok[1]), self.value(tokens))
+        except (NoParseError, ValueError):
+            self.drain(tokens)
+            raise
+
+    def value(self, tokens):
+        tok = next(tokens, None)
+        if tok is not None:
+            if tok[0] == 'kel':
+                return self.obj(tokens)
+            if tok[0] in self.leaves:
+                return self.leaves[tok[0]](tok[1])
+        raise self.unexpected(tok)
+
+    def obj(self, tokens):
+        leaves = self.leaves
+        kel = simple_op('{')
+        contents = []
+        tok = next(tokens, None)
+        while tok is not None:
+            kind, val = tok[0], tok[1]
+            if kind == 'ker':
+                return Obj(kel, contents, simple_op(val))
+            if kind not in leaves:
+                raise self.unexpected(tok)
+            key = leaves[kind](val)
+            tok = next(tokens, None)
+            if tok is not None and tok[0] == 'op':
+                contents.append(Pair(key, simple_op(tok[1]),
+                                     self.value(tokens)))
+                tok = next(tokens, None)
+            else:
+                contents.append(key)
+        if self.strict:
+            raise self.unexpected(tok)
+        return Obj(kel, contents, simple_op('}'))
+
+
+class _Lookahead:
+    """one-token lookahead over FullScanner tokens, holding the comments
+    read while looking for the next significant token"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.tok = next(tokens, None)
+        self.comments = []
+
+    def significant(self):
+        tok = self.tok
+        while tok is not None and tok[0] in ('newline', 'comment'):
+            if tok[0] == 'comment':
+                self.comments.append(tok[1])
+            tok = self.tok = next(self.tokens, None)
+        return tok
+
+    def take(self):
+        pre_comments, self.comments = self.comments, []
+        val = self.tok[1]
+        tok = self.tok = next(self.tokens, None)
+        post_comment = None
+        if tok is not None and tok[0] == 'comment':
+            post_comment = tok[1]
+            self.tok = next(self.tokens, None)
+        return pre_comments, val, post_comment
+
+
+class FullScanner(SimpleScanner):
+    """Single-pass replacement for FullTokenizer plus the funcparserlib
+    grammar of FullParser"""
+
+    token_re = re.compile(r'''
+        [ \t]*
+        (?:
+        (?P<comment>\#(?:.*\S)?) |
+        (?P<newline>\r?\n) |
+        (?P<kel>\{) |
+        (?P<ker>\}) |
+        (?P<op>[<=>]=?) |
+        (?P<date>-?\d*\.\d*\.\d*) |
+        (?P<number>[-+]?\d+(?:\.\d+)?(?!\w)) |
+        "(?P<quoted_string>(?s:.*?))" |
+        (?P<unquoted_string>[^\s"\#<=>{}]+) |
+        (?P<error>(?s:.)) |
+        \Z)
+        ''', re.VERBOSE)
+    leaves = {'unquoted_string': String, 'date': Date, 'number': Number,
+              'quoted_string': String}
+
+    def parse(self, string):
+        post_comments = []
+        contents = list(self.iter_pairs([string], post_comments))
+        return TopLevel(contents, post_comments)
+
+    def iter_pairs(self, chunks, post_comments=None):
+        ts = _Lookahead(self.tokens(chunks))
+        try:
+            while True:
+                tok = ts.significant()
+                if tok is None:
+                    break
+                if tok[0] not in self.leaves:
+                    raise self.unexpected(tok)
+                key = self.leaves[tok[0]](*ts.take())
+                tok = ts.significant()
+                if tok is None or tok[0] != 'op':
+                    raise self.unexpected(tok)
+                yield Pair(key, Op(*ts.take()), self.value(ts))
+        except (NoParseError, ValueError):
+            self.drain(ts.tokens)
+            raise
+        if post_comments is not None:
+            post_comments.extend(ts.comments)
+
+    def value(self, ts):
+        tok = ts.significant()
+        if tok is not None:
+            if tok[0] == 'kel':
+                return self.obj(ts)
+            if tok[0] in self.leaves:
+                return self.leaves[tok[0]](*ts.take())
+        raise self.unexpected(tok)
+
+    def obj(self, ts):
+        leaves = self.leaves
+        kel = Op(*ts.take())
+        contents = []
+        while True:
+            tok = ts.significant()
+            if tok is None:
+                # the grammar's "end" alternative doesn't consume comments
+                if self.strict or ts.comments:
+                    raise self.unexpected(tok)
+                return Obj(kel, contents)
+            kind = tok[0]
+            if kind == 'ker':
+                return Obj(kel, contents, Op(*ts.take()))
+            if kind == 'kel':
+                contents.append(self.obj(ts))
+            elif kind in leaves:
+                key = leaves[kind](*ts.take())
+                tok = ts.significant()
+                if tok is not None and tok[0] == 'op':
+                    contents.append(Pair(key, Op(*ts.take()),
+                                         self.value(ts)))
+                else:
+                    contents.append(key)
+            else:
+                raise self.unexpected(tok)
+
+
+class CacheStore:
+    """Parse trees of one parser class in a single sqlite database instead of
+    a cache file per parsed file. Entries are keyed by (path, encoding,
+    stamp, VERSION), where the stamp is the git blob of a clean tracked
+    file or else a hash of the file's contents."""
+
+    filename = 'trees.sqlite'
+    batch_size = 500
+
+    def __init__(self, dbpath):
+        self.dbpath = dbpath
+        self.db = sqlite3.connect(str(dbpath))
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS trees ('
+                        'path TEXT, encoding TEXT, stamp TEXT, '
+                        'version INTEGER, tree BLOB, '
+                        'PRIMARY KEY (path, encoding, stamp, version))')
+
+    def get_many(self, keys):
+        """return {key: serialized tree} for those keys which are stored"""
+        keys = set(keys)
+        paths = sorted({path for path, _, _ in keys})
+        found = {}
+        for i in range(0, len(paths), self.batch_size):
+            batch = paths[i:i + self.batch_size]
+            query = ('SELECT path, encoding, stamp, tree FROM trees '
+                     'WHERE version = ? AND path IN ({})'.format(
+                     ', '.join('?' * len(batch))))
+            for path, encoding, stamp, blob in self.db.execute(
+                    query, [VERSION] + batch):
+                if (path, encoding, stamp) in keys:
+                    found[path, encoding, stamp] = blob
+        return found
+
+    def put(self, key, data):
+        self.db.execute('INSERT OR REPLACE INTO trees VALUES (?, ?, ?, ?, ?)',
+                        key + (VERSION, data))
+
+    def commit(self):
+        self.db.commit()
+
+    def gc(self):
+        """drop entries from other VERSIONs, for files that no longer exist,
+        and all but the latest entry per (path, encoding), then compact the
+        database; returns (removed, kept)"""
+        count = lambda: self.db.execute(
+            'SELECT COUNT(*) FROM trees').fetchone()[0]
+        before = count()
+        with self.db:
+            self.db.execute('DELETE FROM trees WHERE version != ?', (VERSION,))
+            self.db.execute('DELETE FROM trees WHERE rowid NOT IN '
+                            '(SELECT MAX(rowid) FROM trees '
+                            'GROUP BY path, encoding)')
+            gone = [(path,) for path, in
+                    self.db.execute('SELECT DISTINCT path FROM trees')
+                    if not os.path.exists(path)]
+            self.db.executemany('DELETE FROM trees WHERE path = ?', gone)
+        self.db.execute('VACUUM')
+        after = count()
+        return before - after, after
+
+
+_worker_parser = None
+
+def _init_worker(parser):
+    global _worker_parser
+    parser.ignore_cache = True # also keeps __del__ quiet
+    _worker_parser = parser
+
+def _parse_in_worker(path, encoding, errors, cachepath):
+    return _worker_parser.parse_path(path, encoding, errors, cachepath)
+
+
 class SimpleParser:
     tokenizer = SimpleTokenizer
+    scanner = SimpleScanner
+    engines = ['scanner', 'funcparserlib']
     repos = {}
 
-    def __init__(self, *moddirs, strict=True):
+    def __init__(self, *moddirs, strict=True, engine='scanner'):
+        if engine not in self.engines:
+            raise ValueError('unknown parser engine {!r}'.format(engine))
         self.moddirs = list(moddirs)
+        self.engine = engine
         self.basedir = vanilladir
         self.strict = strict
         self.cache_hits = 0
@@ -899,6 +1797,7 @@ class SimpleParser:
         self.parse_tree_cache = {}
         self.memcache_default = False
         self.diskcache_default = True
+        self.workers_default = 1
         self.tab_indents = True
         self.indent_width = 8 # minimum 2
         self.chars_per_line = 125
@@ -910,9 +1809,32 @@ class SimpleParser:
         self.encoding = 'cp1252'
         self.ignore_cache = False
         self.vanilla_is_repo = True
+        self.cache_backend = 'files' # or 'sqlite', for a CacheStore
+        self.cache_format = 'pickle' # or 'flat', see dump_tree
+        self.lazy_load = False # flat cache hits load as LazyObj trees
+        self._cachestore = None
         self.cachedir = cachedir / self.__class__.__name__
         self.cachedir.mkdir(parents=True, exist_ok=True)
         self.setup_parser()
+        self.scan = self.scanner(strict)
+
+    def __getstate__(self):
+        """the parser's settings, without the compiled grammar, the scanner
+        and the caches, which are rebuilt on unpickling. This is how
+        parse_paths hands the parser to its worker processes, so every
+        setting carries over, such as strict, engine and cache_format, as do
+        attributes set by subclasses."""
+        state = self.__dict__.copy()
+        for name in ['toplevel', 'scan', 'parse_tree_cache', '_cachestore']:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.parse_tree_cache = {}
+        self._cachestore = None
+        self.setup_parser()
+        self.scan = self.scanner(self.strict)
 
     def __del__(self):
         if not self.ignore_cache:
@@ -924,13 +1846,13 @@ class SimpleParser:
         unarg = lambda f: lambda x: f(*x)
         tokval = lambda x: x.value
         toktype = lambda t: some(lambda x: x.type == t) >> tokval
-        kel = a(Token('Brace', '{')) >> tokval >> Op
-        ker = a(Token('Brace', '}')) >> tokval >> Op
-        op = toktype('Op') >> Op
-        number = toktype('Number') >> Number
-        date = toktype('Date') >> Date
-        name = toktype('Name') >> String
-        string = toktype('String') >> (lambda s: s[1:-1]) >> String
+        kel = a(Token('Brace', '{')) >> tokval >> simple_op
+        ker = a(Token('Brace', '}')) >> tokval >> simple_op
+        op = toktype('Op') >> simple_op
+        number = toktype('Number') >> SimpleNumber
+        date = toktype('Date') >> SimpleDate
+        name = toktype('Name') >> SimpleString
+        string = toktype('String') >> (lambda s: s[1:-1]) >> SimpleString
         key = date | number | name | string
         pair = forward_decl()
         if self.strict:
@@ -958,15 +1880,13 @@ class SimpleParser:
             if bad_repo_path != None:
                 del self.repos[bad_repo_path]
 
-    def get_cachepath(self, path, encoding):
-        m = hashlib.md5()
-        m.update(encoding.encode())
-        m.update(bytes(path))
-        cachedir = self.cachedir
-        name = m.hexdigest()
+    def get_blob(self, path):
+        """return (repo_path, blob) where blob is the hash git has indexed for
+        path, or None if path is untracked or modified; repo_path is None if
+        path isn't in a git repo"""
         if not self.vanilla_is_repo and vanilladir in path.parents:
-            return self.cachedir / 'vanilla' / name, False
-        for repo_path, (latest_commit, dirty_paths) in self.repos.items():
+            return None, None
+        for repo_path, blobs in self.repos.items():
             if repo_path in path.parents:
                 break
         else:
@@ -983,45 +1903,54 @@ class SimpleParser:
             if no_git:
                 if self.vanilla_is_repo and vanilladir in path.parents:
                     self.vanilla_is_repo = False
-                    return self.cachedir / 'vanilla' / name, False
-                return self.cachedir / name, False
+                return None, None
             repo_path = pathlib.Path(repo.working_tree_dir)
-            tracked_files = set(repo.git.ls_files(z=True).split('\x00')[:-1])
-            latest_commit = {}
-            log_output = repo.git.log('.', m=True, pretty='format:%h', z=True,
-                                      name_only=True)
-            log_iter = iter(log_output.split('\x00'))
-            for entry in log_iter:
-                try:
-                    commit, file_str = entry.split('\n', maxsplit=1)
-                except ValueError:
-                    continue
-                while file_str:
-                    try:
-                        tracked_files.remove(file_str)
-                        latest_commit[file_str] = commit
-                    except KeyError:
-                        pass
-                    file_str = next(log_iter)
-                if not tracked_files:
-                    break
-            dirty_paths = []
-            status_output = repo.git.status(z=True)
-            status_iter = iter(status_output.split('\x00')[:-1])
-            for entry in status_iter:
-                dirty_paths.append(pathlib.Path(entry[3:]))
-                if entry[0] == 'R':
-                    next(status_iter)
-            self.repos[repo_path] = latest_commit, dirty_paths
-            print('Repo {} processed in {:g} s'.format(
+            # the index already has a blob hash for every tracked file, so
+            # unlike the last commit per file this needs no history walk
+            blobs = {}
+            for entry in repo.git.ls_files(s=True, z=True).split('\x00')[:-1]:
+                info, file_str = entry.split('\t', maxsplit=1)
+                _, blob, stage = info.split()
+                if stage == '0':
+                    blobs[file_str] = blob
+            # files differing from the index, also dropping unmerged ones
+            for file_str in repo.git.diff(name_only=True, z=True).split('\x00'):
+                blobs.pop(file_str, None)
+            self.repos[repo_path] = blobs
+            print('Repo {} indexed in {:g} s'.format(
                   repo_path.name, time.time() - repo_init_start),
                   file=sys.stderr)
+        return repo_path, blobs.get(path.relative_to(repo_path).as_posix())
+
+    def get_cachepath(self, path, encoding):
+        m = hashlib.md5()
+        m.update(encoding.encode())
+        m.update(bytes(path))
+        name = m.hexdigest()
+        repo_path, blob = self.get_blob(path)
+        if repo_path is None:
+            if vanilladir in path.parents:
+                return self.cachedir / 'vanilla' / name, False
+            return self.cachedir / name, False
         repo_cachedir = self.cachedir / repo_path.name
-        path = path.relative_to(repo_path)
-        if not any(p == path or p in path.parents for p in dirty_paths):
-            return repo_cachedir / latest_commit[str(path)] / name, True
+        if blob is not None:
+            return repo_cachedir / blob[:2] / (blob[2:] + '-' + name), True
         return repo_cachedir / name, False
 
+    def get_cachekey(self, path, encoding):
+        """key of path in the CacheStore: the git blob of a clean tracked file
+        stands in for its contents, anything else is hashed"""
+        _, stamp = self.get_blob(path)
+        if stamp is None:
+            stamp = hashlib.md5(path.read_bytes()).hexdigest()
+        return str(path), encoding, stamp
+
+    @property
+    def cachestore(self):
+        if self._cachestore is None:
+            self._cachestore = CacheStore(self.cachedir / CacheStore.filename)
+        return self._cachestore
+
     def files(self, glob, reverse=False):
         yield from files(glob, self.moddirs, basedir=self.basedir,
                          reverse=reverse)
@@ -1030,21 +1959,94 @@ class SimpleParser:
         return next(self.files(*args, **kwargs))
 
     def merge_parse(self, glob, basedir=None, moddirs=None, **kwargs):
-        """parse files, merge all top level items into one dictionary and return the items of that dictionary"""
+        """parse files, merge all top level items into one dictionary and return the items of that dictionary
+
+        >>> parser = SimpleParser()
+        >>> parser.parse_files = lambda *args, **kwargs: [
+        ...     (None, parser.parse('a = 1 b = 2 c = 3 a = 4'))]
+        >>> [(k, v.val) for k, v in parser.merge_parse('*')]
+        [('b', 2), ('c', 3), ('a', 1)]
+        """
         dictionary = {}
         for filename, tree in self.parse_files(glob, basedir, moddirs, **kwargs):
             dictionary.update(reversed(tree.dictionary.items()))
 
         return dictionary.items()
 
-    def parse_files(self, glob, basedir=None, moddirs=None, **kwargs):
+    def parse_files(self, glob, basedir=None, moddirs=None, workers=None,
+                    **kwargs):
+        """parse the files matching glob, yielding (path, tree) in files()
+        order. With workers > 1, cache misses are parsed in a pool of that
+        many processes; on platforms that spawn rather than fork, the calling
+        script then needs an if __name__ == '__main__' guard."""
         if moddirs is None:
             moddirs = self.moddirs
         if basedir is None:
             basedir = self.basedir
-        for path in files(glob, moddirs, basedir=basedir):
-            if path.is_file():
-                yield path.resolve(), self.parse_file(path, **kwargs)
+        if workers is None:
+            workers = self.workers_default
+        paths = (path for path in files(glob, moddirs, basedir=basedir)
+                 if path.is_file())
+        if workers > 1 or self.cache_backend == 'sqlite':
+            yield from self.parse_paths(paths, workers, **kwargs)
+            return
+        for path in paths:
+            yield path.resolve(), self.parse_file(path, **kwargs)
+
+    def parse_paths(self, paths, workers=1, encoding=None, errors='replace',
+                    memcache=None, diskcache=None):
+        """parse_file over many paths, with the cache lookups batched and the
+        misses optionally parsed in a process pool. Each worker gets a copy
+        of this parser as it is configured when the pool starts (see
+        __getstate__), but not its memory cache."""
+        if memcache is None:
+            memcache = self.memcache_default
+        if diskcache is None:
+            diskcache = self.diskcache_default
+        if encoding is None:
+            encoding = self.encoding
+        ignore_cache = (self.ignore_cache or errors != 'replace')
+        paths = [path.resolve() for path in paths]
+        if ignore_cache:
+            found = [(None, None)] * len(paths)
+        else:
+            found = self.cached_trees(paths, encoding, memcache)
+        pool = None
+        if workers > 1:
+            pool = concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_worker, initargs=(self,))
+        try:
+            jobs = []
+            for path, (tree, cachekey) in zip(paths, found):
+                if not diskcache:
+                    cachekey = None
+                if tree is None and pool is not None:
+                    # workers write pickle files themselves, but only this
+                    # process writes to the sqlite store
+                    tree = pool.submit(_parse_in_worker, path, encoding,
+                                       errors, cachekey if self.cache_backend
+                                       == 'files' else None)
+                    if self.cache_backend == 'files':
+                        cachekey = None
+                jobs.append((path, tree, cachekey))
+            for path, tree, cachekey in jobs:
+                if tree is None:
+                    tree = self.parse_path(path, encoding, errors, cachekey)
+                elif isinstance(tree, concurrent.futures.Future):
+                    tree = tree.result()
+                    if cachekey is not None:
+                        self.write_cache(cachekey, tree)
+                else:
+                    yield path, tree
+                    continue
+                if not ignore_cache and memcache:
+                    self.parse_tree_cache[path] = tree
+                yield path, tree
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            if self._cachestore is not None:
+                self._cachestore.commit()
 
     def parse_file(self, path, encoding=None, errors='replace',
                    memcache=None, diskcache=None):
@@ -1060,50 +2062,142 @@ class SimpleParser:
         if encoding is None:
             encoding = self.encoding
         ignore_cache = (self.ignore_cache or errors != 'replace')
-        if not ignore_cache:
+        if ignore_cache:
+            return self.parse_path(path, encoding, errors)
+        tree, cachekey = self.cached_trees([path], encoding, memcache)[0]
+        if tree is None:
+            tree = self.parse_path(path, encoding, errors,
+                                   cachekey if diskcache else None)
+            if self._cachestore is not None:
+                self._cachestore.commit()
+            if memcache:
+                self.parse_tree_cache[path] = tree
+        return tree
+
+    def cached_trees(self, paths, encoding, memcache):
+        """look up resolved paths in the memory and disk caches, returning a
+        (tree, cachekey) for each; tree is None on a miss, and cachekey is
+        where the parse should be stored"""
+        results = [None] * len(paths)
+        keys = {}
+        for i, path in enumerate(paths):
             if path in self.parse_tree_cache:
-                return self.parse_tree_cache[path]
-            cachepath, is_indexed = self.get_cachepath(path, encoding)
-            try:
-                if cachepath.exists() and (is_indexed or
-                                           (os.path.getmtime(str(cachepath)) >=
-                                            os.path.getmtime(str(path)))):
-                    with cachepath.open('rb') as f:
-                        tree = pickle.load(f)
-                        if tree.version == VERSION:
-                            if memcache:
-                                self.parse_tree_cache[path] = tree
-                            self.cache_hits += 1
-                            return tree
-            except AttributeError:
-                pass
-            except (pickle.PickleError, EOFError, ImportError, IndexError):
-                print('Error retrieving cache for {}'.format(path),
-                      file=sys.stderr)
-                traceback.print_exc()
-                pass
-            self.cache_misses += 1
+                results[i] = self.parse_tree_cache[path], None
+            elif self.cache_backend == 'sqlite':
+                keys[i] = self.get_cachekey(path, encoding)
+            else:
+                results[i] = self.cached_tree(path, encoding, memcache)
+        if keys:
+            blobs = self.cachestore.get_many(keys.values())
+            for i, key in keys.items():
+                tree = None
+                if key in blobs:
+                    try:
+                        tree = self.load_cached(blobs[key])
+                    except (pickle.PickleError, EOFError, ImportError,
+                            IndexError, AttributeError, ValueError):
+                        print('Error retrieving cache for {}'.format(
+                              paths[i]), file=sys.stderr)
+                        traceback.print_exc()
+                if tree is None:
+                    self.cache_misses += 1
+                else:
+                    if memcache:
+                        self.parse_tree_cache[paths[i]] = tree
+                    self.cache_hits += 1
+                results[i] = tree, key
+        return results
+
+    def cached_tree(self, path, encoding, memcache):
+        cachepath, is_indexed = self.get_cachepath(path, encoding)
+        try:
+            if cachepath.exists() and (is_indexed or
+                                       (os.path.getmtime(str(cachepath)) >=
+                                        os.path.getmtime(str(path)))):
+                tree = self.load_cached(cachepath.read_bytes())
+                if tree is not None:
+                    if memcache:
+                        self.parse_tree_cache[path] = tree
+                    self.cache_hits += 1
+                    return tree, cachepath
+        except AttributeError:
+            pass
+        except (pickle.PickleError, EOFError, ImportError, IndexError,
+                ValueError):
+            print('Error retrieving cache for {}'.format(path),
+                  file=sys.stderr)
+            traceback.print_exc()
+            pass
+        self.cache_misses += 1
+        return None, cachepath
+
+    def load_cached(self, data):
+        """tree from cached data in either format, None if it is stale"""
+        if data[:len(TREE_MAGIC)] == TREE_MAGIC:
+            return load_tree(data, self.lazy_load)
+        tree = pickle.loads(data)
+        return tree if tree.version == VERSION else None
+
+    def write_cache(self, cachekey, tree):
+        if self.cache_format == 'flat':
+            data = dump_tree(tree)
+        else:
+            tree.version = VERSION
+            data = pickle.dumps(tree)
+        if isinstance(cachekey, tuple):
+            self.cachestore.put(cachekey, data)
+        else:
+            cachekey.parent.mkdir(parents=True, exist_ok=True)
+            # possible todo: put this i/o in another thread
+            cachekey.write_bytes(data)
+
+    def parse_path(self, path, encoding, errors, cachepath=None):
+        """parse a resolved path, writing the result to the cache if given a
+        cachepath or CacheStore key"""
         with path.open(encoding=encoding, errors=errors) as f:
             try:
                 data = f.read()
                 if path.name == 'zzz_WoC_Shared_Horde_Missions.txt':
                     data = data.replace('create_general_with_pips {', 'create_general_with_pips = {')
                 tree = self.parse(data)
-                if not ignore_cache:
-                    if diskcache:
-                        cachepath.parent.mkdir(parents=True, exist_ok=True)
-                        # possible todo: put this i/o in another thread
-                        with cachepath.open('wb') as f:
-                            tree.version = VERSION
-                            pickle.dump(tree, f)
-                    if memcache:
-                        self.parse_tree_cache[path] = tree
+                if cachepath is not None:
+                    self.write_cache(cachepath, tree)
                 return tree
             except:
                 print(path, file=sys.stderr)
                 raise
 
+    def iter_pairs(self, path, encoding=None, errors='replace',
+                   chunk_size=1 << 16):
+        """yield the top-level pairs of a file one at a time, each as soon as
+        it has been read, without building the whole tree. The disk cache is
+        neither read nor written; use parse_file for files that are parsed
+        on every run."""
+        try:
+            path = path.resolve()
+        except AttributeError:
+            path = self.file(path).resolve()
+        if path in self.parse_tree_cache:
+            yield from self.parse_tree_cache[path]
+            return
+        if encoding is None:
+            encoding = self.encoding
+        if (self.engine != 'scanner' or
+            path.name == 'zzz_WoC_Shared_Horde_Missions.txt'):
+            yield from self.parse_file(path, encoding, errors,
+                                       memcache=False, diskcache=False)
+            return
+        with path.open(encoding=encoding, errors=errors) as f:
+            try:
+                yield from self.scan.iter_pairs(
+                    iter(functools.partial(f.read, chunk_size), ''))
+            except (NoParseError, LexerError):
+                print(path, file=sys.stderr)
+                raise
+
     def parse(self, string):
+        if self.engine == 'scanner':
+            return self.scan.parse(string)
         tokens = list(self.tokenizer.tokenize(string))
         tree = self.toplevel.parse(tokens)
         return tree
@@ -1113,13 +2207,14 @@ class SimpleParser:
         try:
             with path.open('w', encoding=self.encoding,
                            newline=('\r\n' if self.crlf else '\n')) as f:
-                f.write(tree.str(self))
+                f.writelines(tree.iter_str(self))
         except:
             print(path)
             raise
 
 class FullParser(SimpleParser):
     tokenizer = FullTokenizer
+    scanner = FullScanner
 
     def setup_parser(self):
         unarg = lambda f: lambda x: f(*x)
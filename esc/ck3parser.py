@@ -17,6 +17,8 @@ from funcparserlib.lexer import make_tokenizer, Token
 from funcparserlib.parser import (some, a, maybe, many, finished, skip,
                                   oneplus, forward_decl, NoParseError)
 from localpaths import rootpath, ck3dir, ck3cachedir
+import vfs
+from locindex import compile_index, yml_entries
 
 try:
     import git
@@ -48,11 +50,7 @@ def csv_rows(path, linenum=False, comments=False):
 # give mod dirs in descending lexicographical order of mod name (Z-A),
 # modified for dependencies as necessary.
 def files(glob, moddirs=(), basedir=ck3dir, reverse=False):
-    result_paths = {p.relative_to(d): p
-                    for d in (basedir,) + tuple(moddirs) for p in d.glob(glob)}
-    for _, p in sorted(result_paths.items(), key=lambda t: t[0].parts,
-                       reverse=reverse):
-        yield p
+    yield from vfs.shared(basedir, *moddirs).glob(glob, reverse)
 
 # def get_cultures(parser, groups=True):
 #     cultures = []
@@ -112,15 +110,11 @@ def files(glob, moddirs=(), basedir=ck3dir, reverse=False):
 #                 locs[row[0]] = row[1]
 #     return locs
 
+# read-only and compiled into ck3cachedir; the last value of a key wins
 def localization():
-    localization_dict = {}
-    for path in (ck3dir / 'localization').glob('*_l_english.yml'):
-        with path.open(encoding='utf-8-sig') as f:
-            for line in f:
-                match = re.fullmatch(r'\s*([^#\s:]+):\d?\s*"(.*)"[^"]*', line)
-                if match:
-                    localization_dict[match.group(1)] = match.group(2)
-    return localization_dict
+    sources = sorted((ck3dir / 'localization').glob('*_l_english.yml'))
+    return compile_index(ck3cachedir / 'locindex' / 'ck3-english', sources,
+                         yml_entries, first_wins=False)
 
 def static_values(parser):
     static_values_dict = {}
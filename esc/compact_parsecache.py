@@ -0,0 +1,17 @@
+#!/usr/bin/env python3
+
+# drop stale entries from the sqlite parse caches (SimpleParser with
+# cache_backend = 'sqlite') and compact them
+
+from ck2parser import cachedir, CacheStore
+from print_time import print_time
+
+@print_time
+def main():
+    for dbpath in sorted(cachedir.glob('*/' + CacheStore.filename)):
+        removed, kept = CacheStore(dbpath).gc()
+        print('{}: removed {} entries, kept {}'.format(dbpath.parent.name,
+                                                       removed, kept))
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,9 @@ import PIL
 import PIL.Image
 import tabulate
 import ck2parser
+import provincemap
+import raster
+import timeline
 
 rootpath = ck2parser.rootpath
 
@@ -114,11 +117,11 @@ class Title:
 
     def __init__(self, codename):
         self.codename = codename
-        self.lieges = {}
+        self.lieges = timeline.Changes()
         self.vassal_intvls = collections.defaultdict(list)
-        self.builts = {}
-        self.cultures = {}
-        self.religions = {}
+        self.builts = timeline.Changes()
+        self.cultures = timeline.Changes()
+        self.religions = timeline.Changes()
         self.name = localisation.get(codename, codename)
         self.other_names = []
         self.neighbors = []
@@ -149,11 +152,7 @@ class Title:
         self.builts[from_when] = False
 
     def built(self, when=EARLIEST_DATE):
-        try:
-            return self.builts[max(date for date in self.builts if
-                                   date <= when)]
-        except ValueError:
-            return False
+        return self.builts.at(when, False)
 
     def built_holdings(self, when=EARLIEST_DATE):
         return (t for t in self.vassals(when) if t.built(when))
@@ -169,31 +168,22 @@ class Title:
                          from_when in intvl)
             intvl.stop = from_when
         self.lieges[from_when] = liege
-        to_when = min((date for date in self.lieges if date > from_when),
-                      default=LATEST_DATE)
+        to_when = self.lieges.next_date(from_when, LATEST_DATE)
         if liege is not None:
             liege.vassal_intvls[self].append(Interval(from_when, to_when))
 
     def liege(self, when=EARLIEST_DATE):
-        try:
-            return self.lieges[max(date for date in self.lieges if
-                                   date <= when)]
-        except ValueError:
-            return None
+        return self.lieges.at(when)
 
     def culture(self, when=EARLIEST_DATE):
-        try:
-            culture = self.cultures[max(date for date in self.cultures if
-                                    date <= when)]
-        except ValueError:
+        culture = self.cultures.at(when)
+        if culture is None:
             return None
         return localisation.get(culture, culture)
 
     def religion(self, when=EARLIEST_DATE):
-        try:
-            religion = self.religions[max(date for date in self.religions if
-                                      date <= when)]
-        except ValueError:
+        religion = self.religions.at(when)
+        if religion is None:
             return None
         return localisation.get(religion, religion)
 
@@ -376,24 +366,16 @@ def process_map_definitions_row(row):
         Title.id_name_map[province] = row[4]
 
 # pre: process map definitions
-def parse_map_provinces(path):
-    def province_id(rgb):
-        return Title.rgb_id_map.get(tuple(rgb), 0)
-
-    image = PIL.Image.open(str(path))
-    image = numpy.array(image)
-    for i, j in numpy.ndindex(image.shape[0] - 1, image.shape[1] - 1):
-        province = province_id(image[i, j])
-        if province != 0:
-            neighbor_x = province_id(image[i, j + 1])
-            neighbor_y = province_id(image[i + 1, j])
-            for neighbor in [neighbor_x, neighbor_y]:
-                if neighbor != province and neighbor != 0:
-                    Title.province_graph.add_edge(province, neighbor)
+def parse_map_provinces():
+    province_map = provincemap.ProvinceMap(parser)
+    # pairs are ordered, so province 0 can only come first
+    Title.province_graph.add_edges_from(
+        (province, neighbor) for province, neighbor in
+        raster.adjacent_pairs(province_map.ids).tolist() if province != 0)
     seas_lakes = Title.province_graph.subgraph(Title.waters - Title.rivers)
     Title.seas = {x for x in seas_lakes if seas_lakes[x]}
 
-def generate_province_map(in_path, out_dir, value):
+def generate_province_maps(out_dir, values):
     COLORMAP = {1: numpy.uint8((247, 252, 245)),
                 2: numpy.uint8((219, 241, 213)),
                 3: numpy.uint8((173, 222, 167)),
@@ -401,109 +383,105 @@ def generate_province_map(in_path, out_dir, value):
                 5: numpy.uint8((55, 160, 85)),
                 6: numpy.uint8((11, 119, 52)),
                 7: numpy.uint8((0, 68, 27))}
-    wasteland_color = numpy.uint8((36, 36, 36))
-    water_color = numpy.uint8((51, 67, 85))
-
-    rgb_map = {}
-    border = True
     start = 1066, 9, 15
-    in_image = PIL.Image.open(str(in_path))
-    array = numpy.array(in_image)
 
-    def province_color(rgb):
-        rgb_t = tuple(rgb)
-        try:
-            return rgb_map[rgb_t]
-        except KeyError:
-            try:
-                province = Title.rgb_id_map[rgb_t]
-                if province in Title.waters:
-                    color = water_color
-                else:
-                    title = Title.id_title_map[province]
-                    v = max(vmin, min(title_value(title), vmax))
-                    color = numpy.uint8(colormap.to_rgba(v, bytes=True)[:3])
-            except KeyError:
-                if rgb_t == (255, 255, 255):
-                    color = water_color
-                else:
-                    color = wasteland_color
-            rgb_map[rgb_t] = color
-            return color
-
-    def count_province_area(rgb):
-        try:
-            prov_area[Title.id_title_map[Title.rgb_id_map[tuple(rgb)]]] += 1
-        except KeyError:
-            pass
-        return 0
-
-    if value == 'max_settlements':
-        title_value = lambda title: title.max_holdings
-        vmin, vmax = 1, 7
-    elif value == 'defined_baronies':
-        title_value = lambda title: sum(1 for t in title.vassals(start))
-        vmin, vmax = 1, 7
-    elif value == 'defined_baronies_minus_max_settlements':
-        title_value = lambda title: (
-            sum(1 for t in title.vassals(start)) - title.max_holdings)
-        vmin, vmax = 0, 6
-    elif value == '1066_built_holdings':
-        title_value = lambda title: (
-            sum(1 for t in title.built_holdings(start)))
-        vmin, vmax = 1, 7
-    elif value == 'max_settlements_minus_1066_built_holdings':
-        title_value = lambda title: (
-            title.max_holdings - sum(1 for t in title.built_holdings(start)))
-        vmin, vmax = 0, 6
-    elif value.endswith('divided_by_area'):
-        if not value.startswith('log_'):
-            wasteland_color = COLORMAP[1]
-            water_color = COLORMAP[1]
-        border = False
-        prov_area = collections.Counter()
-        numpy.apply_along_axis(count_province_area, 2, array)
-        if 'max_settlements' in value:
+    # every pixel gets a key into the colour tables of each map: the id of
+    # its province if that is water or a title, else one of two extra keys
+    province_map = provincemap.ProvinceMap(parser)
+    wasteland_key = province_map.size
+    white_key = province_map.size + 1
+    present = numpy.flatnonzero(province_map.counts).tolist()
+    waters = [p for p in present if p in Title.waters]
+    titles = {p: Title.id_title_map[p] for p in present
+              if p not in Title.waters and p in Title.id_title_map}
+    drawn = numpy.zeros(province_map.size + 2, bool)
+    drawn[waters + list(titles)] = True
+    color_keys = raster.color_ids(province_map.colors,
+                                  province_map.rgb_id_map,
+                                  missing=wasteland_key, dtype=numpy.int32)
+    undrawn = ~drawn[color_keys]
+    color_keys[undrawn] = wasteland_key
+    color_keys[undrawn &
+               numpy.all(province_map.colors == 255, axis=1)] = white_key
+    keys = color_keys[province_map.color_index]
+    prov_area = {t: int(province_map.counts[p]) for p, t in titles.items()}
+    borders = PIL.Image.open(str(borders_path)) if borders_path else None
+
+    for value in values:
+        wasteland_color = numpy.uint8((36, 36, 36))
+        water_color = numpy.uint8((51, 67, 85))
+        border = True
+        if value == 'max_settlements':
+            title_value = lambda title: title.max_holdings
+            vmin, vmax = 1, 7
+        elif value == 'defined_baronies':
+            title_value = lambda title: sum(1 for t in title.vassals(start))
+            vmin, vmax = 1, 7
+        elif value == 'defined_baronies_minus_max_settlements':
+            title_value = lambda title: (
+                sum(1 for t in title.vassals(start)) - title.max_holdings)
+            vmin, vmax = 0, 6
+        elif value == '1066_built_holdings':
             title_value = lambda title: (
-                title.max_holdings / prov_area[title])
-        elif '1066_built_holdings' in value:
+                sum(1 for t in title.built_holdings(start)))
+            vmin, vmax = 1, 7
+        elif value == 'max_settlements_minus_1066_built_holdings':
             title_value = lambda title: (
-                sum(1 for t in title.built_holdings(start)) / prov_area[title])
+                title.max_holdings -
+                sum(1 for t in title.built_holdings(start)))
+            vmin, vmax = 0, 6
+        elif value.endswith('divided_by_area'):
+            if not value.startswith('log_'):
+                wasteland_color = COLORMAP[1]
+                water_color = COLORMAP[1]
+            border = False
+            if 'max_settlements' in value:
+                title_value = lambda title: (
+                    title.max_holdings / prov_area[title])
+            elif '1066_built_holdings' in value:
+                title_value = lambda title: (
+                    sum(1 for t in title.built_holdings(start)) /
+                    prov_area[title])
+            else:
+                raise ValueError()
+            vmin, vmax = 0, max(title_value(t) for t in prov_area)
         else:
             raise ValueError()
-        # import pprint
-        # pprint.pprint(sorted(((t.name, title_value(t)) for t in prov_area),
-        #                      key=lambda x: -x[1])[:20])
-        vmin, vmax = 0, max(title_value(t) for t in prov_area)
-    else:
-        raise ValueError()
-
-    # width_px, height_px = in_image.size
-    # dpi = 96
-    # size = (width_px / dpi, height_px / dpi)
-    # figure = matplotlib.pyplot.figure(figsize=size, dpi=dpi, frameon=False)
-    # plot_axes = figure.add_axes([0, 0, 1, 1])
-    # plot_axes.axis('off')
-    # cmap = matplotlib.cm.get_cmap('Greens', vmax - vmin + 1)
-    cmap = matplotlib.cm.get_cmap('Greens')
-    # cmap.set_under('#242424')
-    # cmap.set_over('#334355')
-    if value.startswith('log_'):
-        vmin = min(title_value(t) for t in prov_area)
-        norm = matplotlib.colors.LogNorm(vmin, vmax)
-    else:
-        norm = matplotlib.colors.Normalize(vmin, vmax)
-    colormap = matplotlib.cm.ScalarMappable(cmap=cmap, norm=norm)
-    array = numpy.apply_along_axis(province_color, 2, array)
-    out_image = PIL.Image.fromarray(array)
-    if border and borders_path:
-        borders = PIL.Image.open(str(borders_path))
-        out_image.paste(borders, mask=borders)
-        # plot_axes.imshow(borders)
-    mod = '' if not modpaths else 'swmh_' if modpaths[0].name == 'SWMH' else 'mod_'
-    out_path = out_dir / '{}{}.png'.format(mod, value)
-    out_image.save(str(out_path))
-    # figure.savefig(str(out_path))
+
+        title_values = numpy.array([title_value(t) for t in titles.values()],
+                                   dtype=float)
+        # width_px, height_px = in_image.size
+        # dpi = 96
+        # size = (width_px / dpi, height_px / dpi)
+        # figure = matplotlib.pyplot.figure(figsize=size, dpi=dpi,
+        #                                   frameon=False)
+        # plot_axes = figure.add_axes([0, 0, 1, 1])
+        # plot_axes.axis('off')
+        # cmap = matplotlib.cm.get_cmap('Greens', vmax - vmin + 1)
+        cmap = matplotlib.cm.get_cmap('Greens')
+        # cmap.set_under('#242424')
+        # cmap.set_over('#334355')
+        if value.startswith('log_'):
+            vmin = title_values.min()
+            norm = matplotlib.colors.LogNorm(vmin, vmax)
+        else:
+            norm = matplotlib.colors.Normalize(vmin, vmax)
+        colormap = matplotlib.cm.ScalarMappable(cmap=cmap, norm=norm)
+        lut = numpy.empty((province_map.size + 2, 3), numpy.uint8)
+        lut[:] = wasteland_color
+        lut[waters + [white_key]] = water_color
+        if titles:
+            lut[list(titles)] = colormap.to_rgba(
+                numpy.clip(title_values, vmin, vmax), bytes=True)[:, :3]
+        out_image = PIL.Image.fromarray(lut[keys])
+        if border and borders:
+            out_image.paste(borders, mask=borders)
+            # plot_axes.imshow(borders)
+        mod = ('' if not modpaths else
+               'swmh_' if modpaths[0].name == 'SWMH' else 'mod_')
+        out_path = out_dir / '{}{}.png'.format(mod, value)
+        out_image.save(str(out_path))
+        # figure.savefig(str(out_path))
 
 # pre: parse_map_provinces
 def process_map_adjacencies_row(row):
@@ -799,7 +777,7 @@ def main():
     map_definitions, map_provinces, map_adjacencies = (
         process_default_map(default_map))
     parse_csv(map_definitions, process_map_definitions_row)
-    parse_map_provinces(map_provinces)
+    parse_map_provinces()
     parse_csv(map_adjacencies, process_map_adjacencies_row)
 
     # old scraps:
@@ -837,8 +815,7 @@ def main():
         '1066_built_holdings_divided_by_area',
         'log_1066_built_holdings_divided_by_area',
     ]
-    # for value in maps:
-    #     generate_province_map(map_provinces, province_map_out, value)
+    # generate_province_maps(province_map_out, maps)
 
     # import pdb;pdb.set_trace()
 
@@ -0,0 +1,240 @@
+import functools
+import hashlib
+import json
+import os
+import sys
+import sysconfig
+from ck2parser import SimpleParser
+from localpaths import eu4dir
+from eu4.paths import eu4outpath, eu4cachedir
+
+# dependency tracking for the eu4 scripts. While a Recorder is active, it
+# collects the game files which are read and the output files which are
+# written. The disk cache and the cached properties (see eu4.cache) keep the
+# files which their values were computed from, so that the cache can be
+# invalidated exactly when one of them changes, and build targets of a
+# BuildGraph are skipped as long as their inputs and outputs are unchanged.
+
+_recorders = []
+
+# stored with the recorded inputs, and bumped when what is recorded changes,
+# so that inputs recorded before are not trusted
+FORMAT = 2
+
+_game_prefix = os.path.join(os.path.abspath(eu4dir), '')
+_output_prefix = os.path.join(os.path.abspath(eu4outpath), '')
+# the standard library and installed packages, whose code isn't tracked
+_library_prefixes = tuple({
+    os.path.join(os.path.abspath(sysconfig.get_path(name)), '')
+    for name in ['stdlib', 'platstdlib', 'purelib', 'platlib']})
+
+
+class Recorder:
+    """collects the game files read and the output files written while it is
+    active, including those of nested recorders"""
+
+    def __init__(self):
+        self.paths = set()
+        self.outputs = set()
+        # sets of inputs which cached values recorded, by id
+        self.groups = {}
+
+    def __enter__(self):
+        _recorders.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _recorders.remove(self)
+
+    @property
+    def inputs(self):
+        """frozenset of the game files and code which were used, together
+        with the folders of the game files, so that new files in them count
+        as changes"""
+        paths = {path for path in map(os.path.abspath, self.paths)
+                 if path.startswith(_game_prefix)}
+        paths.update(os.path.dirname(path) for path in list(paths))
+        for group in self.groups.values():
+            paths.update(group)
+        return frozenset(paths)
+
+    @property
+    def written(self):
+        """frozenset of the output files which were written"""
+        return frozenset(path for path in map(os.path.abspath, self.outputs)
+                         if path.startswith(_output_prefix))
+
+
+def recording():
+    return bool(_recorders)
+
+
+def record_reads(paths):
+    for recorder in _recorders:
+        recorder.paths.update(map(os.fspath, paths))
+
+
+def record_inputs(inputs):
+    """add a frozenset of inputs, as returned by Recorder.inputs"""
+    for recorder in _recorders:
+        recorder.groups[id(inputs)] = inputs
+
+
+def record_output(path):
+    """record an output file which is written later, e.g. by another
+    process"""
+    for recorder in _recorders:
+        recorder.outputs.add(os.fspath(path))
+
+
+def code_inputs():
+    """frozenset of the source files of every loaded module outside the
+    standard library and installed packages, i.e. the running script, the
+    modules of this repository and pyradox. Anything computed in this
+    process may depend on any of them."""
+    paths = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if path:
+            path = os.path.abspath(path)
+            if not path.startswith(_library_prefixes):
+                paths.add(path)
+    return frozenset(paths)
+
+
+def _audit(event, args):
+    if event == 'open' and _recorders:
+        path, mode, flags = args
+        if isinstance(path, int):
+            return
+        if mode is None:
+            writing = flags & (os.O_WRONLY | os.O_RDWR)
+        else:
+            writing = any(c in mode for c in 'wax+')
+        path = os.fsdecode(path)
+        for recorder in _recorders:
+            (recorder.outputs if writing else recorder.paths).add(path)
+
+
+sys.addaudithook(_audit)
+
+
+class RecordingParser(SimpleParser):
+    """SimpleParser which records the files it parses, even if their trees
+    come from a cache"""
+
+    def cached_trees(self, paths, encoding, memcache):
+        record_reads(paths)
+        return super().cached_trees(paths, encoding, memcache)
+
+
+# digests by (path, mtime, size), so that every file is only read once
+_digests = {}
+
+
+def _digest(path, st):
+    """md5 of the contents of a file or of the names in a folder"""
+    key = path, st.st_mtime_ns, st.st_size
+    if key not in _digests:
+        if os.path.isdir(path):
+            contents = '\n'.join(sorted(os.listdir(path))).encode()
+        else:
+            with open(path, 'rb') as f:
+                contents = f.read()
+        _digests[key] = hashlib.md5(contents).hexdigest()
+    return _digests[key]
+
+
+def fingerprints(paths):
+    """dict of each path to its [mtime, size, digest], or None if it doesn't
+    exist"""
+    result = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            result[path] = [st.st_mtime_ns, st.st_size, _digest(path, st)]
+        except FileNotFoundError:
+            result[path] = None
+    return result
+
+
+def unchanged(recorded):
+    """whether the files still match a fingerprints() dict. The contents
+    are only compared if the modification time or size changed, so that
+    rewriting a file without changing it, as game updates do, doesn't
+    count as a change"""
+    for path, fingerprint in recorded.items():
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            if fingerprint is None:
+                continue
+            return False
+        if fingerprint is None:
+            return False
+        if [st.st_mtime_ns, st.st_size] == fingerprint[:2]:
+            continue
+        if _digest(path, st) != fingerprint[2]:
+            return False
+    return True
+
+
+class BuildGraph:
+    """the inputs and outputs of the targets of a script, so that targets
+    whose game files, code and output files are unchanged can be skipped on
+    the next run. A target is a call which only writes output files. The
+    graph is stored per game version, so that a new version gets all
+    outputs in its own output folder. Without a cache folder, every target
+    runs."""
+
+    def __init__(self, name):
+        self.path = eu4cachedir / 'buildgraph' / (name + '.json') \
+            if eu4cachedir else None
+        self.targets = {}
+        if self.path and self.path.exists():
+            with self.path.open() as f:
+                stored = json.load(f)
+            if stored.get('format') == FORMAT:
+                self.targets = stored['targets']
+        # recorders of the targets which ran, until save
+        self.pending = {}
+
+    def run(self, key, func, *args, **kwargs):
+        """call func(*args, **kwargs) unless the target key is up to date"""
+        target = self.targets.get(key)
+        if (self.path and target and target['outputs'] and
+                unchanged(target['inputs']) and unchanged(target['outputs'])):
+            print('{}: up to date'.format(key))
+            return
+        with Recorder() as recorder:
+            func(*args, **kwargs)
+            # after the call, so that the modules it imported count
+            record_inputs(code_inputs())
+        self.pending[key] = recorder
+
+    def target(self, method):
+        """decorator for methods which are targets, keyed by the method
+        name and the other arguments"""
+        @functools.wraps(method)
+        def wrapper(instance, *args, **kwargs):
+            key = method.__qualname__
+            if args or kwargs:
+                key += repr((args, kwargs))
+            self.run(key, method, instance, *args, **kwargs)
+        return wrapper
+
+    def save(self):
+        """store the targets which ran. Call this after everything they
+        queued was written"""
+        if not self.path:
+            return
+        for key, recorder in self.pending.items():
+            self.targets[key] = {
+                'inputs': fingerprints(sorted(recorder.inputs)),
+                'outputs': fingerprints(sorted(recorder.written))}
+        self.pending = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with tmp.open('w') as f:
+            json.dump({'format': FORMAT, 'targets': self.targets}, f)
+        os.replace(tmp, self.path)
@@ -1,14 +1,43 @@
+import json
 import pickle
 import numpy
 from functools import wraps
-from eu4.paths import eu4cachedir
+from eu4.paths import eu4diskcachedir
+from eu4.buildgraph import FORMAT, Recorder, record_inputs, code_inputs, fingerprints, unchanged
 
-try:
-    from functools import cached_property
-except: # for backwards compatibility with python versions < 3.8
-    from functools import lru_cache
-    def cached_property(f):
-        return property(lru_cache()(f))
+
+class cached_property:
+    """like functools.cached_property, but the value remembers the files which it was computed from (see
+    eu4.buildgraph). Every access records them, so that a build target which uses the value depends on them even if
+    it was computed earlier"""
+
+    def __init__(self, func):
+        self.func = func
+        self.attrname = None
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner, name):
+        self.attrname = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            value, inputs = instance.__dict__[self.attrname]
+        except KeyError:
+            with Recorder() as recorder:
+                value = self.func(instance)
+            inputs = recorder.inputs
+            instance.__dict__[self.attrname] = value, inputs
+        record_inputs(inputs)
+        return value
+
+    # a data descriptor, so that __get__ is called for every access and not only the first
+    def __set__(self, instance, value):
+        instance.__dict__[self.attrname] = value, frozenset()
+
+    def __delete__(self, instance):
+        del instance.__dict__[self.attrname]
 
 
 class PickleSerializer:
@@ -41,29 +70,55 @@ class NumpySerializer:
         return numpy.load(filename)
 
 
+class CompressedNumpySerializer(NumpySerializer):
+    """for large arrays which compress well, like rasters of the map"""
+
+    @staticmethod
+    def get_file_extension():
+        return 'npz'
+
+    @staticmethod
+    def serialize(data, filename):
+        numpy.savez_compressed(filename, data)
+
+    @staticmethod
+    def deserialize(filename):
+        with numpy.load(filename) as data:
+            return data['arr_0']
+
+
 def disk_cache(serializer=PickleSerializer):
     """Cache the method result on disk
 
-    Warning: the cache assumes that the return value does not change
-    as long as the eu4 version stays the same. When changing the code
-    of the decorated method, you have to clear the cache manually
+    Next to the result, the cache stores the game files which the method read and the source code of every module
+    which was loaded when it was computed (see eu4.buildgraph.code_inputs). The result is computed again if any of
+    them changed, so the cache survives game updates which don't touch the files of the method. Files which other
+    processes read for the method are not tracked
 
-    setting eu4cachedir to None disables the cache, but it doesn't clear it
+    setting the cachedir to None disables the cache, but it doesn't clear it
     """
     def decorating_function(f):
-        if not eu4cachedir:
+        if not eu4diskcachedir:
             return f
 
         @wraps(f)
         def wrapper(self):
-            cachedir_with_module = eu4cachedir / f.__module__
+            cachedir_with_module = eu4diskcachedir / f.__module__
             cachedir_with_module.mkdir(parents=True, exist_ok=True)
             cachefile = cachedir_with_module / (f.__name__ + '.' + serializer.get_file_extension())
-            if cachefile.exists():
-                return serializer.deserialize(cachefile)
-            else:
+            inputsfile = cachedir_with_module / (f.__name__ + '.inputs.json')
+            if cachefile.exists() and inputsfile.exists():
+                with inputsfile.open() as file:
+                    stored = json.load(file)
+                if stored.get('format') == FORMAT and unchanged(stored['inputs']):
+                    record_inputs(frozenset(stored['inputs']))
+                    return serializer.deserialize(cachefile)
+            with Recorder() as recorder:
                 return_value = f(self)
-                serializer.serialize(return_value, cachefile)
-                return return_value
+                record_inputs(code_inputs())
+            serializer.serialize(return_value, cachefile)
+            with inputsfile.open('w') as file:
+                json.dump({'format': FORMAT, 'inputs': fingerprints(sorted(recorder.inputs))}, file)
+            return return_value
         return wrapper
     return decorating_function
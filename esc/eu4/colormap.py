@@ -1,13 +1,32 @@
 #!/usr/bin/env python3
 
+import concurrent.futures
+import functools
+import os
+import tempfile
+import time
+from typing import NamedTuple
 import numpy as np
 from PIL import Image
-from localpaths import rootpath
 from colormath import color_objects
-from _collections import OrderedDict
+from raster import bboxes, border_layer
 from eu4.cache import cached_property
+from eu4.buildgraph import record_output
 from eu4.paths import eu4outpath
-from eu4.mapparser import Eu4MapParser
+from eu4.mapparser import Eu4MapParser, BORDERS
+
+
+class MapSpec(NamedTuple):
+    """one map for ColorMapGenerator.render_maps. The arguments are those of
+    generate_mapimage_with_several_colors, or of create_shaded_image if shaded is true"""
+    name: str
+    color_to_provinces: dict
+    crop_to_color: object = None
+    margin: int = 10
+    shaded: bool = False
+    color_to_provinces_without_shading: dict = None
+    pattern: object = None
+    layers: int = None
 
 
 class ColorMapGenerator:
@@ -44,8 +63,10 @@ class ColorMapGenerator:
         self.outpath = eu4outpath
         self.contains = {}
 
-        # caching the border image
-        self._borderlayer = None
+        # render jobs of the maps collected by generate_mapimage_with_several_colors and create_shaded_image while
+        # batching
+        self.pending = None
+        self._after = {}
 
         # to check that one name isn't used for multiple things. e.g. an area and region with the same internal name
         self.name_to_type = {}
@@ -99,6 +120,11 @@ class ColorMapGenerator:
         self.contains[grouping].append(provinceID)
 
     def get_contains_dict(self):
+        return self._contains_dict
+
+    @cached_property
+    def _contains_dict(self):
+        # a cached property, so that the maps which use it depend on the files it was built from
         if not self.contains:
             for province in self.mapparser.all_provinces.values():
                 self._add_to_contains_dict(province.id, province.id, 'provinceID-int')
@@ -123,14 +149,25 @@ class ColorMapGenerator:
             crop_to_color = None
         self.generate_mapimage_with_several_colors({'important': where}, name, crop_to_color, margin)
 
+    @cached_property
+    def province_bboxes(self):
+        """(min_x, min_y, max_x, max_y) of each province, or -1s if it isn't on the map"""
+        return bboxes(self.mapparser.positions_to_provinceID_array, self.mapparser.max_provinces)
+
+    @cached_property
+    def borderlayer(self):
+        """the province borders as an rgba array, as in eu4borderlayer.png"""
+        return border_layer(self.mapparser.border_classes, BORDERS['province'])
+
     def calculate_boundaries(self, province_list, margin=10):
         """ calculate the min_x, max_x, min_y, max_y of the given provinces on the map and add a margin"""
-        c = np.isin(self.mapparser.positions_to_provinceID_array, province_list).nonzero()
+        boxes = self.province_bboxes[list(province_list)]
+        boxes = boxes[boxes[:, 0] >= 0]
+        if not len(boxes):
+            raise ValueError('none of the provinces are on the map')
 
-        min_y = c[0].min() - margin
-        min_x = c[1].min() - margin
-        max_y = c[0].max() + margin
-        max_x = c[1].max() + margin
+        min_x, min_y = boxes[:, :2].min(axis=0) - margin
+        max_x, max_y = boxes[:, 2:].max(axis=0) + margin
 
         # make sure the max and min values are not outside the image
         min_y = max(0, min_y)
@@ -141,18 +178,21 @@ class ColorMapGenerator:
         return min_x, max_x, min_y, max_y
 
     def generate_mapimage_with_several_colors(self, color_to_provinces, name='', crop_to_color=None, margin=10):
-        out_path = self.outpath / '{}.png'.format(name)
-        self.generate_mapimage_object_with_several_colors(color_to_provinces, crop_to_color, margin).save(str(out_path))
-
-    def add_province_borders(self, out):
-        if not self._borderlayer:
-            borders_path = rootpath / 'eu4borderlayer.png'
-            self._borderlayer = Image.open(str(borders_path))
-        out.paste(self._borderlayer, mask=self._borderlayer)
+        spec = MapSpec(name, color_to_provinces, crop_to_color, margin)
+        self._queue(spec)
 
-    def generate_mapimage_object_with_several_colors(self, color_to_provinces, crop_to_color=None, margin=10):
-        prov_color_lut = np.copy(self.prov_color_lut_base)
+    def add_province_borders(self, out, box=None):
+        """paste the border layer, or the box (left, upper, right, lower) of it, onto out"""
+        if box is not None:
+            borderlayer = Image.fromarray(self.borderlayer[box[1]:box[3], box[0]:box[2]])
+        else:
+            borderlayer = Image.fromarray(self.borderlayer)
+        out.paste(borderlayer, mask=borderlayer)
 
+    def _color_stacks(self, color_to_provinces, crop_to_color=None):
+        """dict of each colored province to the list of its colors in the order of the categories, and the list of
+        provinces to crop to"""
+        color_stacks = {}
         provinces_used_for_cropping = []
         for category in color_to_provinces:
             provinceIdList = color_to_provinces[category]
@@ -161,40 +201,147 @@ class ColorMapGenerator:
             provs = {y for x in provinceIdList for y in (self.get_contains_dict().get(x, None) or (int(x),))}
             if crop_to_color == category or crop_to_color == True:  # true means to include all colored provinces
                 provinces_used_for_cropping.extend(provs)
+            color = self.convert_color_to_np_type(category)
             for prov in provs:
-                prov_color_lut[prov] = self.convert_color_to_np_type(category)
-
-        out_a = prov_color_lut[self.mapparser.positions_to_provinceID_array]
-        out = Image.fromarray(out_a)
-        self.add_province_borders(out)
-
-        if crop_to_color:
-            min_x, max_x, min_y, max_y = self.calculate_boundaries(provinces_used_for_cropping, margin)
-            # for some reason, pillow excludes the bottom row and rightmost
-            # column of pixels when cropping, so we have to add 1 to include them
-            out = out.crop((min_x, min_y, max_x + 1, max_y + 1))
+                color_stacks.setdefault(prov, []).append(color)
+        return color_stacks, provinces_used_for_cropping
+
+    def _prepare(self, spec):
+        """the color lookup tables, crop box and stripe pattern of a MapSpec. Layer 0 of the lookup tables shows the
+        last color of each province, layer 1 the one before and so on, wrapping around."""
+        color_stacks, provinces_used_for_cropping = self._color_stacks(spec.color_to_provinces, spec.crop_to_color)
+        layers = 1
+        if spec.shaded:
+            if spec.color_to_provinces_without_shading:
+                unshaded, unshaded_cropping = self._color_stacks(spec.color_to_provinces_without_shading,
+                                                                 spec.crop_to_color)
+                for prov, colors in unshaded.items():
+                    color_stacks[prov] = colors[-1:]
+                provinces_used_for_cropping.extend(unshaded_cropping)
+            layers = spec.layers or max((len(colors) for colors in color_stacks.values()), default=1)
+        luts = np.repeat(self.prov_color_lut_base[np.newaxis], layers, axis=0)
+        for prov, colors in color_stacks.items():
+            for layer in range(layers):
+                luts[layer, prov] = colors[(len(colors) - 1 - layer) % len(colors)]
+
+        if spec.crop_to_color and provinces_used_for_cropping:
+            min_x, max_x, min_y, max_y = self.calculate_boundaries(provinces_used_for_cropping, spec.margin)
+            # pillow boxes exclude the right and bottom edge
+            box = (min_x, min_y, max_x + 1, max_y + 1)
+        else:
+            box = None
+        return luts, box, spec.pattern or diagonal_stripes()
 
-        return out
+    def generate_mapimage_object_with_several_colors(self, color_to_provinces, crop_to_color=None, margin=10):
+        luts, box, pattern = self._prepare(MapSpec('', color_to_provinces, crop_to_color, margin))
+        return render_window(self.mapparser.positions_to_provinceID_array, self.borderlayer, luts, box, pattern)
 
     def create_shaded_image(self, color_to_provinces, color_to_provinces_without_shading=None, name='',
-                            crop_to_color=None, margin=10):
-        color_first_image = color_to_provinces.copy()
-        color_second_image = OrderedDict(reversed(list(color_to_provinces.items())))
-        if color_to_provinces_without_shading:
-            for k, v in color_to_provinces_without_shading.items():
-                color_first_image[k] = v
-                color_second_image[k] = v
-        first_image = self.generate_mapimage_object_with_several_colors(color_first_image, crop_to_color, margin)
-        second_image = self.generate_mapimage_object_with_several_colors(color_second_image, crop_to_color, margin)
-        shaded_image = Image.new(first_image.mode, first_image.size)
-        for x in range(first_image.width):
-            for y in range(first_image.height):
-                if (x+y) % 6 < 3:
-                    source_image_for_current_pixel = first_image
-                else:
-                    source_image_for_current_pixel = second_image
-
-                shaded_image.putpixel((x, y), source_image_for_current_pixel.getpixel((x, y)))
-
-        out_path = self.outpath / '{}.png'.format(name)
-        shaded_image.save(str(out_path))
+                            crop_to_color=None, margin=10, pattern=None, layers=None):
+        """provinces with several colors get stripes of each of them, chosen by pattern (see diagonal_stripes).
+        There are as many layers of stripes as the most colors of any province unless layers is given."""
+        spec = MapSpec(name, color_to_provinces, crop_to_color, margin, True, color_to_provinces_without_shading,
+                       pattern, layers)
+        self._queue(spec)
+
+    def _queue(self, spec):
+        if self.pending is not None:
+            self.pending.append(self._job(spec))
+        else:
+            self.render_maps([spec], workers=1)
+
+    def _job(self, spec):
+        """the arguments of _render_job for a MapSpec"""
+        out_path = self.outpath / '{}.png'.format(spec.name)
+        # pending maps are rendered after the build target which queued them (see eu4.buildgraph), so the target
+        # records the output and, by accessing the arrays which the rendering uses, its inputs now
+        record_output(out_path)
+        self.mapparser.positions_to_provinceID_array, self.borderlayer
+        return (spec.name, *self._prepare(spec), str(out_path))
+
+    def after(self, name, func):
+        """call func once the map called name is saved, which is now unless it's pending"""
+        if self.pending is not None and any(job[0] == name for job in self.pending):
+            self._after.setdefault(name, []).append(func)
+        else:
+            func()
+
+    def render_pending(self, workers=None):
+        """render the maps collected since pending was set to a list and stop collecting"""
+        jobs, self.pending = self.pending, None
+        return self._render_jobs(jobs, workers)
+
+    def render_maps(self, specs, workers=None):
+        """Render and save a list of MapSpecs, in a pool of worker processes unless workers is 1. The workers share
+        the province id raster and border layer through memory mapped files. Print and return the seconds each map
+        took by name."""
+        return self._render_jobs([self._job(spec) for spec in specs], workers)
+
+    def _render_jobs(self, jobs, workers):
+        timings = {}
+
+        def finished(name, seconds):
+            timings[name] = seconds
+            print('{}: {:.2f} s'.format(name, seconds))
+            for func in self._after.pop(name, []):
+                func()
+
+        if workers == 1 or len(jobs) <= 1:
+            for job in jobs:
+                finished(*_render_job(job, self.mapparser.positions_to_provinceID_array, self.borderlayer))
+            return timings
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = [os.path.join(tmp, 'provinceIDs.npy'), os.path.join(tmp, 'borderlayer.npy')]
+            np.save(shared[0], self.mapparser.positions_to_provinceID_array)
+            np.save(shared[1], self.borderlayer)
+            with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                        initargs=shared) as pool:
+                for future in concurrent.futures.as_completed([pool.submit(_render_job, job) for job in jobs]):
+                    finished(*future.result())
+        return timings
+
+
+def _diagonal_stripe_layers(width, x, y, layers):
+    return (x + y) // width % layers
+
+
+def diagonal_stripes(width=3):
+    """pattern for create_shaded_image of stripes width pixels wide, from the bottom left to the top right"""
+    return functools.partial(_diagonal_stripe_layers, width)
+
+
+def render_window(provinceIDs, borderlayer, luts, box, pattern):
+    """the map image of the box (left, upper, right, lower), or of the whole map if box is None, with the colors of
+    the lookup tables luts, the layer of each pixel picked by pattern, and the borders of the borderlayer array"""
+    if box is not None:
+        provinceIDs = provinceIDs[box[1]:box[3], box[0]:box[2]]
+        borderlayer = borderlayer[box[1]:box[3], box[0]:box[2]]
+    if len(luts) == 1:
+        out_a = luts[0][provinceIDs]
+    else:
+        y, x = np.ogrid[:provinceIDs.shape[0], :provinceIDs.shape[1]]
+        out_a = luts[pattern(x, y, len(luts)), provinceIDs]
+    out = Image.fromarray(out_a)
+    borders = Image.fromarray(np.ascontiguousarray(borderlayer))
+    out.paste(borders, mask=borders)
+    return out
+
+
+# the shared arrays of a render_maps process
+_provinceIDs = None
+_borderlayer = None
+
+
+def _init_worker(provinceIDs_path, borderlayer_path):
+    global _provinceIDs, _borderlayer
+    _provinceIDs = np.load(provinceIDs_path, mmap_mode='r')
+    _borderlayer = np.load(borderlayer_path, mmap_mode='r')
+
+
+def _render_job(job, provinceIDs=None, borderlayer=None):
+    name, luts, box, pattern, out_path = job
+    if provinceIDs is None:
+        provinceIDs, borderlayer = _provinceIDs, _borderlayer
+    start = time.perf_counter()
+    render_window(provinceIDs, borderlayer, luts, box, pattern).save(out_path)
+    return name, time.perf_counter() - start
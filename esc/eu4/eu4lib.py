@@ -1,9 +1,12 @@
 import re
+import threading
 import zipfile
+from collections import OrderedDict
 from operator import attrgetter
-from pathlib import Path, PurePath
+from pathlib import Path
 from zipfile import ZipFile
 
+import vfs
 from ck2parser import String
 from common.paradox_lib import NameableEntity, PdxColor
 from eu4.provincelists import coastal_provinces
@@ -692,6 +695,39 @@ class Country(NameableEntity):
             return None
 
 
+class ZipPool:
+    """open ZipFiles of the dlc archives, so that reading many files doesn't open an archive for each of them. At most
+    size archives are kept, the least recently used one is dropped first. Reading different members of a ZipFile
+    from several threads is safe, but the reads are serialized on its file handle"""
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self._archives = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, archive: Path) -> ZipFile:
+        with self._lock:
+            if archive in self._archives:
+                self._archives.move_to_end(archive)
+                return self._archives[archive]
+            dlc_archive = ZipFile(archive)
+            self._archives[archive] = dlc_archive
+            while len(self._archives) > self.size:
+                # not closed explicitly, because zipfile.Paths from DLC.glob may still use it. It is closed when the
+                # last reference is gone
+                self._archives.popitem(last=False)
+            return dlc_archive
+
+    def close(self):
+        with self._lock:
+            for dlc_archive in self._archives.values():
+                dlc_archive.close()
+            self._archives.clear()
+
+
+zip_pool = ZipPool()
+
+
 class DLC(NameableEntity):
     short_names = {
         'Conquest of Paradise': 'cop',
@@ -727,31 +763,51 @@ class DLC(NameableEntity):
         else:
             self.short_name = ''
 
-        self._open_dlc_archive = None
-
     def get_icon(self):
         if self.short_name != '':
             return '{{icon|' + self.short_name + '}}'
         else:
             return self.display_name
 
+    def find(self, glob: str) -> list[str]:
+        """the paths of the files which match glob, as taken by get_file_contents. They are looked up in the index of
+        the members of the archive, so the archive isn't listed again"""
+        return vfs.shared(self.archive).glob(glob)
+
     def glob(self, glob: str):
-        with ZipFile(self.archive) as dlc_archive:
-            # store opened archive so that get_file_contents doesn't have to open it again
-            self._open_dlc_archive = dlc_archive
-            for filename in dlc_archive.namelist():
-                if PurePath(filename).match(glob):
-                    yield zipfile.Path(dlc_archive, filename)
-            self._open_dlc_archive = None
+        dlc_archive = zip_pool.get(self.archive)
+        for filename in self.find(glob):
+            yield zipfile.Path(dlc_archive, filename)
 
     def get_file_contents(self, filepath):
-        if self._open_dlc_archive:
-            with self._open_dlc_archive.open(filepath) as file:
-                return file.read()
-        else:
-            with ZipFile(self.archive) as dlc_archive:
-                with dlc_archive.open(filepath) as file:
-                    return file.read()
+        with zip_pool.get(self.archive).open(filepath) as file:
+            return file.read()
+
+    def read_many(self, filepaths) -> list[bytes]:
+        """the contents of a list of files. They are read in the order in which they are stored in the archive"""
+        dlc_archive = zip_pool.get(self.archive)
+        contents = {}
+        for filepath in sorted(set(filepaths), key=lambda filepath: self._members[filepath].header_offset):
+            with dlc_archive.open(self._members[filepath]) as file:
+                contents[filepath] = file.read()
+        return [contents[filepath] for filepath in filepaths]
+
+    @cached_property
+    def _members(self) -> dict[str, zipfile.ZipInfo]:
+        with ZipFile(self.archive) as dlc_archive:
+            return {info.filename: info for info in dlc_archive.infolist()}
+
+    def file_key(self, filepath):
+        """(archive, member, size, modification time) of a file, which identifies its contents"""
+        info = self._members[filepath]
+        return str(self.archive), filepath, info.file_size, info.date_time
+
+    def open_file(self, filepath, dlc_archive: ZipFile = None):
+        """a binary file object to stream the file from. By default it is read from the pooled ZipFile of the archive.
+        Threads which read in parallel should pass their own open ZipFile of the archive instead"""
+        if dlc_archive is None:
+            dlc_archive = zip_pool.get(self.archive)
+        return dlc_archive.open(filepath)
 
 
 class BaseGame(DLC):
@@ -763,6 +819,10 @@ class BaseGame(DLC):
     def get_icon(self):
         return ''
 
+    def find(self, glob: str) -> list[str]:
+        return ['/'.join(parts) for _, parts in
+                vfs.shared(self.parser.basedir, *self.parser.moddirs).matches(glob)]
+
     def glob(self, glob: str):
         return self.parser.files(glob)
 
@@ -770,17 +830,32 @@ class BaseGame(DLC):
         with open(self.parser.file(filepath), 'rb') as file:
             return file.read()
 
+    def read_many(self, filepaths) -> list[bytes]:
+        return [self.get_file_contents(filepath) for filepath in filepaths]
+
+    def file_key(self, filepath):
+        path = self.parser.file(filepath)
+        st = path.stat()
+        return str(path), '', st.st_size, st.st_mtime_ns
+
+    def open_file(self, filepath, dlc_archive: ZipFile = None):
+        return open(self.parser.file(filepath), 'rb')
+
 
 class EventPicture:
     def __init__(self, name: str, filename: str, wiki_filename: str, dlc: DLC, overridden_by: list['EventPicture'],
-                 sha_hash: str, picture_data: bytes):
+                 sha_hash: str = None):
         self.name = name
         self.filename = filename
         self.wiki_filename = wiki_filename
         self.dlc = dlc
         self.overridden_by = overridden_by
         self.sha_hash = sha_hash
-        self.picture_data = picture_data
+
+    @property
+    def picture_data(self) -> bytes:
+        """the contents of the picture file. They are read on every access instead of being kept in memory"""
+        return self.dlc.get_file_contents(self.filename)
 
 
 class Estate(NameableEntity):
@@ -1,5 +1,7 @@
+import concurrent.futures
 import hashlib
-import re
+import pickle
+import threading
 import zipfile
 from pathlib import PurePath, Path
 from zipfile import ZipFile
@@ -7,6 +9,63 @@ from zipfile import ZipFile
 from eu4.parser import Eu4Parser
 from eu4.eu4lib import Event, EventPicture, BaseGame, DLC
 from eu4.cache import cached_property
+from eu4.paths import eu4diskcachedir
+
+
+class PictureHasher:
+    """sha256 hashes of files in the base game and the dlc archives. Every file is hashed once, streamed in chunks in
+    a thread pool, and the hashes are cached on disk by (archive, member, size, modification time)"""
+
+    chunk_size = 1 << 20
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.cachefile = eu4diskcachedir / 'eu4.eventparser' / 'picture_hashes.pkl' if eu4diskcachedir else None
+        self.hashes = {}
+        if self.cachefile and self.cachefile.exists():
+            with self.cachefile.open('rb') as f:
+                self.hashes = pickle.load(f)
+
+    def hash_files(self, files):
+        """list of the sha256 hex digests of a list of (dlc, filepath) pairs"""
+        keys = [dlc.file_key(filepath) for dlc, filepath in files]
+        missing = {}
+        for file, key in zip(files, keys):
+            if key not in self.hashes:
+                missing.setdefault(key, file)
+        if missing:
+            # reads from a shared ZipFile are serialized, so every thread opens each archive once
+            local = threading.local()
+            opened = []
+
+            def hash_file(file):
+                dlc, filepath = file
+                archives = local.__dict__.setdefault('archives', {})
+                if dlc.archive and dlc.archive not in archives:
+                    archives[dlc.archive] = ZipFile(dlc.archive)
+                    opened.append(archives[dlc.archive])
+                sha = hashlib.sha256()
+                with dlc.open_file(filepath, archives.get(dlc.archive)) as f:
+                    # hashlib releases the GIL for large chunks, so the threads hash in parallel
+                    for chunk in iter(lambda: f.read(self.chunk_size), b''):
+                        sha.update(chunk)
+                return sha.hexdigest()
+
+            try:
+                with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                    for key, digest in zip(missing, pool.map(hash_file, missing.values())):
+                        self.hashes[key] = digest
+            finally:
+                for archive in opened:
+                    archive.close()
+            self.save()
+        return [self.hashes[key] for key in keys]
+
+    def save(self):
+        if self.cachefile:
+            self.cachefile.parent.mkdir(parents=True, exist_ok=True)
+            with self.cachefile.open('wb') as f:
+                pickle.dump(self.hashes, f)
 
 
 class Eu4EventParser(Eu4Parser):
@@ -61,8 +120,15 @@ class Eu4EventParser(Eu4Parser):
                     pictures_by_gfx_file[gfx_path.name] = self._get_pictures_from_gfx_file(dlc, gfx_path)
                     pictures.extend(pictures_by_gfx_file[gfx_path.name])
         self._add_overriding_information(pictures_by_gfx_file)
+        hashes = self.picture_hasher.hash_files([(picture.dlc, picture.filename) for picture in pictures])
+        for picture, sha_hash in zip(pictures, hashes):
+            picture.sha_hash = sha_hash
         return pictures
 
+    @cached_property
+    def picture_hasher(self):
+        return PictureHasher()
+
     def _add_overriding_information(self, pictures_by_gfx_file: dict[str, list[EventPicture]]):
         pictures_by_name = {}
         for gfx, pictures in sorted(pictures_by_gfx_file.items()):
@@ -97,10 +163,8 @@ class Eu4EventParser(Eu4Parser):
                 if picture_filename == 'gfx/event_pictures/event_pictures_domination/eunuch_estate_eventPicture.dds':
                     picture_filename = 'gfx/event_pictures/event_pictures_domination/eunuch_estate_eventpicture.dds'
                 wiki_filename = self._generate_wiki_filename(picture_filename)
-                picture_data = actual_dlc.get_file_contents(picture_filename)
-                picture_sha = hashlib.sha256(picture_data).hexdigest()
-                picture = EventPicture(picture_name, picture_filename, wiki_filename, actual_dlc, [], picture_sha,
-                                       picture_data)
+                # the hash is added by event_pictures, which hashes all pictures together
+                picture = EventPicture(picture_name, picture_filename, wiki_filename, actual_dlc, [])
                 # if there is already an entry with the same name in this gfx file, it will be overwritten,
                 # because I assume that the game would do the same(as of version 1.34,
                 # the only duplications have identical values)
@@ -130,18 +194,21 @@ class Eu4EventParser(Eu4Parser):
         for picture in self.event_pictures:
             used_sha.add(picture.sha_hash)
             if picture.dlc.name not in filenames_by_dlc:
-                filenames_by_dlc[picture.dlc.name] = []
-            filenames_by_dlc[picture.dlc.name].append(picture.filename)
+                filenames_by_dlc[picture.dlc.name] = set()
+            filenames_by_dlc[picture.dlc.name].add(picture.filename)
 
-        unused_pictures = {}
+        unreferenced = []
         for dlc in self.dlcs_including_base_game:
-            for picture_path in dlc.glob('gfx/event_pictures/*/*.dds'):
-                picture_filename = re.sub(r'^.*gfx/event_pictures', 'gfx/event_pictures', str(picture_path))
-                if dlc.name not in filenames_by_dlc or picture_filename not in filenames_by_dlc[dlc.name]:
-                    picture_data = dlc.get_file_contents(picture_filename)
-                    picture_sha = hashlib.sha256(picture_data).hexdigest()
-                    if picture_sha not in used_sha:
-                        if picture_sha not in unused_pictures:
-                            unused_pictures[picture_sha] = []
-                        unused_pictures[picture_sha].append(EventPicture('none', picture_filename, self._generate_wiki_filename(picture_filename), dlc, [], picture_sha, picture_data))
+            # the file names come from the member index, so the archives are neither opened nor listed again
+            for picture_filename in dlc.find('gfx/event_pictures/*/*.dds'):
+                if picture_filename not in filenames_by_dlc.get(dlc.name, ()):
+                    unreferenced.append((dlc, picture_filename))
+        hashes = self.picture_hasher.hash_files(unreferenced)
+
+        unused_pictures = {}
+        for (dlc, picture_filename), picture_sha in zip(unreferenced, hashes):
+            if picture_sha not in used_sha:
+                if picture_sha not in unused_pictures:
+                    unused_pictures[picture_sha] = []
+                unused_pictures[picture_sha].append(EventPicture('none', picture_filename, self._generate_wiki_filename(picture_filename), dlc, [], picture_sha))
         return unused_pictures
@@ -15,6 +15,10 @@ from eu4.paths import eu4_major_version, eu4outpath
 from eu4.mapparser import Eu4Parser
 from eu4.eu4lib import Idea, Policy
 from eu4.modifier_list import all_modifiers
+from eu4.buildgraph import BuildGraph
+
+# skips the tables whose game files and code didn't change since the last run
+build = BuildGraph('bonus_tables')
 
 
 class BonusTableGenerator:
@@ -89,6 +93,7 @@ class BonusTableGenerator:
         self.eu4parser = Eu4Parser()
         self.parser = self.eu4parser.parser
 
+    @build.target
     def run(self):
         self.writeFile('bonus_tables', self.generate())
 
@@ -325,6 +330,7 @@ class PolicyListGenerator:
     # def replace_icons_with_file_images(self, wikitext):
     #     return re.sub(r'{{icon\|([^}]*)}}', self._replace_icon, wikitext)
 
+    @build.target
     def run(self):
         self.build_overview()
         for category, category_display_name in {'ADM': 'Administrative', 'DIP': 'Diplomatic', 'MIL': 'Military'}.items():
@@ -363,6 +369,7 @@ class StaticModifiersGenerator:
             else:
                 raise Exception('Unhandled modifier line: ' + line)
 
+    @build.target
     def run(self):
         wiki_converter = WikiTextConverter()
 
@@ -392,5 +399,6 @@ if __name__ == '__main__':
     StaticModifiersGenerator().run()
     PolicyListGenerator().run()
     BonusTableGenerator().run()
+    build.save()
 
 
@@ -12,6 +12,10 @@ from eu4.mapparser import Eu4MapParser
 from eu4.paths import eu4outpath
 from eu4.eu4_file_generator import Eu4FileGenerator
 from eu4.eu4lib import Unit
+from eu4.buildgraph import BuildGraph
+
+# skips the files whose game files and code didn't change since the last run
+build = BuildGraph('files')
 
 
 class AnotherFileGenerator(Eu4FileGenerator):
@@ -76,6 +80,7 @@ class AnotherFileGenerator(Eu4FileGenerator):
                 techs.append(tech)
         return techs
 
+    @build.target
     def mil_table(self):
 
         lines = ['{| class="mildtable" style="width:100%"',
@@ -153,6 +158,7 @@ class AnotherFileGenerator(Eu4FileGenerator):
         lines.append('|}')
         self.write_file('mil_tech', '\n'.join(lines))
 
+    @build.target
     def mil_techs_effects_table(self):
         lines = []
         lines.append('{| class="mildtable" style="text-align:center"')
@@ -189,6 +195,7 @@ class AnotherFileGenerator(Eu4FileGenerator):
         lines.append('|}')
         self.write_file('mil_tech_effects_table', '\n'.join(lines))
 
+    @build.target
     def unit_pip_table(self):
         piplist = {'infantry': {}, 'cavalry': {}, 'artillery': {}}
         unitlist = {'infantry': {}, 'cavalry': {}, 'artillery': {}}
@@ -269,6 +276,7 @@ class AnotherFileGenerator(Eu4FileGenerator):
 
     #         for techlevel in range(1,32):
 
+    @build.target
     def straits(self):
         self.write_file('straits', '\n'.join(self.generate_straits_list()))
 
@@ -303,3 +311,4 @@ if __name__ == '__main__':
     #             generator[arg]()
     else:
         generator.generate_all()
+    build.save()
@@ -25,8 +25,12 @@ from eu4.mapparser import Eu4MapParser
 from eu4.eu4lib import GovernmentReform, Country, Estate, ColonialRegion, Culture
 from eu4.eu4_file_generator import Eu4FileGenerator
 from eu4.eventparser import Eu4EventParser
+from eu4.buildgraph import BuildGraph
 from ck2parser import Obj, Pair
 
+# skips the lists whose game files and code didn't change since the last run
+build = BuildGraph('lists')
+
 
 class PdxparseToList(Eu4FileGenerator):
 
@@ -34,6 +38,11 @@ class PdxparseToList(Eu4FileGenerator):
         super().__init__()
         self.wiki_converter = WikiTextConverter()
 
+    def _write_text_file(self, name, content):
+        # lists with placeholders for pdxparse output are generated again once it ran, see __main__
+        if not WikiTextConverter.has_placeholders():
+            super()._write_text_file(name, content)
+
     @staticmethod
     def _add_element_to_dict_and_create_list_for_duplicates(key, value, dictionary):
         if key in dictionary:
@@ -730,6 +739,8 @@ class MonumentList:
 
     @staticmethod
     def _writeFile(name, content):
+        if WikiTextConverter.has_placeholders():
+            return
         output_file = eu4outpath / 'eu4{}.txt'.format(name)
         with output_file.open('w') as f:
             f.write(content)
@@ -1206,6 +1217,8 @@ class GovernmentReforms:
         return reforms
 
     def writeFile(self, name, content):
+        if WikiTextConverter.has_placeholders():
+            return
         output_file = eu4outpath / 'eu4{}.txt'.format(name)
         with output_file.open('w') as f:
             f.write(content)
@@ -1410,14 +1423,36 @@ class CultureList(Eu4FileGenerator):
 if __name__ == '__main__':
     # for correct sorting. en_US seems to work even for non english characters, but the default None sorts all non-ascii characters to the end
     setlocale(LC_COLLATE, 'en_US.utf8')
-    EstateAgendas().run_for_all_estates()
-    Achievements(365).run([])
-    EstatePrivileges().run_for_all_estates()
-    EocReforms().run([])
-    GovernmentReforms().run()
-    MercenaryList().run([])
-    MonumentList().run()
-    EventPicturesList().run([])
-    CountryList().run([])
-    AreaAndRegionsList().run([])
-    CultureList().run([])
+    generators = {
+        'estate_agendas': lambda: EstateAgendas().run_for_all_estates(),
+        'achievements': lambda: Achievements(365).run([]),
+        'estate_privileges': lambda: EstatePrivileges().run_for_all_estates(),
+        'eoc_reforms': lambda: EocReforms().run([]),
+        'government_reforms': lambda: GovernmentReforms().run(),
+        'mercenaries': lambda: MercenaryList().run([]),
+        'monuments': lambda: MonumentList().run(),
+    }
+    # lists whose snippets are all cached are generated right away. The others only collect their snippets, with
+    # placeholders instead of pdxparse output and without writing anything, and run again after a single pdxparse call
+    # converted the snippets of all of them
+    waiting = {}
+    with WikiTextConverter.batch():
+        for name, generate in generators.items():
+            WikiTextConverter.start_collecting()
+            try:
+                build.run(name, generate)
+            except Exception as e:
+                # the placeholders aren't valid pdxparse output, so the list might not get through them
+                if not WikiTextConverter.has_placeholders():
+                    raise
+                print(f'{name}: {e!r} while collecting snippets')
+            if WikiTextConverter.has_placeholders():
+                print(f'{name}: waiting for pdxparse')
+                waiting[name] = generate
+    for name, generate in waiting.items():
+        build.run(name, generate)
+    build.run('event_pictures', lambda: EventPicturesList().run([]))
+    build.run('countries', lambda: CountryList().run([]))
+    build.run('areas_and_regions', lambda: AreaAndRegionsList().run([]))
+    build.run('cultures', lambda: CultureList().run([]))
+    build.save()
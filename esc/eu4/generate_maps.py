@@ -15,8 +15,12 @@ from eu4.eu4lib import Eu4Color
 from eu4.paths import eu4outpath, verified_for_version
 from eu4.colormap import ColorMapGenerator
 from eu4.provincelists import is_island, province_is_on_an_island, island, terrain_to_provinces, coastal_provinces
+from eu4.buildgraph import BuildGraph
 from ck2parser import Date
 
+# skips the maps whose game files and code didn't change since the last run
+build = BuildGraph('maps')
+
 
 class MapGenerator:
 
@@ -24,6 +28,7 @@ class MapGenerator:
         self.color_map_generator = ColorMapGenerator()
         self.mapparser = self.color_map_generator.mapparser
 
+    @build.target
     def decision_maps(self):
         # change the version number after verifying that the provinces/areas are still correct
         verified_for_version('1.37.0')
@@ -116,6 +121,7 @@ class MapGenerator:
 #             'green': [507, 555] # one of these
 #             }, 'Formdehli', crop_to_color=True)
 
+    @build.target
     def superregion_map(self):
         color_to_superregion = {}
         for i, superregion in enumerate(self.mapparser.all_superregions.values()):
@@ -124,6 +130,7 @@ class MapGenerator:
 
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_superregion, 'Superregion map')
 
+    @build.target
     def region_maps(self):
         maps_to_generate = {
             'Superregion india': [prov.id for prov in self.mapparser.all_land_provinces.values() if prov.superregion.name == 'india_superregion'],
@@ -158,7 +165,9 @@ class MapGenerator:
             else:
                 crop_to_color = True
             self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, name, crop_to_color=crop_to_color)
+        self.color_map_generator.after('Oceanian regions', self.rearrange_oceania_map)
 
+    def rearrange_oceania_map(self):
         # reorganize the oceania image so that the parts west of the
         # date line are on the left side of the image and the parts
         # east of the date line are on the right of the image
@@ -252,6 +261,7 @@ class MapGenerator:
                     colors.append(LabColor((minimum_l + level * brightness_step) * 100, a_value * 128, b_value * 128))
         return colors
 
+    @build.target
     def culture_map(self):
         """Experimental culture map. Not currently used by the wiki"""
         color_to_provinces = {}
@@ -265,6 +275,7 @@ class MapGenerator:
                     color_to_provinces[Eu4Color(rgb_color.clamped_rgb_r, rgb_color.clamped_rgb_g, rgb_color.clamped_rgb_b, is_upscaled=False)] = list(provinces)
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Cultures')
 
+    @build.target
     def culture_group_map(self):
         color_to_provinces = {}
         for i, culture_group in enumerate(self.mapparser.culture_groups.values()):
@@ -273,6 +284,7 @@ class MapGenerator:
                 color_to_provinces[i+1] = list(provinces)
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Culture groups')
 
+    @build.target
     def religion_map(self):
         color_to_provinces = {}
         for religion in self.mapparser.all_religions.values():
@@ -282,6 +294,7 @@ class MapGenerator:
                                        if prov.get('Religion') is None and prov.type == 'Land']
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Religion')
 
+    @build.target
     def trade_node_map(self):
         color_to_provinces = {}
         for i, trade_node in enumerate(self.mapparser.all_trade_nodes.values()):
@@ -291,23 +304,27 @@ class MapGenerator:
                 color_to_provinces[i+1] = trade_node.provinceIDs
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Trade nodes')
 
+    @build.target
     def trade_company_map(self):
         color_to_provinces = {}
         for tc in self.mapparser.all_trade_companies.values():
             color_to_provinces[tc.color] = tc.provinceIDs
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Trade companies')
 
+    @build.target
     def colonial_region_map(self):
         color_to_provinces = {}
         for colonial_region in self.mapparser.all_colonial_regions.values():
             color_to_provinces[colonial_region.color] = colonial_region.provinceIDs
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Colonial regions')
 
+    @build.target
     def island_maps(self):
         self.color_map_generator.generate_mapimage_with_important_provinces(is_island, 'is_island_map', crop=False)
         self.color_map_generator.generate_mapimage_with_important_provinces(island, 'island_map', crop=False)
         self.color_map_generator.generate_mapimage_with_important_provinces(province_is_on_an_island, 'province_is_on_an_island_map', crop=False)
 
+    @build.target
     def coal_map(self):
         coal_provinces = []
         for prov in self.mapparser.all_provinces.values():
@@ -315,6 +332,7 @@ class MapGenerator:
                 coal_provinces.append(prov.id)
         self.color_map_generator.generate_mapimage_with_several_colors({'cyan': coal_provinces}, 'coalmap', crop_to_color=False)
 
+    @build.target
     def gold_map(self):
         gold_provinces = []
         for prov in self.mapparser.all_provinces.values():
@@ -322,6 +340,7 @@ class MapGenerator:
                 gold_provinces.append(prov.id)
         self.color_map_generator.generate_mapimage_with_several_colors({'gold': gold_provinces}, 'Goldmap', crop_to_color=False)
 
+    @build.target
     def terrain_map(self):
         color_to_provinces = {}
         for terrain in self.mapparser.terrains.values():
@@ -333,11 +352,15 @@ class MapGenerator:
             elif terrain.name not in ['lake', 'ocean']: # just use default colors for oceans and lakes because the game files make oceans white and have no color for lakes
                 color_to_provinces[terrain.color] = terrain.provinceIDs
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Terrain map', crop_to_color=False)
+        self.color_map_generator.after('Terrain map', self.add_terrain_legend)
+
+    def add_terrain_legend(self):
         map_image = Image.open(eu4outpath / 'Terrain map.png')
         legend_image = Image.open(Path(__file__).parent / 'terrain_legend.png')
         map_image.paste(legend_image, (430, 820))
         map_image.save(eu4outpath / 'Terrain map.png')
 
+    @build.target
     def country_map(self):
         empty_provinces = set(self.mapparser.all_land_provinces.keys())
         color_to_provinces = {}
@@ -349,6 +372,7 @@ class MapGenerator:
         color_to_provinces[Eu4Color(150, 150, 150)] = empty_provinces
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Countries')
 
+    @build.target
     def continent_map(self):
         self.color_map_generator.generate_mapimage_with_several_colors({
             Eu4Color.new_from_rgb_hex('#7fffff'): 'europe',
@@ -359,6 +383,7 @@ class MapGenerator:
             Eu4Color.new_from_rgb_hex('#ff7fff'): 'oceania'
         }, 'Continent map')
 
+    @build.target
     def techgroup_map(self):
         tech_group_color = {
             'western': '#ccc000', 'eastern': '#b38000',
@@ -388,6 +413,7 @@ class MapGenerator:
         self.color_map_generator.generate_mapimage_with_several_colors(color_to_provinces, 'Tech groups')
 
     # TODO: this is unfinished and waiting for the outcome of the discussion on the talk page
+    @build.target
     def mission_map(self):
         tags_with_tag_specific_missions = set()
         tags_with_shared_tag_specific_missions = set()
@@ -525,6 +551,7 @@ class MapGenerator:
     def achievement_map(self, achievement_name, where, crop=True, margin = 10):
         self.map(where, achievement_name + ' map', crop, margin)
 
+    @build.target
     def achievement_maps(self):
         # change the version number after verifying that the provinces/areas are still correct
         # for the first two achievements, the decision file has to be checked
@@ -695,7 +722,9 @@ every_province = {
             print('    "{}": [{}],'.format(terrain['terrain'], ','.join(tags_to_provinces[terrain['tag']])))
         print('}')
 
-    def generate_all(self):
+    def generate_all(self, workers=None):
+        # collect every map and render them together in a process pool
+        self.color_map_generator.pending = []
         self.superregion_map()
         self.region_maps()
         self.island_maps()
@@ -713,6 +742,8 @@ every_province = {
         self.continent_map()
         self.techgroup_map()
         # self.mission_map()
+        self.color_map_generator.render_pending(workers)
+        build.save()
 
 
 if __name__ == '__main__':
@@ -732,5 +763,6 @@ if __name__ == '__main__':
         else:
             for arg in sys.argv[1:]:
                 getattr(generator, arg)()
+            build.save()
     else:
         generator.generate_all()
@@ -8,6 +8,10 @@ from locale import strxfrm, setlocale, LC_COLLATE
 from eu4.mapparser import Eu4MapParser
 from eu4.paths import eu4outpath
 from eu4.wiki import get_version_header, get_SVersion_header
+from eu4.buildgraph import BuildGraph
+
+# skips the tables if their game files and code didn't change since the last run
+build = BuildGraph('province_tables')
 
 
 class ProvinceTables:
@@ -21,6 +25,7 @@ class ProvinceTables:
         self._notes = None
         self._provinces_to_include_in_continent = None
 
+    @build.target
     def main(self):
         provinces = self.parser.all_provinces
         continents = self.analyze_continents(provinces)
@@ -318,3 +323,4 @@ class ProvinceTables:
 
 if __name__ == '__main__':
     ProvinceTables().main()
+    build.save()
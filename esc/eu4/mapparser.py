@@ -4,10 +4,15 @@ import numpy as np
 from PIL import Image
 from ck2parser import csv_rows, Pair
 from localpaths import cachedir
+from raster import id_raster, adjacent_pairs, adjacency_sets, pairs_to_csr, group_lut, border_bits
 from eu4.provincelists import terrain_to_provinces
 from eu4.eu4lib import *
 from eu4.parser import Eu4Parser
-from eu4.cache import disk_cache, cached_property, NumpySerializer
+from eu4.cache import disk_cache, cached_property, NumpySerializer, CompressedNumpySerializer
+
+
+# the bits of Eu4MapParser.border_classes
+BORDERS = {'province': 1, 'area': 2, 'region': 4, 'country': 8, 'coast': 16}
 
 
 class Eu4MapParser(Eu4Parser):
@@ -21,30 +26,42 @@ class Eu4MapParser(Eu4Parser):
     def __init__(self):
         super().__init__()
 
-        self.default_tree = self.parser.parse_file('map/default.map')
-        self.random_only = {n.val for n in self.default_tree['only_used_for_random']}
-        self.max_provinces = self.default_tree['max_provinces'].val
-        self.provinces_rgb_map = None
         self.regionColors = None
         if cachedir:
             self.cachedir = cachedir / self.__class__.__name__
             self.cachedir.mkdir(parents=True, exist_ok=True)
 
+    # properties instead of attributes, so that the values which use them depend on map/default.map
+
+    @cached_property
+    def default_tree(self):
+        return self.parser.parse_file('map/default.map')
+
+    @cached_property
+    def random_only(self):
+        return {n.val for n in self.default_tree['only_used_for_random']}
+
+    @cached_property
+    def max_provinces(self):
+        return self.default_tree['max_provinces'].val
+
     def map_path(self, key):
         return self.parser.file('map/' + self.default_tree[key].val)
 
-    def _get_provinces_rgb_map(self):
-        if not self.provinces_rgb_map:
-            self.provinces_rgb_map = {}
-            for row in csv_rows(self.map_path('definitions')):
-                try:
-                    number = int(row[0])
-                except ValueError:
-                    continue
-                if number < self.max_provinces:
-                    rgb = tuple(np.uint8(row[1:4]))
-                    self.provinces_rgb_map[rgb] = np.uint16(number)
+    @cached_property
+    def provinces_rgb_map(self):
+        provinces_rgb_map = {}
+        for row in csv_rows(self.map_path('definitions')):
+            try:
+                number = int(row[0])
+            except ValueError:
+                continue
+            if number < self.max_provinces:
+                rgb = tuple(np.uint8(row[1:4]))
+                provinces_rgb_map[rgb] = np.uint16(number)
+        return provinces_rgb_map
 
+    def _get_provinces_rgb_map(self):
         return self.provinces_rgb_map
 
     @cached_property
@@ -56,26 +73,38 @@ class Eu4MapParser(Eu4Parser):
         # the code is valid, because Image implements __array_interface__
         # noinspection PyTypeChecker
         pa = np.array(Image.open(str(self.map_path('provinces'))))
-        pa = pa.view('u1,u1,u1')[..., 0]
-        pa = np.vectorize(lambda x: self._get_provinces_rgb_map()[tuple(x)],
-                          otypes=[np.uint16])(pa)
-        return pa
+        return id_raster(pa, self._get_provinces_rgb_map())
+
+    @cached_property
+    @disk_cache(CompressedNumpySerializer)
+    def border_classes(self):
+        """uint8 array with the borders of each point of the provinces.bmp as bits of BORDERS: every province border,
+        area, region and country (owner at the start date) borders, and the coast between land and sea provinces. The
+        provinces.bmp colors which are black are borders, as in eu4borderlayer.py"""
+        pa = self.positions_to_provinceID_array
+        size = int(pa.max()) + 1
+        areas = {provinceID: area.name for provinceID, area in self.province_to_area_mapping.items()}
+        regions = {provinceID: self.area_to_region_mapping[area].name for provinceID, area in areas.items()
+                   if area in self.area_to_region_mapping}
+        owners = {provinceID: attributes['Owner'] for provinceID, attributes in self._province_attributes.items()
+                  if 'Owner' in attributes}
+        sea = {provinceID: self.get_province_type(provinceID) in ['Sea', 'Inland sea', 'Open sea']
+               for provinceID in self.all_provinceIDs}
+        always = np.zeros(size, bool)
+        for color, provinceID in self._get_provinces_rgb_map().items():
+            if provinceID < size and not any(color):
+                always[provinceID] = True
+        return border_bits(pa, [group_lut(groups, size) for groups in [areas, regions, owners, sea]], always)
 
     @cached_property
     @disk_cache()
     def all_provinceIDs(self):
         """all ids including water and wasteland, but not provinces in the RNW"""
-        province_positions = self.positions_to_provinceID_array
-        provinceIDs = []
-        for i in range(1, self.max_provinces):
-            if i in self.random_only:
-                continue
-            # check if province exists in the province map
-            prov_indices = np.nonzero(province_positions == i)
-            if not len(prov_indices[0]):
-                continue
-            provinceIDs.append(i)
-        return provinceIDs
+        # number of pixels of each province in the province map
+        pixel_counts = np.bincount(self.positions_to_provinceID_array.ravel(),
+                                   minlength=self.max_provinces)
+        return [i for i in range(1, self.max_provinces)
+                if i not in self.random_only and pixel_counts[i]]
 
     @cached_property
     def all_provinces(self) -> dict[int, Province]:
@@ -127,15 +156,17 @@ class Eu4MapParser(Eu4Parser):
         # the code is valid, because Image implements __array_interface__
         # noinspection PyTypeChecker
         ta = np.array(Image.open(str(self.map_path('terrain'))))
+        # terrain histogram of every province in one pass
+        terrain_counts = np.bincount(pa.ravel().astype(np.int64) * 256 +
+                                     ta.ravel(),
+                                     minlength=self.max_provinces * 256)
+        main_terrain = terrain_counts.reshape(-1, 256).argmax(axis=1)
 
         for number in self.all_provinceIDs:
             if number in is_inland_sea:
                 # skip provinces which were already set by a terrain override
                 continue
-            prov_indices = np.nonzero(pa == number)
-            if len(prov_indices[0]):
-                terrain_num = np.argmax(np.bincount(ta[prov_indices]))
-                is_inland_sea[number] = terrain_num in inland_sea_nums
+            is_inland_sea[number] = main_terrain[number] in inland_sea_nums
         return [provinceID
                 for provinceID, province_is_inland_sea in is_inland_sea.items()
                 if province_is_inland_sea]
@@ -517,30 +548,27 @@ class Eu4MapParser(Eu4Parser):
         return self.adjacency_map[provinceID]
 
     @cached_property
-    @disk_cache()
+    @disk_cache(NumpySerializer)
+    def adjacent_province_pairs(self):
+        """array of the pairs (a, b), a < b, of provinceIDs which border
+        each other"""
+        # tests indicate that diagonal pixels don't count as adjacent
+        # examples:
+        # Halmaheran Sea(1400) - Flores Sea(1357)
+        # Stadacona (994) - Pekuakamiulnuatsh (2579)
+        return adjacent_pairs(self.positions_to_provinceID_array)
+
+    @cached_property
     def adjacency_map(self):
         """dictionary between provinceIDs and a set of adjacent provinceIDs"""
-        id_map = self.positions_to_provinceID_array
-        max_x = len(id_map[0])
-        max_y = len(id_map)
-        adjacency_map = {provinceID: set() for provinceID in self.all_provinceIDs}
-        for x in range(max_x):
-            for y in range(max_y):
-                provinceID = id_map[y][x]
-                if x > 0:
-                    adjacency_map[provinceID].add(id_map[y][x - 1])
-                if y > 0:
-                    adjacency_map[provinceID].add(id_map[y - 1][x])
-                if x < max_x - 1:
-                    adjacency_map[provinceID].add(id_map[y][x + 1])
-                if y < max_y - 1:
-                    adjacency_map[provinceID].add(id_map[y + 1][x])
-                # tests indicate that diagonal pixels don't count as adjacent
-                # examples:
-                # Halmaheran Sea(1400) - Flores Sea(1357)
-                # Stadacona (994) - Pekuakamiulnuatsh (2579)
-
-        return adjacency_map
+        return adjacency_sets(self.adjacent_province_pairs,
+                              self.all_provinceIDs)
+
+    @cached_property
+    def adjacency_csr(self):
+        """(indptr, indices) such that indices[indptr[i]:indptr[i + 1]] are
+        the provinceIDs adjacent to province i"""
+        return pairs_to_csr(self.adjacent_province_pairs, self.max_provinces)
 
     @cached_property
     def straits(self) -> list[Strait]:
@@ -5,12 +5,14 @@ from collections import OrderedDict
 
 # add the parent folder to the path so that imports work even if the working directory is the eu4 folder
 sys.path.append(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
-from ck2parser import SimpleParser, Obj, String, Number
+from ck2parser import Obj, String, Number
 from localpaths import eu4dir
-from eu4.paths import eu4_version, eu4_major_version
+from locindex import compile_index, merge, yml_entries
+from eu4.paths import eu4_version, eu4_major_version, eu4cachedir
 from eu4.eu4lib import Religion, Idea, IdeaGroup, Policy, Eu4Color, Country, Mission, MissionGroup, GovernmentReform, \
     CultureGroup, Culture, DLC, BaseGame, Estate
 from eu4.cache import disk_cache, cached_property
+from eu4.buildgraph import RecordingParser, record_reads
 
 
 class Eu4Parser:
@@ -24,20 +26,20 @@ class Eu4Parser:
     localizationOverrides = {}
 
     def __init__(self):
-        self.parser = SimpleParser()
+        self.parser = RecordingParser()
         self.parser.basedir = eu4dir
 
     @cached_property
-    @disk_cache()
     def _localisation_dict(self):
-        localisation_dict = {}
-        for path in (eu4dir / 'localisation').glob('*_l_english.yml'):
-            with path.open(encoding='utf-8-sig') as f:
-                for line in f:
-                    match = re.fullmatch(r'\s*([^#\s:]+):\d?\s*"(.*)"[^"]*', line)
-                    if match:
-                        localisation_dict[match.group(1)] = match.group(2)
-        return localisation_dict
+        """the english localisation, compiled into a memory-mapped index in the eu4cachedir
+
+        the last value of a key wins"""
+        sources = sorted((eu4dir / 'localisation').glob('*_l_english.yml'))
+        # the index only reads the sources if they changed
+        record_reads(sources)
+        if not eu4cachedir:
+            return merge(sources, yml_entries, first_wins=False)
+        return compile_index(eu4cachedir / 'locindex' / 'eu4-english', sources, yml_entries, first_wins=False)
 
     def localize(self, key: str, default: str = None) -> str:
         """localize the key from the english eu4 localisation files
@@ -46,5 +46,9 @@ if cachedir:
     # the cache gets invalidated if the game changes while the version number is unchanged(this can happen in
     # unreleased versions). The re.sub is to avoid potential problems with weird characters in the version string
     eu4cachedir = cachedir / re.sub(r'[^a-zA-Z0-9._]', '_', eu4_full_version())
+    # the disk cache (see eu4.cache) tracks the files which each value was computed from, so it can be kept across
+    # versions and only the values whose files changed are computed again
+    eu4diskcachedir = cachedir / 'eu4'
 else:
     eu4cachedir = None
+    eu4diskcachedir = None
@@ -1,10 +1,13 @@
+from contextlib import contextmanager
 from tempfile import TemporaryDirectory, mkstemp
+import hashlib
 import os
+import sqlite3
 import subprocess
 import re
 
 from common.wiki import WikiTextFormatter
-from eu4.paths import eu4_major_version
+from eu4.paths import eu4_major_version, eu4_full_version, eu4cachedir
 
 
 def get_SVersion_header(scope=None):
@@ -28,59 +31,163 @@ def get_version_header():
     """
     return '{{Version|' + eu4_major_version() + '}}'
 
+class PdxparseCache:
+    """wikitext which pdxparse generated, keyed by a hash of the scope, the snippet and the eu4 version
+
+    it is stored in a sqlite database in the eu4cachedir or only kept in memory if the eu4cachedir is None
+    """
+
+    def __init__(self):
+        if eu4cachedir:
+            eu4cachedir.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(eu4cachedir / 'pdxparse.sqlite'))
+            self.db.execute('CREATE TABLE IF NOT EXISTS wikitext (hash TEXT PRIMARY KEY, wikitext TEXT)')
+        else:
+            self.db = None
+        self.memory = {}
+
+    @staticmethod
+    def _hash(scope, snippet):
+        return hashlib.sha256('\0'.join([scope, snippet, eu4_full_version()]).encode()).hexdigest()
+
+    def get_many(self, snippets):
+        """dict of each cached (scope, snippet) pair to its wikitext"""
+        hashes = {self._hash(*snippet): snippet for snippet in snippets}
+        found = {hashes[h]: self.memory[h] for h in hashes if h in self.memory}
+        missing = [h for h in hashes if h not in self.memory]
+        if self.db:
+            for i in range(0, len(missing), 500):
+                batch = missing[i:i + 500]
+                for h, wikitext in self.db.execute('SELECT hash, wikitext FROM wikitext WHERE hash IN ({})'.format(
+                        ', '.join('?' * len(batch))), batch):
+                    self.memory[h] = found[hashes[h]] = wikitext
+        return found
+
+    def update(self, results):
+        """store a dict of (scope, snippet) pairs to their wikitext"""
+        rows = [(self._hash(*snippet), wikitext) for snippet, wikitext in results.items()]
+        self.memory.update(rows)
+        if self.db:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO wikitext VALUES (?, ?)', rows)
+
+
 class WikiTextConverter:
     """Uses pdxparse to convert game code to wikitext.
 
     pdxparse has to be in the path so that it can be called by this class.
+
+    The results are cached by snippet, so that pdxparse only has to convert snippets which it didn't see before
+    in the same eu4 version. See batch() to convert the snippets of several callers with a single pdxparse call
     """
 
+    # pdxparse argument for each parameter of to_wikitext, in the order in which they are passed
+    scope_arguments = ['--countryscope', '--provincescope', '--modifiers']
+
+    _cache = None
+    # the (scope, snippet) pairs which were requested in a batch() block, or None outside of it
+    _pending = None
+    # whether to_wikitext filled in placeholders in the batch() block since the last start_collecting()
+    _placeholders = False
+
+    @classmethod
+    def _get_cache(cls):
+        if cls._cache is None:
+            cls._cache = PdxparseCache()
+        return cls._cache
+
     def to_wikitext(self, country_scope=None, province_scope=None, modifiers=None, strip_icon_sizes=False):
         """calls pdxparse to convert the values of the parameter dicts from strings in pdxscript to wikitext. the dicts are modified in place
 
             most of the slowness of this function is the overhead from calling pdxparse
             and letting it parse the normal game files, so it is best to only call it once
-            with everything which needs to be converted
+            with everything which needs to be converted. Snippets which were converted before
+            are taken from the cache without calling pdxparse
 
             if strip_icon_sizes is True, the 28px which pdxparse adds to an icon template is removed
         """
+        snippets = {}
+        for scope, dictionary in zip(self.scope_arguments, [country_scope, province_scope, modifiers]):
+            if dictionary:
+                for key in dictionary:
+                    snippets[scope, id(dictionary), key] = self.remove_surrounding_brackets(dictionary[key])
+        wanted = {(scope, snippet) for (scope, _, _), snippet in snippets.items() if len(snippet) > 0}
+        results = self._get_cache().get_many(wanted)
+        missing = wanted - results.keys()
+        if missing and WikiTextConverter._pending is not None:
+            # the unconverted snippets stand in for their wikitext, so that the caller gets to its other to_wikitext
+            # calls. It has to run again after the batch
+            WikiTextConverter._pending.update(missing)
+            WikiTextConverter._placeholders = True
+            results.update((snippet, snippet[1]) for snippet in missing)
+        elif missing:
+            results.update(self._run_pdxparse(missing))
+
+        for scope, dictionary in zip(self.scope_arguments, [country_scope, province_scope, modifiers]):
+            if dictionary:
+                for key in dictionary:
+                    snippet = snippets[scope, id(dictionary), key]
+                    dictionary[key] = results[scope, snippet] if len(snippet) > 0 else ''
+
+        # self._strip_whitespace(country_scope)
+        # self._strip_whitespace(province_scope)
+        # self._strip_whitespace(modifiers)
+
+        if strip_icon_sizes:
+            self._strip_icon_sizes(country_scope)
+            self._strip_icon_sizes(province_scope)
+            self._strip_icon_sizes(modifiers)
+
+    @classmethod
+    @contextmanager
+    def batch(cls):
+        """collect the conversions of all to_wikitext calls in the with block and run pdxparse once for all of them
+
+        to_wikitext calls which only need cached snippets work as usual. The others fill in the unconverted snippets
+        as placeholders, and they are converted and cached after the block, so that running the same code again gets
+        all of them from the cache. Results which contain placeholders must not be written, see has_placeholders()
+        """
+        cls._pending = set()
+        cls._placeholders = False
+        try:
+            yield
+            pending = cls._pending
+        finally:
+            cls._pending = None
+            cls._placeholders = False
+        if pending:
+            cls._run_pdxparse(pending)
+
+    @classmethod
+    def start_collecting(cls):
+        """start tracking the placeholders of one caller in a batch() block"""
+        cls._placeholders = False
+
+    @classmethod
+    def has_placeholders(cls):
+        """whether to_wikitext filled in placeholders since the last start_collecting() in this batch() block"""
+        return cls._placeholders
+
+    @classmethod
+    def _run_pdxparse(cls, snippets):
+        """convert (scope, snippet) pairs with one pdxparse call and return and cache a dict of them to the wikitext"""
         with TemporaryDirectory() as tmpfolder:
             inputfolder = tmpfolder + '/in'
             os.mkdir(inputfolder)
             outputfolder = tmpfolder + '/output/Europa Universalis IV'
-            self._replace_values_by_filenames(inputfolder, country_scope)
-            self._replace_values_by_filenames(inputfolder, province_scope)
-            self._replace_values_by_filenames(inputfolder, modifiers)
+            filenames = {snippet: cls._create_temp_file(inputfolder, snippet[1]) for snippet in
+                         sorted(snippets, key=lambda snippet: cls.scope_arguments.index(snippet[0]))}
             pdxparse_arguments = ['pdxparse', '--nowait', '-e']
-            if country_scope:
-                for file in country_scope.values():
-                    if len(file) > 0:
-                        pdxparse_arguments.append('--countryscope')
-                        pdxparse_arguments.append(file)
-            if province_scope:
-                for file in province_scope.values():
-                    if len(file) > 0:
-                        pdxparse_arguments.append('--provincescope')
-                        pdxparse_arguments.append(file)
-            if modifiers:
-                for file in modifiers.values():
-                    if len(file) > 0:
-                        pdxparse_arguments.append('--modifiers')
-                        pdxparse_arguments.append(file)
+            for (scope, _), file in filenames.items():
+                pdxparse_arguments.append(scope)
+                pdxparse_arguments.append(file)
 
             subprocess.run(pdxparse_arguments, check=True, cwd=tmpfolder)
 
-            self._replace_filenames_with_values(outputfolder, country_scope)
-            self._replace_filenames_with_values(outputfolder, province_scope)
-            self._replace_filenames_with_values(outputfolder, modifiers)
-
-            # self._strip_whitespace(country_scope)
-            # self._strip_whitespace(province_scope)
-            # self._strip_whitespace(modifiers)
-
-            if strip_icon_sizes:
-                self._strip_icon_sizes(country_scope)
-                self._strip_icon_sizes(province_scope)
-                self._strip_icon_sizes(modifiers)
+            results = {snippet: cls._readfile(outputfolder + file + '/' + os.path.basename(file))
+                       for snippet, file in filenames.items()}
+        cls._get_cache().update(results)
+        return results
 
     def add_indent(self, wikilist):
         return re.sub(r'^\*', '**', wikilist, flags=re.MULTILINE)
@@ -113,13 +220,15 @@ class WikiTextConverter:
         return_value = WikiTextConverter.remove_indent(wikilist)
         return WikiTextConverter.remove_superfluous_indents(return_value)
 
-    def _create_temp_file(self, folder, contents):
+    @staticmethod
+    def _create_temp_file(folder, contents):
         fp, filename = mkstemp(suffix='.txt', dir=folder)
         with os.fdopen(fp, mode='w') as file:
             file.write(contents)
         return filename
 
-    def _readfile(self, filename):
+    @staticmethod
+    def _readfile(filename):
         with open(filename) as file:
             return file.read()
 
@@ -135,21 +244,6 @@ class WikiTextConverter:
         else:
             return string
 
-    def _replace_values_by_filenames(self, folder, dictionary):
-        if dictionary:
-            for key in dictionary:
-                value = self.remove_surrounding_brackets(dictionary[key])
-                if len(value) > 0:
-                    dictionary[key] = self._create_temp_file(folder, value)
-                else:
-                    dictionary[key] = ''
-
-    def _replace_filenames_with_values(self, folder, dictionary):
-        if dictionary:
-            for key in dictionary:
-                if len(dictionary[key]) > 0:
-                    dictionary[key] = self._readfile(folder + dictionary[key] + '/' + os.path.basename(dictionary[key]))
-
     def _strip_icon_sizes(self, dictionary):
         if dictionary:
             for key in dictionary:
@@ -2,8 +2,9 @@
 
 import numpy as np
 from PIL import Image
-from ck2parser import rootpath, csv_rows, SimpleParser
+from ck2parser import rootpath, SimpleParser
 from localpaths import eu4dir
+from provincemap import ProvinceMap
 from print_time import print_time
 
 def map(where, name='', crop=True):
@@ -38,19 +39,7 @@ parser.basedir = eu4dir
 default_tree = parser.parse_file('map/default.map')
 max_provinces = default_tree['max_provinces'].val
 map_path = lambda key: parser.file('map/' + default_tree[key].val)
-rgb_number_map = {}
-for row in csv_rows(map_path('definitions')):
-    try:
-        number = int(row[0])
-    except ValueError:
-        continue
-    if number < max_provinces:
-        rgb = tuple(np.uint8(row[1:4]))
-        rgb_number_map[rgb] = np.uint16(number)
-prov_rgb = np.array(Image.open(str(map_path('provinces'))))
-prov_rgb = prov_rgb.view('u1,u1,u1')[..., 0]
-prov_id = np.vectorize(lambda x: rgb_number_map[tuple(x)],
-                       otypes=[np.uint16])(prov_rgb)
+prov_id = ProvinceMap(parser).ids
 borders_path = rootpath / 'eu4borderlayer.png'
 borders = Image.open(str(borders_path))
 prov_color_lut_base = np.full(max_provinces, colors['land'], '3u1')
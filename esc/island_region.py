@@ -5,9 +5,10 @@ import re
 import sys
 import networkx as nx
 import numpy as np
-from PIL import Image
 from ck2parser import (rootpath, csv_rows, SimpleParser, is_codename, Pair,
                        Number, TopLevel, FullParser)
+from provincemap import ProvinceMap
+from raster import adjacent_pairs
 from print_time import print_time
 
 
@@ -16,18 +17,9 @@ def main():
     parser = SimpleParser()
     if len(sys.argv) > 1:
         parser.moddirs.append(Path(sys.argv[1]))
-    rgb_id_map = {}
-    id_name_map = {}
     default_tree = parser.parse_file('map/default.map')
-    max_provinces = default_tree['max_provinces'].val
-    for row in csv_rows(parser.file('map/' + default_tree['definitions'].val)):
-        try:
-            province = int(row[0])
-        except ValueError:
-            continue
-        if province < max_provinces:
-            rgb_id_map[tuple(np.uint8(row[1:4]))] = province
-            id_name_map[province] = row[4]
+    province_map = ProvinceMap(parser)
+    id_name_map = province_map.id_name_map
     id_county_map = {}
     county_id_map = {}
     for path in parser.files('history/provinces/* - *.txt'):
@@ -41,16 +33,12 @@ def main():
             id_county_map[prov_id] = county
             county_id_map[county] = prov_id
     province_graph = nx.Graph()
-    provinces_path = parser.file('map/' + default_tree['provinces'].val)
-    a = np.array(Image.open(str(provinces_path)))
-    for i, j in np.ndindex(a.shape[0] - 1, a.shape[1] - 1):
-        province = rgb_id_map.get(tuple(a[i, j]))
-        if province in id_county_map:
-            province_graph.add_node(province)
-            for coords in ((i, j + 1), (i + 1, j)):
-                neighbor = rgb_id_map.get(tuple(a[coords]))
-                if neighbor != province and neighbor in id_county_map:
-                    province_graph.add_edge(province, neighbor)
+    province_graph.add_nodes_from(province for province in
+                                  np.flatnonzero(province_map.counts).tolist()
+                                  if province in id_county_map)
+    province_graph.add_edges_from(
+        (x, y) for x, y in adjacent_pairs(province_map.ids).tolist()
+        if x in id_county_map and y in id_county_map)
     for row in csv_rows(parser.file('map/' + default_tree['adjacencies'].val)):
         try:
             one, two = int(row[0]), int(row[1])
@@ -0,0 +1,183 @@
+import array
+import collections.abc
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import re
+import struct
+
+# compiled localisation for the ck2, ck3 and eu4 scripts. All localisation of
+# one game, mod set and language is merged into one file holding the entries
+# in source order, their keys sorted for binary search and a heap of the utf-8
+# keys and values. The file is mapped into memory, so opening it costs
+# nothing no matter how many scripts use it, and the entries of each source
+# file are cached separately so that only changed files are read again.
+
+MAGIC = b'LOCIDX\0\1'
+# magic, manifest length, number of entries
+HEADER = struct.Struct('<8sII')
+
+YML_LINE = re.compile(r'\s*([^#\s:]+):\d?\s*"(.*)"[^"]*')
+
+
+def yml_entries(path):
+    """the (key, value) pairs of a ck3 or eu4 localisation file"""
+    entries = []
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            match = YML_LINE.fullmatch(line)
+            if match:
+                entries.append(match.groups())
+    return entries
+
+
+def merge(sources, read_source, first_wins=True):
+    """dict of every entry of the source files, in order. If a key appears
+    more than once, its first value wins or, unless first_wins, its last"""
+    result = {}
+    for path in sources:
+        for key, value in read_source(path):
+            if not first_wins or key not in result:
+                result[key] = value
+    return result
+
+
+def _stat(path):
+    st = os.stat(path)
+    return [str(path), st.st_mtime_ns, st.st_size]
+
+
+def _cached_entries(fragment_dir, stat, read_source):
+    """entries of one source file, read again only if it changed"""
+    name = hashlib.md5('{}:{}'.format(read_source.__name__, stat[0])
+                       .encode()).hexdigest()
+    fragment = fragment_dir / name
+    try:
+        with fragment.open('rb') as f:
+            mtime, size, entries = pickle.load(f)
+        if [mtime, size] == stat[1:]:
+            return entries
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError, ValueError):
+        pass
+    entries = read_source(stat[0])
+    tmp = fragment.with_name(fragment.name + '.tmp')
+    with tmp.open('wb') as f:
+        pickle.dump((stat[1], stat[2], entries), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, fragment)
+    return entries
+
+
+def _write(path, manifest, entries):
+    keys = [key.encode() for key in entries]
+    values = [value.encode() for value in entries.values()]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    key_offsets = array.array('I', [0])
+    value_offsets = array.array('I', [0])
+    for key, value in zip(keys, values):
+        key_offsets.append(key_offsets[-1] + len(key))
+        value_offsets.append(value_offsets[-1] + len(value))
+    manifest = json.dumps(manifest).encode()
+    # pad the manifest so that the offset tables are aligned
+    manifest += b' ' * (-(HEADER.size + len(manifest)) % 4)
+    tmp = path.with_name(path.name + '.tmp')
+    with tmp.open('wb') as f:
+        f.write(HEADER.pack(MAGIC, len(manifest), len(keys)))
+        f.write(manifest)
+        f.write(array.array('I', order).tobytes())
+        f.write(key_offsets.tobytes())
+        f.write(value_offsets.tobytes())
+        f.writelines(keys)
+        f.writelines(values)
+    os.replace(tmp, path)
+
+
+class LocIndex(collections.abc.Mapping):
+    """read-only dict of a compiled localisation file. Iterates in source
+    order."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, manifest_len, n = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError('{} is not a localisation index'.format(path))
+        start = HEADER.size + manifest_len
+        self.manifest = json.loads(self._mmap[HEADER.size:start])
+        view = memoryview(self._mmap)
+        self._n = n
+        self._order = view[start:start + 4 * n].cast('I')
+        start += 4 * n
+        self._key_offsets = view[start:start + 4 * (n + 1)].cast('I')
+        start += 4 * (n + 1)
+        self._value_offsets = view[start:start + 4 * (n + 1)].cast('I')
+        self._keys_start = start + 4 * (n + 1)
+        self._values_start = self._keys_start + self._key_offsets[n]
+
+    def _key(self, i):
+        return self._mmap[self._keys_start + self._key_offsets[i]:
+                          self._keys_start + self._key_offsets[i + 1]]
+
+    def _find(self, key):
+        """entry number of key, or -1"""
+        key = key.encode()
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(self._order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._key(self._order[lo]) == key:
+            return self._order[lo]
+        return -1
+
+    def __getitem__(self, key):
+        i = self._find(key) if isinstance(key, str) else -1
+        if i < 0:
+            raise KeyError(key)
+        return self._mmap[self._values_start + self._value_offsets[i]:
+                          self._values_start + self._value_offsets[i + 1]
+                          ].decode()
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self._find(key) >= 0
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._key(i).decode()
+
+    def close(self):
+        self._order.release()
+        self._key_offsets.release()
+        self._value_offsets.release()
+        self._mmap.close()
+
+
+def compile_index(path, sources, read_source, first_wins=True):
+    """LocIndex of the source files at path, merged as by merge. It is
+    rebuilt if the list of sources or any of them changed since it was
+    written, reading only the changed sources again."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    manifest = {'first_wins': first_wins,
+                'sources': [_stat(source) for source in sources]}
+    try:
+        index = LocIndex(path)
+        if index.manifest == manifest:
+            return index
+        # release the mapping so that the file can be replaced
+        index.close()
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+    fragment_dir = path.parent / 'fragments'
+    fragment_dir.mkdir(exist_ok=True)
+    entries = merge(manifest['sources'],
+                    lambda stat: _cached_entries(fragment_dir, stat,
+                                                 read_source),
+                    first_wins)
+    _write(path, manifest, entries)
+    return LocIndex(path)
@@ -0,0 +1,146 @@
+import concurrent.futures
+import sys
+import time
+
+# parse -> transform -> write for scripts which rewrite a mod, such as
+# ziji_build. Transforms are declared per glob, every file is parsed once in
+# a single parse_paths stream across all globs, so that the worker pool
+# parses later globs while earlier ones are transformed, and only files
+# whose content changed are written.
+
+
+class Stage:
+    """the files matching glob and the transforms to apply to each of them.
+    A transform is called with (path, tree) and returns whether it changed
+    the tree. Changed trees are written if write is true; with rewrite,
+    every tree is written, whether or not it changed. start is called before
+    the first file of the stage is transformed, after all files of the
+    earlier stages were."""
+
+    def __init__(self, glob, transforms, write=True, rewrite=False,
+                 start=None):
+        self.glob = glob
+        self.transforms = transforms
+        self.write = write or rewrite
+        self.rewrite = rewrite
+        self.start = start
+        self.files = 0
+        self.changed = 0
+        self.written = 0
+        self.bytes_written = 0
+        # seconds spent parsing, transforming, serializing and writing
+        self.times = dict.fromkeys(['parse', 'transform', 'serialize',
+                                    'write'], 0.0)
+
+    def report(self):
+        def rate(step):
+            seconds = self.times[step]
+            if not seconds:
+                return '{:.3g} s'.format(seconds)
+            return '{:.3g} s ({:.0f} files/s)'.format(seconds,
+                                                     self.files / seconds)
+        return ('{}: {} files, {} changed, {} written ({} kB); parse {}, '
+                'transform {}, serialize {}, write {}').format(
+            self.glob, self.files, self.changed, self.written,
+            self.bytes_written // 1024, rate('parse'), rate('transform'),
+            rate('serialize'), rate('write'))
+
+
+def _write_if_changed(outpath, data):
+    """write data to outpath unless it already holds it. Return whether it
+    was written"""
+    try:
+        if outpath.read_bytes() == data:
+            return False
+    except FileNotFoundError:
+        pass
+    outpath.parent.mkdir(parents=True, exist_ok=True)
+    outpath.write_bytes(data)
+    return True
+
+
+class Pipeline:
+    """stages of transforms run over the files of a parser, see Stage.
+    outpath maps an input path to the path to write it to; without it,
+    nothing is written. Files are parsed in a pool of processes if
+    workers > 1 (see SimpleParser.parse_paths) and written in a thread pool.
+    """
+
+    def __init__(self, parser, outpath=None, workers=1, encoding='cp1252',
+                 newline='\r\n'):
+        self.parser = parser
+        self.outpath = outpath
+        self.workers = workers
+        self.encoding = encoding
+        self.newline = newline
+        self.stages = []
+
+    def add(self, glob, *transforms, write=True, rewrite=False, start=None):
+        stage = Stage(glob, transforms, write, rewrite, start)
+        self.stages.append(stage)
+        return stage
+
+    def run(self, report=True):
+        """run every stage in order, printing the throughput of each to
+        stderr if report is true"""
+        jobs = []
+        for stage in self.stages:
+            jobs.extend((path, stage) for path in self.parser.files(stage.glob)
+                        if path.is_file())
+        pending = []
+        with concurrent.futures.ThreadPoolExecutor(
+                max(self.workers, 4)) as writers:
+            trees = self.parser.parse_paths([path for path, _ in jobs],
+                                            self.workers)
+            stages = iter(self.stages)
+            current = None
+            for _, stage in jobs:
+                while current is not stage:
+                    current = next(stages)
+                    if current.start:
+                        current.start()
+                start = time.perf_counter()
+                path, tree = next(trees)
+                stage.times['parse'] += time.perf_counter() - start
+                write = self._process(stage, path, tree, writers)
+                if write:
+                    pending.append(write)
+            # stages without files still get started
+            for current in stages:
+                if current.start:
+                    current.start()
+            for stage, future, size in pending:
+                written, seconds = future.result()
+                stage.times['write'] += seconds
+                if written:
+                    stage.written += 1
+                    stage.bytes_written += size
+        if report:
+            for stage in self.stages:
+                print(stage.report(), file=sys.stderr)
+
+    def _process(self, stage, path, tree, writers):
+        """transform a tree and submit its write, returning (stage, future,
+        size) or None if it isn't written"""
+        stage.files += 1
+        start = time.perf_counter()
+        changed = False
+        for transform in stage.transforms:
+            changed |= bool(transform(path, tree))
+        stage.changed += changed
+        stage.times['transform'] += time.perf_counter() - start
+        if not (self.outpath and stage.write and
+                (changed or stage.rewrite)):
+            return None
+        start = time.perf_counter()
+        text = tree.str(self.parser)
+        if self.newline != '\n':
+            text = text.replace('\n', self.newline)
+        data = text.encode(self.encoding)
+        stage.times['serialize'] += time.perf_counter() - start
+
+        def write(outpath=self.outpath(path)):
+            start = time.perf_counter()
+            written = _write_if_changed(outpath, data)
+            return written, time.perf_counter() - start
+        return stage, writers.submit(write), len(data)
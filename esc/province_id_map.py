@@ -5,6 +5,7 @@ import sys
 import numpy as np
 from PIL import Image, ImageFont, ImageDraw
 from ck2parser import rootpath, csv_rows, SimpleParser
+from provincemap import ProvinceMap
 from print_time import print_time
 
 @print_time
@@ -13,7 +14,6 @@ def main():
     if len(sys.argv) > 1:
         parser.moddirs.append(Path(sys.argv[1]))
     default_tree = parser.parse_file('map/default.map')
-    provinces_path = parser.file('map/' + default_tree['provinces'].val)
     max_provinces = default_tree['max_provinces'].val
     inhabited_provs = set()
     colors = {
@@ -22,10 +22,9 @@ def main():
         'desert': np.uint8((36, 36, 36)),
         'mountains': np.uint8((0, 0, 0))
     }
-    rgb_number_map = {
-        tuple(np.uint8((0, 0, 0))): np.uint16(0),
-        tuple(np.uint8((255, 255, 255))): np.uint16(max_provinces)
-    }
+    # black is province 0 like any other unknown color
+    province_map = ProvinceMap(parser,
+                               extra_colors={(255, 255, 255): max_provinces})
     prov_color_lut = np.full(max_provinces + 1, colors['desert'], '3u1')
     prov_color_lut[0] = colors['mountains']
     prov_color_lut[max_provinces] = colors['sea']
@@ -35,8 +34,6 @@ def main():
         except ValueError:
             continue
         if number < max_provinces:
-            rgb = tuple(np.uint8(row[1:4]))
-            rgb_number_map[rgb] = np.uint16(number)
             path = 'history/provinces/{} - {}.txt'.format(number, row[4])
             try:
                 if 'title' in parser.parse_file(path).dictionary:
@@ -50,17 +47,16 @@ def main():
             prov_color_lut[i:j + 1] = colors['sea']
     uninhabited_provs = set(range(1, max_provinces)) - inhabited_provs
 
-    image = Image.open(str(provinces_path))
-    a = np.array(image).view(dtype='u1,u1,u1')[..., 0]
-    b = np.vectorize(lambda x: rgb_number_map[tuple(x)], otypes=[np.uint16])(a)
+    b = province_map.ids
+    height, width = b.shape
     font = ImageFont.truetype(str(rootpath / 'ck2utils/esc/NANOTYPE.ttf'), 16)
     mod = parser.moddirs[0].name.lower() + '_' if parser.moddirs else ''
     borders_path = rootpath / (mod + 'borderlayer.png')
     borders = Image.open(str(borders_path))
 
     for provs, mode in [(inhabited_provs, ''), (uninhabited_provs, '_water')]:
-        txt = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        lines = Image.new('RGBA', image.size, (0, 0, 0, 0))
+        txt = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        lines = Image.new('RGBA', (width, height), (0, 0, 0, 0))
         draw_txt = ImageDraw.Draw(txt)
         draw_lines = ImageDraw.Draw(lines)
         maxlen = len(str(max(provs)))
@@ -69,20 +65,19 @@ def main():
         for number in sorted(provs):
             print('\r' + str(number), end='', file=sys.stderr)
             size = len(str(number)) * 4 - 1, 5
-            c = np.nonzero(b == number)
-            if len(c[0]) == 0:
+            if not province_map.counts[number]:
                 continue
-            center = np.mean(c[1]), np.mean(c[0])
+            center = province_map.centroids[number]
             pos = [int(round(max(0, min(center[0] - size[0] / 2,
-                                        image.width - size[0])))),
+                                        width - size[0])))),
                    int(round(max(0, min(center[1] - size[1] / 2,
-                                        image.height - size[1]))))]
+                                        height - size[1]))))]
             pos[2:] = pos[0] + size[0], pos[1] + size[1]
             if not e[size][pos[1], pos[0]]:
-                x1, x2 = max(0, pos[0] - 1), min(pos[0] + 2, image.width)
-                y1, y2 = max(0, pos[1] - 1), min(pos[1] + 2, image.height)
+                x1, x2 = max(0, pos[0] - 1), min(pos[0] + 2, width)
+                y1, y2 = max(0, pos[1] - 1), min(pos[1] + 2, height)
                 if not np.any(e[size][y1:y2, x1:x2]):
-                    x1, y1, (x2, y2) = 0, 0, image.size
+                    x1, y1, x2, y2 = 0, 0, width, height
                 f = np.nonzero(e[size][y1:y2, x1:x2])
                 g = (f[0] - pos[1]) ** 2 + (f[1] - pos[0]) ** 2
                 pos[:2] = np.transpose(f)[np.argmin(g)][::-1] + [x1, y1]
@@ -96,6 +91,10 @@ def main():
             x = int(round(pos[0] + size[0] / 2))
             y = int(round(pos[1] + size[1] / 2))
             if b[y, x] != number:
+                # pixels of the province, searched within its bounding box
+                left, top, right, bottom = province_map.bboxes[number]
+                c = np.nonzero(b[top:bottom + 1, left:right + 1] == number)
+                c = c[0] + top, c[1] + left
                 d = (c[0] - y) ** 2 + (c[1] - x) ** 2
                 dest = tuple(np.transpose(c)[np.argmin(d)][::-1])
                 start = (max(pos[0] - 1, min(dest[0], pos[2])),
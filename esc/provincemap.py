@@ -0,0 +1,74 @@
+import hashlib
+import numpy as np
+from PIL import Image
+from ck2parser import cachedir, csv_rows
+from raster import bboxes, color_index, color_ids
+
+
+class ProvinceMap:
+    """The provinces bitmap of map/default.map as arrays, cached on disk
+    under a hash of the bitmap and the definitions.
+
+    colors: (k, 3) array of the distinct colors in the bitmap
+    color_index: (h, w) array, index into colors of each pixel
+    ids: (h, w) array, province id of each pixel; colors which are neither
+        in the definitions nor in extra_colors get 0
+    counts: number of pixels of each id
+    bboxes: (x0, y0, x1, y1) of each id, inclusive, or -1s if it has no pixels
+    centroids: mean (x, y) of the pixels of each id, or nans
+    """
+
+    version = 1
+    arrays = ['colors', 'color_index', 'ids', 'counts', 'bboxes', 'centroids']
+
+    def __init__(self, parser, extra_colors=None):
+        default_tree = parser.parse_file('map/default.map')
+        self.max_provinces = default_tree['max_provinces'].val
+        self.provinces_path = parser.file(
+            'map/' + default_tree['provinces'].val)
+        self.definitions_path = parser.file(
+            'map/' + default_tree['definitions'].val)
+        self.rgb_id_map = {}
+        self.id_name_map = {}
+        for row in csv_rows(self.definitions_path):
+            try:
+                number = int(row[0])
+            except ValueError:
+                continue
+            if number < self.max_provinces:
+                self.rgb_id_map[tuple(np.uint8(row[1:4]).tolist())] = number
+                self.id_name_map[number] = row[4]
+        self.rgb_id_map.update(extra_colors or {})
+        self.size = max([self.max_provinces] +
+                        [x + 1 for x in self.rgb_id_map.values()])
+        m = hashlib.md5()
+        m.update(self.provinces_path.read_bytes())
+        m.update(self.definitions_path.read_bytes())
+        m.update(repr((self.version, self.size,
+                       sorted((extra_colors or {}).items()))).encode())
+        cachepath = (cachedir / self.__class__.__name__ /
+                     (m.hexdigest() + '.npz'))
+        try:
+            with np.load(str(cachepath)) as data:
+                for name in self.arrays:
+                    setattr(self, name, data[name])
+        except (OSError, KeyError, ValueError):
+            self.compute()
+            cachepath.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(str(cachepath),
+                     **{name: getattr(self, name) for name in self.arrays})
+
+    def compute(self):
+        rgb = np.array(Image.open(str(self.provinces_path)).convert('RGB'))
+        self.colors, self.color_index = color_index(rgb)
+        self.ids = color_ids(self.colors, self.rgb_id_map,
+                             missing=0)[self.color_index]
+        flat = self.ids.ravel()
+        self.counts = np.bincount(flat, minlength=self.size)
+        present = self.counts > 0
+        ys, xs = np.indices(self.ids.shape, dtype=np.int32).reshape(2, -1)
+        self.centroids = np.full((self.size, 2), np.nan)
+        for axis, coords in enumerate([xs, ys]):
+            sums = np.bincount(flat, weights=coords, minlength=self.size)
+            self.centroids[present, axis] = sums[present] / self.counts[present]
+        self.bboxes = bboxes(self.ids, self.size)
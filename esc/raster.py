@@ -0,0 +1,140 @@
+import numpy as np
+
+# numpy helpers for province bitmaps, shared by the ck2 and eu4 map scripts
+
+
+def color_index(rgb):
+    """(colors, index) where colors is a (k, 3) uint8 array of the distinct
+    colors of an (h, w, 3) rgb array and index is the (h, w) array of each
+    pixel's index into colors"""
+    rgb = rgb[..., :3].astype(np.uint32)
+    keys = rgb[..., 0] << 16 | rgb[..., 1] << 8 | rgb[..., 2]
+    keys, index = np.unique(keys, return_inverse=True)
+    colors = np.stack([keys >> 16, keys >> 8 & 0xff, keys & 0xff], axis=1)
+    index = index.reshape(rgb.shape[:2])
+    if len(colors) <= 1 << 16:
+        index = index.astype(np.uint16)
+    return colors.astype(np.uint8), index
+
+
+def color_ids(colors, rgb_id_map, missing=None, dtype=np.uint16):
+    """array of the id of each row of a colors array. Colors not in
+    rgb_id_map become missing, or raise KeyError if missing is None"""
+    ids = []
+    for c in map(tuple, colors.tolist()):
+        ids.append(rgb_id_map[c] if missing is None else
+                   rgb_id_map.get(c, missing))
+    return np.array(ids, dtype=dtype)
+
+
+def id_raster(rgb, rgb_id_map, missing=None, dtype=np.uint16):
+    """array of the id of each pixel of an (h, w, 3) rgb array, see
+    color_ids"""
+    # look up each distinct color once instead of once per pixel
+    colors, index = color_index(rgb)
+    return color_ids(colors, rgb_id_map, missing, dtype)[index]
+
+
+def bboxes(ids, size):
+    """(size, 4) int32 array of the (x0, y0, x1, y1) inclusive bounding box
+    of each id below size in an (h, w) id array, or -1s for missing ids"""
+    height, width = ids.shape
+    result = np.full((size, 4), -1, np.int32)
+    # the first and last pixel of each id in row-major order give its rows,
+    # in column-major order its columns
+    for order, axis, length in [(ids.ravel(), 1, width),
+                                (ids.T.ravel(), 0, height)]:
+        found, first = np.unique(order, return_index=True)
+        _, last = np.unique(order[::-1], return_index=True)
+        keep = found < size
+        found, first, last = found[keep], first[keep], last[keep]
+        result[found, axis] = first // length
+        result[found, axis + 2] = (len(order) - 1 - last) // length
+    return result
+
+
+def neighbor_views(a):
+    """pairs of views (a, b) such that each b pixel is right of or below the
+    a pixel at the same index. Diagonal pixels don't count as neighbors."""
+    return [(a[:, :-1], a[:, 1:]), (a[:-1], a[1:])]
+
+
+def adjacent_pairs(ids):
+    """(n, 2) int64 array of the distinct id pairs (x, y), x < y, such that a
+    pixel of x borders a pixel of y, sorted"""
+    packed = []
+    for a, b in neighbor_views(ids):
+        border = a != b
+        a = a[border].astype(np.int64)
+        b = b[border].astype(np.int64)
+        packed.append(np.minimum(a, b) << 32 | np.maximum(a, b))
+    packed = np.unique(np.concatenate(packed))
+    return np.stack([packed >> 32, packed & 0xffffffff], axis=1)
+
+
+def adjacency_sets(pairs, nodes=()):
+    """dict of each id to the set of ids adjacent to it, for the given nodes
+    and every id in pairs"""
+    adjacency = {node: set() for node in nodes}
+    for x, y in pairs.tolist():
+        adjacency.setdefault(x, set()).add(y)
+        adjacency.setdefault(y, set()).add(x)
+    return adjacency
+
+
+def pairs_to_csr(pairs, size):
+    """(indptr, indices) such that indices[indptr[i]:indptr[i + 1]] are the
+    ids adjacent to id i, sorted, for ids below size"""
+    both = np.concatenate([pairs, pairs[:, ::-1]])
+    both = both[np.lexsort((both[:, 1], both[:, 0]))]
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(both[:, 0], minlength=size), out=indptr[1:])
+    return indptr, both[:, 1]
+
+
+def group_lut(groups, size, dtype=np.int32):
+    """array of the group number of each id below size, given a dict of ids to
+    hashable groups. Ids without a group get -1"""
+    numbers = {}
+    lut = np.full(size, -1, dtype)
+    for i, group in groups.items():
+        if i < size:
+            lut[i] = numbers.setdefault(group, len(numbers))
+    return lut
+
+
+def border_bits(ids, group_luts=(), always=None, dtype=np.uint8):
+    """(h, w) bitfield of the borders of an (h, w) id array, such as province
+    ids or color indices. A pixel is on a border if its id differs from that
+    of the pixel north, west or northwest of it. Bit 0 marks every border and
+    bit i + 1 the borders between different groups of group_luts[i], an array
+    of the group of each id (see group_lut). Pixels whose id is true in the
+    always array get bit 0 even if they aren't on a border"""
+    height, width = ids.shape
+    bits = np.zeros((height, width), dtype)
+    # compare each shifted view into one scratch mask instead of making
+    # shifted copies of the whole raster
+    differ = np.empty((height, width), bool)
+    for dy, dx in [(1, 0), (0, 1), (1, 1)]:
+        here = ids[dy:, dx:]
+        there = ids[:height - dy, :width - dx]
+        mask = differ[:height - dy, :width - dx]
+        np.not_equal(here, there, out=mask)
+        ys, xs = np.nonzero(mask)
+        # the groups are only looked up for the few pixels on a border
+        a, b = here[ys, xs], there[ys, xs]
+        field = np.ones(len(ys), dtype)
+        for bit, lut in enumerate(group_luts, 1):
+            field |= (lut[a] != lut[b]).astype(dtype) << bit
+        bits[dy:, dx:][ys, xs] |= field
+    if always is not None and always.any():
+        bits[always[ids]] |= 1
+    return bits
+
+
+def border_layer(bits, mask=1):
+    """(h, w, 4) rgba array which is opaque black where bits has any bit of
+    mask, and transparent elsewhere"""
+    layer = np.zeros(bits.shape + (4,), np.uint8)
+    layer[..., 3][(bits & mask) != 0] = 255
+    return layer
@@ -7,8 +7,8 @@ from pathlib import Path
 import sys
 import networkx as nx
 import numpy as np
-from PIL import Image
 from ck2parser import rootpath, csv_rows, SimpleParser
+from provincemap import ProvinceMap
 from print_time import print_time
 
 
@@ -17,18 +17,9 @@ def main():
     modpath = (Path(sys.argv[1])
                if len(sys.argv) > 1 else rootpath / 'SWMH-BETA/SWMH')
     parser = SimpleParser(modpath)
-    rgb_id_map = {}
-    id_name_map = {}
     default_tree = parser.parse_file('map/default.map')
-    max_provinces = default_tree['max_provinces'].val
-    for row in csv_rows(parser.file('map/' + default_tree['definitions'].val)):
-        try:
-            province = int(row[0])
-        except ValueError:
-            continue
-        if province < max_provinces:
-            rgb_id_map[tuple(np.uint8(row[1:4]))] = province
-            id_name_map[province] = row[4]
+    province_map = ProvinceMap(parser)
+    id_name_map = province_map.id_name_map
     id_county_map = {}
     for path in parser.files('history/provinces/* - *.txt'):
         prov_id, prov_name = path.stem.split(' - ')
@@ -41,22 +32,45 @@ def main():
     rivers = {x.val: ([], []) for x in default_tree['major_rivers']}
     land_or_river = set(id_county_map) | set(rivers)
     province_graph = nx.Graph()
-    provinces_path = parser.file('map/' + default_tree['provinces'].val)
-    a = np.array(Image.open(str(provinces_path)))
-    for i, j in np.ndindex(a.shape[0] - 1, a.shape[1] - 1):
-        province = rgb_id_map.get(tuple(a[i, j]))
-        if province in land_or_river:
-            province_graph.add_node(province)
-            if province in rivers:
-                rivers[province][0].append((i, j))
-            for coords in ((i, j + 1), (i + 1, j)):
-                neighbor = rgb_id_map.get(tuple(a[coords]))
-                if neighbor != province and neighbor in land_or_river:
-                    province_graph.add_edge(province, neighbor)
-                    if province in rivers and neighbor not in rivers:
-                        rivers[province][1].append(coords)
-                    if neighbor in rivers and province not in rivers:
-                        rivers[neighbor][1].append((i, j))
+    ids = province_map.ids.copy()
+    # every pixel but those of the last row and column is paired with its
+    # right and its lower neighbor, scanning row by row
+    h, w = ids.shape[0] - 1, ids.shape[1] - 1
+    scan_views = lambda a: [(a[:h, :w], a[:h, 1:]), (a[:h, :w], a[1:, :w])]
+    province_graph.add_nodes_from(
+        province for province in np.unique(ids[:h, :w]).tolist()
+        if province in land_or_river)
+    for ids_0, ids_1 in scan_views(ids):
+        pairs = np.unique(np.column_stack([ids_0[ids_0 != ids_1],
+                                           ids_1[ids_0 != ids_1]]), axis=0)
+        province_graph.add_edges_from(
+            (x, y) for x, y in pairs.tolist()
+            if x in land_or_river and y in land_or_river)
+    is_river = np.isin(ids, list(rivers))
+    is_land = np.isin(ids, list(land_or_river - set(rivers)))
+    for i, j in np.argwhere(is_river[:h, :w]).tolist():
+        rivers[int(ids[i, j])][0].append((i, j))
+    # land pixels bordering a river pixel, as (river, i, j), in the order in
+    # which the scan first finds them, as the nearest border pixel of a river
+    # pixel is the first found of those at the same distance
+    border = []
+    coords = np.indices(ids.shape).transpose(1, 2, 0)
+    # position in the scan: pixel by pixel, the right before the lower pair
+    order = np.arange(h * w).reshape(h, w) * 2
+    views = [scan_views(x) for x in (ids, coords, is_river, is_land)]
+    for step, ((ids_0, ids_1), (coords_0, coords_1), (river_0, river_1),
+               (land_0, land_1)) in enumerate(zip(*views)):
+        mask = river_0 & land_1
+        border.append(np.column_stack([ids_0[mask], coords_1[mask],
+                                       order[mask] + step]))
+        mask = land_0 & river_1
+        border.append(np.column_stack([ids_1[mask], coords_0[mask],
+                                       order[mask] + step]))
+    border = np.concatenate(border)
+    border = border[border[:, 3].argsort(kind='stable'), :3]
+    _, first = np.unique(border, axis=0, return_index=True)
+    for river, i, j in border[np.sort(first)].tolist():
+        rivers[river][1].append((i, j))
     river_adjacencies = defaultdict(set)
     for river, (river_px, border_px) in rivers.items():
         if not river_px:
@@ -65,19 +79,14 @@ def main():
         if not border_px:
             print('WARNING: no border for {}'.format(river))
             continue
+        border_px = np.array(border_px)
         for i0, j0 in river_px:
-            min_item, min_val = None, float('inf')
-            for i1, j1 in border_px:
-                sqdist = (i1 - i0) * (i1 - i0) + (j1 - j0) * (j1 - j0)
-                if sqdist < min_val:
-                    min_val = sqdist
-                    min_item = i1, j1
-            px = a[min_item]
-            a[i0, j0] = px
-            province = rgb_id_map[tuple(px)]
+            sqdist = ((border_px - (i0, j0)) ** 2).sum(axis=1)
+            province = int(ids[tuple(border_px[sqdist.argmin()])])
+            ids[i0, j0] = province
             for coords in [(i0 - 1, j0), (i0, j0 - 1),
                            (i0, j0 + 1), (i0 + 1, j0)]:
-                neighbor = rgb_id_map.get(tuple(a[coords]))
+                neighbor = int(ids[coords])
                 if (neighbor != province and neighbor in id_county_map and
                     not province_graph.has_edge(province, neighbor)):
                     if neighbor < province:
@@ -1,12 +1,14 @@
 #!/usr/bin/env python3
 
 import argparse
-from pathlib import Path
+import fnmatch
+import hashlib
+import io
+from pathlib import Path, PurePosixPath
 import pickle
 import re
-import sys
 import git
-from ck2parser import rootpath, cachedir, is_codename, SimpleParser
+from ck2parser import rootpath, cachedir, is_codename, files, SimpleParser
 from print_time import print_time
 
 
@@ -37,27 +39,14 @@ def parse_arguments():
 
 
 def get_repo(mod_path):
-    if mod_path.name in repo_map:
+    if mod_path in repo_map:
         return repo_map[mod_path]
-    repo = git.Repo(str(mod_path), search_parent_directories=True)
+    repo = git.Repo(str(mod_path), odbt=git.GitCmdObjectDB,
+                    search_parent_directories=True)
     repo_map[mod_path] = repo
     return repo
 
 
-def checkout(repo, ref):
-    repo_dir = Path(repo.working_tree_dir)
-    invalidate_repo_cache(repo_dir)
-
-    prev_head = repo.head.commit if repo.head.is_detached else repo.head.ref
-    repo.head.ref = ref
-    repo.head.reset(working_tree=True)
-
-    print('{}: checked out {}'.format(repo_dir.name,
-        ref.hexsha[:8] if isinstance(ref, git.Commit) else ref.name),
-        file=sys.stderr)
-    return prev_head
-
-
 def get_checkpoint_commit_from_file(mod_path):
     mod_path = mod_path.resolve()
     repo = get_repo(mod_path)
@@ -86,76 +75,173 @@ def compare_digests(old, new):
     return report
 
 
-def create_digest_SWMH():
-    digest = {'version': {4}}
+# each file is digested on its own into a dict of digest keys to lists of
+# items, so that the digest of a commit only parses the files whose blobs
+# aren't in the partial digest cache yet
+
+def digest_buildings(tree):
+    return {'buildings': [(n.val, n2.val) for n, v in tree for n2, v2 in v]}
+
+
+def digest_cultures(tree):
+    return {'culture_groups': [n.val for n, v in tree],
+            'cultures': [n2.val for n, v in tree for n2, v2 in v]}
+
+
+def digest_dynasties(tree):
+    dynasties = []
+    for n, v in tree:
+        culture = v['culture'].val if 'culture' in v.dictionary else None
+        dynasties.append((n.val, culture))
+    return {'dynasties': dynasties}
+
+
+def digest_landed_titles(tree):
+    landed_titles = []
+    dfs = list(tree)
+    while dfs:
+        n, v = dfs.pop()
+        if is_codename(n.val):
+            landed_titles.append(n.val)
+            dfs.extend(v)
+    return {'landed_titles': landed_titles}
+
+
+def digest_minor_titles(tree):
+    return {'minor_titles': [n.val for n, v in tree]}
 
-    buildings = set()
-    for _, tree in parser.parse_files('common/buildings/*.txt'):
-        for n, v in tree:
-            for n2, v2 in v:
-                buildings.add((n.val, n2.val))
-    digest['buildings'] = buildings
-
-    culture_groups = set()
-    cultures = set()
-    for _, tree in parser.parse_files('common/cultures/*.txt'):
-        for n, v in tree:
-            culture_groups.add(n.val)
-            for n2, v2 in v:
-                cultures.add(n2.val)
-    digest['culture_groups'] = culture_groups
-    digest['cultures'] = cultures
-
-    dynasties = set()
-    for _, tree in parser.parse_files('common/dynasties/*.txt'):
-        for n, v in tree:
-            culture = v['culture'].val if 'culture' in v.dictionary else None
-            dynasties.add((n.val, culture))
-    digest['dynasties'] = dynasties
-
-    landed_titles = set()
-    for _, tree in parser.parse_files('common/landed_titles/*.txt'):
-        dfs = list(tree)
-        while dfs:
-            n, v = dfs.pop()
-            if is_codename(n.val):
-                landed_titles.add(n.val)
-                dfs.extend(v)
-    digest['landed_titles'] = landed_titles
-
-    minor_titles = set()
-    for _, tree in parser.parse_files('common/minor_titles/*.txt'):
-        for n, v in tree:
-            minor_titles.add(n.val)
-    digest['minor_titles'] = minor_titles
-
-    religions = set()
-    for _, tree in parser.parse_files('common/religions/*.txt'):
-        for n, v in tree:
-            for n2, v2 in v:
-                religions.add(n2.val)
-    digest['religions'] = religions
-
-    traits = set()
-    trait_index = 0
-    for _, tree in parser.parse_files('common/traits/*.txt'):
-        for n, v in tree:
-            traits.add((trait_index, n.val))
-            trait_index += 1
-    digest['traits'] = traits
 
+def digest_religions(tree):
+    return {'religions': [n2.val for n, v in tree for n2, v2 in v]}
+
+
+def digest_traits(tree):
+    # numbered in merge_digests, since the index runs across files
+    return {'traits': [n.val for n, v in tree]}
+
+
+digest_globs_SWMH = [
+    ('common/buildings/*.txt', digest_buildings),
+    ('common/cultures/*.txt', digest_cultures),
+    ('common/dynasties/*.txt', digest_dynasties),
+    ('common/landed_titles/*.txt', digest_landed_titles),
+    ('common/minor_titles/*.txt', digest_minor_titles),
+    ('common/religions/*.txt', digest_religions),
+    ('common/traits/*.txt', digest_traits)
+]
+
+digest_keys_SWMH = ['buildings', 'culture_groups', 'cultures', 'dynasties',
+                    'landed_titles', 'minor_titles', 'religions', 'traits']
+
+
+def merge_digests(partials, keys):
+    """the digest of a mod from the partial digests of its files, in files()
+    order"""
+    digest = {'version': {4}}
+    for key in keys:
+        digest[key] = set()
+    for partial in partials:
+        for key, items in partial.items():
+            if key == 'traits':
+                start = len(digest[key])
+                items = enumerate(items, start)
+            digest[key].update(items)
     return digest
 
 
-def create_digest(mod_path):
+class PartialCache:
+    """partial digests by digest function and git blob hash, so that a file
+    which is the same in two commits is parsed only once"""
+
+    version = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.partials = {}
+        self.changed = False
+        try:
+            with path.open('rb') as f:
+                version, partials = pickle.load(f)
+            if version == self.version:
+                self.partials = partials
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError,
+                ValueError):
+            pass
+
+    def get(self, digest_file, blob_hash, read):
+        """the partial digest of a file, calling read() for its contents only
+        if it isn't cached"""
+        key = digest_file.__name__, blob_hash
+        if key not in self.partials:
+            data = read()
+            # decoded as by parse_file, including its newline translation
+            text = io.TextIOWrapper(io.BytesIO(data), encoding=parser.encoding,
+                                    errors='replace').read()
+            self.partials[key] = digest_file(parser.parse(text))
+            self.changed = True
+        return self.partials[key]
+
+    def save(self):
+        if self.changed:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(self.path.name + '.tmp')
+            with tmp.open('wb') as f:
+                pickle.dump((self.version, self.partials), f)
+            tmp.replace(self.path)
+            self.changed = False
+
+
+partial_cache = PartialCache(digest_dir / 'partials.pkl')
+
+
+def blob_hash(data):
+    """the hash git gives a blob with these contents"""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()
+
+
+def commit_files(glob, mod_path, commit):
+    """(blob hash, read) of the files matching glob, in files() order, with
+    the mod files taken from commit instead of the working tree. read()
+    returns the contents, from the object database for mod files"""
+    folder, _, pattern = glob.rpartition('/')
+    result = {}
+    for path in files(glob, basedir=parser.basedir):
+        data = path.read_bytes()
+        result[path.relative_to(parser.basedir).as_posix()] = (
+            blob_hash(data), lambda data=data: data)
+    repo = get_repo(mod_path)
+    mod_dir = mod_path.relative_to(Path(repo.working_tree_dir).resolve())
+    tree = commit.tree
+    try:
+        for part in PurePosixPath(mod_dir.as_posix(), folder).parts:
+            if part != '.':
+                tree = tree / part
+    except KeyError:
+        tree = None
+    if tree is not None:
+        for blob in tree.blobs:
+            if fnmatch.fnmatchcase(blob.name, pattern):
+                # read through the object database's git cat-file --batch
+                # process, which stays open between reads
+                result[folder + '/' + blob.name] = (
+                    blob.hexsha, lambda blob=blob: blob.data_stream.read())
+    return [result[name] for name in
+            sorted(result, key=lambda name: PurePosixPath(name).parts)]
+
+
+def create_digest(mod_path, commit):
     mod_path = mod_path.resolve()
-    parser.moddirs = [mod_path]
     if mod_path.name == 'SWMH':
-        digest = create_digest_SWMH()
+        digest_globs, digest_keys = digest_globs_SWMH, digest_keys_SWMH
     else:
         raise ValueError("don't know how to digest {}".format(mod_path.name))
 
-    return digest
+    partials = []
+    for glob, digest_file in digest_globs:
+        for blob_hash, read in commit_files(glob, mod_path, commit):
+            partials.append(partial_cache.get(digest_file, blob_hash, read))
+    partial_cache.save()
+    return merge_digests(partials, digest_keys)
 
 
 def record_digest(mod_path, commit=None, new=False):
@@ -174,16 +260,8 @@ def record_digest(mod_path, commit=None, new=False):
             digest = pickle.load(f)
         return digest
 
-    must_checkout = repo.head.commit != commit
-    prev_head = None
-    try:
-        if must_checkout:
-            prev_head = checkout(repo, commit)
-
-        digest = create_digest(mod_path)
-    finally:
-        if must_checkout and prev_head != None:
-            checkout(repo, prev_head)
+    # digested straight from the commit's blobs, so nothing is checked out
+    digest = create_digest(mod_path, commit)
 
     digest_path.parent.mkdir(parents=True, exist_ok=True)
     with digest_path.open('wb') as f:
@@ -206,10 +284,6 @@ def check_compat(mod_path, checkpoint_commit=None):
     return compat_report
 
 
-def invalidate_repo_cache(bad_path=None):
-    parser.invalidate_repo_cache(bad_path)
-
-
 @print_time
 def main():
     args = parse_arguments()
@@ -28,7 +28,7 @@ def process_landed_titles(parser):
 def main():
     parser = SimpleParser()
     parser.moddirs = [rootpath / 'SWMH-BETA/SWMH']
-    localisation = get_localisation(parser.moddirs)
+    localisation = dict(get_localisation(parser.moddirs))
     localisation.update({t: localisation['PROV{}'.format(num)]
                          for num, t, _ in get_provinces(parser)})
     titles_list, title_liege_map, title_vassals_map = (
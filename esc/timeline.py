@@ -0,0 +1,112 @@
+from bisect import bisect_left, bisect_right
+
+# dated history for the ck2, ck3 and eu4 scripts. A history is a tree whose
+# pairs either apply from the start or, if their key is a date, hold a block
+# of pairs which apply from that date on.
+
+# date of the pairs which apply from the start, before any real date
+START = ()
+
+
+class Changes:
+    """values of one thing over time, sorted by date"""
+
+    def __init__(self):
+        self.dates = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        return zip(self.dates, self.values)
+
+    def __setitem__(self, date, value):
+        """set the value from date on, replacing one set at the same date"""
+        i = bisect_left(self.dates, date)
+        if i < len(self.dates) and self.dates[i] == date:
+            self.values[i] = value
+        else:
+            self.dates.insert(i, date)
+            self.values.insert(i, value)
+
+    def add(self, date, value):
+        """add a change after any others at the same date"""
+        i = bisect_right(self.dates, date)
+        self.dates.insert(i, date)
+        self.values.insert(i, value)
+
+    def at(self, date, default=None):
+        """the value of the last change at or before date"""
+        i = bisect_right(self.dates, date)
+        return self.values[i - 1] if i else default
+
+    def all_at(self, date):
+        """the values of every change at or before date, in order"""
+        return self.values[:bisect_right(self.dates, date)]
+
+    def next_date(self, date, default=None):
+        """the date of the first change after date"""
+        i = bisect_right(self.dates, date)
+        return self.dates[i] if i < len(self.dates) else default
+
+
+class Timeline:
+    """Every pair of a history in the order it applies: undated pairs first,
+    then dated blocks by date, each in file order. Build it once per history
+    and query it for as many dates as needed."""
+
+    def __init__(self, history):
+        undated = []
+        dated = []
+        for pair in history:
+            if isinstance(pair.key.val, tuple):
+                if hasattr(pair.value, 'contents'):
+                    dated.append(pair)
+            else:
+                undated.append((START, pair))
+        dated.sort(key=lambda pair: pair.key.val)
+        self.entries = undated + [(block.key.val, pair) for block in dated
+                                  for pair in block.value]
+        self.dates = [date for date, _ in self.entries]
+        self.keys = {}
+        for date, pair in self.entries:
+            changes = self.keys.get(pair.key.val)
+            if changes is None:
+                changes = self.keys[pair.key.val] = Changes()
+            changes.dates.append(date)
+            changes.values.append(pair.value)
+
+    def entries_until(self, date):
+        """the pairs which apply at date, in order"""
+        return [pair for _, pair in
+                self.entries[:bisect_right(self.dates, date)]]
+
+    def value(self, key, date, default=None):
+        """the last value of key at date"""
+        changes = self.keys.get(key)
+        return default if changes is None else changes.at(date, default)
+
+    def values(self, key, date):
+        """every value of key at date, in order"""
+        changes = self.keys.get(key)
+        return [] if changes is None else changes.all_at(date)
+
+    def state(self, date):
+        """dict of each key set at date to its last value"""
+        state = {}
+        for key, changes in self.keys.items():
+            i = bisect_right(changes.dates, date)
+            if i:
+                state[key] = changes.values[i - 1]
+        return state
+
+    def sweep(self, dates):
+        """for each of the given dates in ascending order, yield the date and
+        the list of (date, pair) entries which apply from after the previous
+        one up to it"""
+        i = 0
+        for date in dates:
+            j = bisect_right(self.dates, date, i)
+            yield date, self.entries[i:j]
+            i = j
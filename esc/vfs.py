@@ -0,0 +1,229 @@
+import fnmatch
+import os
+import pathlib
+import re
+import zipfile
+
+# a layered view of a game folder and mod folders, like libck2's VFS. Files
+# of later layers override those of earlier layers with the same relative
+# path. The listing of each folder is read once and kept, so that globs and
+# file lookups don't walk the folders again.
+
+_ignorecase = os.path.normcase('A') == 'a'
+_glob_magic = re.compile('[*?[]')
+
+
+class _DirLayer:
+    """the listings of the folders below root, read on first use. With watch,
+    a listing is read again when the modification time of its folder
+    changed, which happens whenever an entry is added, removed or renamed"""
+
+    def __init__(self, root, watch):
+        self.root = pathlib.Path(root)
+        self.watch = watch
+        # relative folder path (normcased, '/'-separated) to
+        # (mtime, {normcased name: (name, is_dir, is_symlink)})
+        self.listings = {}
+
+    def _read(self, reldir, st):
+        entries = {}
+        with os.scandir(os.path.join(self.root, reldir)) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                entries[os.path.normcase(entry.name)] = (
+                    entry.name, is_dir, entry.is_symlink())
+        self.listings[reldir] = st.st_mtime_ns, entries
+        return entries
+
+    def listing(self, reldir):
+        """the entries of a folder, or None if it doesn't exist"""
+        cached = self.listings.get(reldir)
+        if cached is not None and not self.watch:
+            return cached[1]
+        try:
+            st = os.stat(os.path.join(self.root, reldir))
+        except OSError:
+            self.listings.pop(reldir, None)
+            return None
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return cached[1]
+        try:
+            return self._read(reldir, st)
+        except (NotADirectoryError, FileNotFoundError):
+            return None
+
+    def scan(self):
+        """read every listing below root in a single walk"""
+        stack = ['']
+        while stack:
+            reldir = stack.pop()
+            try:
+                st = os.stat(os.path.join(self.root, reldir))
+                entries = self._read(reldir, st)
+            except OSError:
+                continue
+            stack.extend(reldir + '/' + key if reldir else key
+                         for key, (_, is_dir, is_symlink) in entries.items()
+                         if is_dir and not is_symlink)
+
+    def path(self, parts):
+        return self.root.joinpath(*parts)
+
+
+class _ZipLayer:
+    """the members of a zip archive, read again with watch if its
+    modification time changed"""
+
+    def __init__(self, archive, watch):
+        self.root = pathlib.Path(archive)
+        self.watch = watch
+        self.mtime = None
+        self.listings = {}
+
+    def _read(self):
+        listings = {'': {}}
+        with zipfile.ZipFile(self.root) as archive:
+            for name in archive.namelist():
+                parts = name.rstrip('/').split('/')
+                reldir = ''
+                for i, part in enumerate(parts):
+                    is_dir = i < len(parts) - 1 or name.endswith('/')
+                    key = os.path.normcase(part)
+                    listings[reldir].setdefault(key, (part, is_dir, False))
+                    reldir = reldir + '/' + key if reldir else key
+                    if is_dir:
+                        listings.setdefault(reldir, {})
+        self.listings = listings
+
+    def listing(self, reldir):
+        if self.mtime is None or self.watch:
+            mtime = os.stat(self.root).st_mtime_ns
+            if mtime != self.mtime:
+                self._read()
+                self.mtime = mtime
+        return self.listings.get(reldir)
+
+    def scan(self):
+        self.listing('')
+
+    def path(self, parts):
+        """the member name"""
+        return '/'.join(parts)
+
+
+class VFS:
+    """Files of layered folders and zip archives. Later layers override
+    earlier ones. Globs follow pathlib's rules and results are sorted by
+    their relative path, as in ck2parser.files().
+
+    Folders are listed on first use, or all at once by scan(). With watch,
+    every query checks the modification times of the folders it visits
+    and lists changed ones again, so files created or deleted in the
+    meantime are found as with a fresh glob."""
+
+    def __init__(self, *layers, watch=True):
+        self.layers = [
+            _ZipLayer(layer, watch) if not os.path.isdir(layer) and
+            zipfile.is_zipfile(layer) else _DirLayer(layer, watch)
+            for layer in layers]
+
+    def scan(self):
+        for layer in self.layers:
+            layer.scan()
+        return self
+
+    def _merged(self, reldirs):
+        """dict of each normcased name in the folder, given as the relative
+        path in each layer where it is a folder, to
+        (name, is_dir, is_symlink, last layer) and the relative folder
+        paths of the layers in which it is a folder"""
+        merged = {}
+        for layer, reldir in reldirs:
+            entries = layer.listing(reldir)
+            if entries is None:
+                continue
+            for key, (name, is_dir, is_symlink) in entries.items():
+                child = reldir + '/' + key if reldir else key
+                if key in merged:
+                    subdirs = merged[key][1]
+                else:
+                    subdirs = []
+                if is_dir:
+                    subdirs.append((layer, child))
+                merged[key] = (name, is_dir, is_symlink, layer), subdirs
+        return merged
+
+    def _select(self, parts, reldirs, segments):
+        """yield (relative parts, layer) of the matches of segments below
+        the folder given by parts and reldirs"""
+        segment, rest = segments[0], segments[1:]
+        if segment == '**':
+            if rest:
+                yield from self._select(parts, reldirs, rest)
+            else:
+                yield parts, reldirs[-1][0]
+            for key, ((name, is_dir, is_symlink, _), subdirs) in \
+                    self._merged(reldirs).items():
+                if is_dir and not is_symlink:
+                    yield from self._select(parts + (name,), subdirs,
+                                            segments)
+            return
+        merged = self._merged(reldirs)
+        if _glob_magic.search(segment):
+            regex = re.compile(fnmatch.translate(segment),
+                               re.IGNORECASE if _ignorecase else 0)
+            keys = [key for key, ((name, _, _, _), _) in merged.items()
+                    if regex.match(name)]
+        else:
+            keys = [os.path.normcase(segment)]
+        for key in keys:
+            if key not in merged:
+                continue
+            (name, is_dir, _, layer), subdirs = merged[key]
+            if not rest:
+                yield parts + (name,), layer
+            elif is_dir:
+                yield from self._select(parts + (name,), subdirs, rest)
+
+    def matches(self, pattern, reverse=False):
+        """list of (layer, relative path parts) of the matches of a glob
+        pattern, sorted by their relative path. Each layer has a root, the
+        folder or zip archive"""
+        segments = [segment for segment in pattern.replace('\\', '/')
+                    .split('/') if segment not in ('', '.')]
+        if not segments:
+            return []
+        found = {}
+        for parts, layer in self._select((), [(layer, '') for layer in
+                                              self.layers], segments):
+            found.setdefault(parts, layer)
+        return [(found[parts], parts)
+                for parts in sorted(found, reverse=reverse)]
+
+    def glob(self, pattern, reverse=False):
+        """the paths of the matches of a glob pattern, sorted by their
+        relative path. Matches in zip archives are member names"""
+        return [layer.path(parts)
+                for layer, parts in self.matches(pattern, reverse)]
+
+    def file(self, pattern):
+        """the path of the first match of a glob pattern"""
+        for path in self.glob(pattern):
+            return path
+        raise StopIteration
+
+
+# VFS of each list of layers, see shared
+_shared = {}
+
+
+def shared(*layers):
+    """the VFS of the layers, watching for changes, shared by all callers
+    with the same layers"""
+    key = tuple(map(os.fspath, layers))
+    if key not in _shared:
+        _shared[key] = VFS(*layers)
+    return _shared[key]
@@ -20,9 +20,10 @@ import csv
 import pathlib
 import re
 import sys
-from ck2parser import (rootpath, vanilladir, csv_rows, files, get_religions,
+from ck2parser import (rootpath, vanilladir, csv_rows, files, add_religions,
                        get_province_id_name_map, is_codename, Date, String,
                        SimpleParser)
+from pipeline import Pipeline
 from print_time import print_time
 
 # if true, instead of removing localisation, write out a file listing broken
@@ -38,6 +39,9 @@ NUKE_IT_FROM_ORBIT = False
 COUNTY_TITLE_NAMES = True
 PROVINCE_HISTORY_NAMES = False
 
+# processes to parse the mod in
+WORKERS = 4
+
 def make_outpath(outroot, inpath, *roots):
     for i, root in enumerate(roots):
         try:
@@ -46,7 +50,7 @@ def make_outpath(outroot, inpath, *roots):
             if i == len(roots) - 1:
                 raise
 
-def process_cultures(parser, build):
+def process_cultures(cultures, culture_groups):
     def update_obj(obj):
         for p in reversed(obj.contents):
             if p.key.val == 'dynasty_title_names':
@@ -54,9 +58,7 @@ def process_cultures(parser, build):
                 return True
         return False
 
-    cultures = []
-    culture_groups = []
-    for inpath, tree in parser.parse_files('common/cultures/*'):
+    def transform(inpath, tree):
         mutated = False
         for n, v in tree:
             culture_groups.append(n.val)
@@ -65,50 +67,34 @@ def process_cultures(parser, build):
                     cultures.append(n2.val)
                     mutated |= update_obj(v2)
             mutated |= update_obj(v)
-        if not AUDIT and mutated:
-            outpath = make_outpath(build, inpath, vanilladir, *parser.moddirs)
-            with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                f.write(tree.str(parser))
-    return cultures, culture_groups
+        return mutated
+    return transform
 
-def process_history(parser, build, extra_keys):
-    prov_title = {}
-    id_name = get_province_id_name_map(parser)
-    # critical_error = False
-    for glob in ['history/provinces/*', 'history/titles/*']:
-        for inpath, tree in parser.parse_files(glob):
-            # if isinstance(tree, Exception):
-            #     critical_error = True
-            #     continue
-            mutated = False
-            for n, v in tree:
-                if isinstance(n, Date):
-                    for p2 in reversed(v.contents):
-                        n2, v2 = p2
-                        if re.fullmatch(r'(reset_)?(name|adjective)', n2.val):
-                            if not AUDIT:
-                                mutated = True
-                                v.contents.remove(p2)
-                            elif n2.val in ['name', 'adjective']:
-                                extra_keys.add(v2.val)
-                if glob == 'history/provinces/*' and n.val == 'title':
-                    number, name = inpath.stem.split(' - ')
-                    number = int(number)
-                    if id_name.get(number) == name:
-                        prov_title['PROV{}'.format(number)] = v.val
-            if mutated:
-                outpath = make_outpath(build, inpath, vanilladir,
-                                       *parser.moddirs)
-                with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                    f.write(tree.str(parser))
-    # if critical_error:
-    #     raise SystemExit()
-    return id_name, prov_title
+def process_history(extra_keys, id_name=None, prov_title=None):
+    # with id_name and prov_title, the files are province history and their
+    # titles are collected
+    def transform(inpath, tree):
+        mutated = False
+        for n, v in tree:
+            if isinstance(n, Date):
+                for p2 in reversed(v.contents):
+                    n2, v2 = p2
+                    if re.fullmatch(r'(reset_)?(name|adjective)', n2.val):
+                        if not AUDIT:
+                            mutated = True
+                            v.contents.remove(p2)
+                        elif n2.val in ['name', 'adjective']:
+                            extra_keys.add(v2.val)
+            if prov_title is not None and n.val == 'title':
+                number, name = inpath.stem.split(' - ')
+                number = int(number)
+                if id_name.get(number) == name:
+                    prov_title['PROV{}'.format(number)] = v.val
+        return mutated
+    return transform
 
-def get_governments(parser):
-    governments = []
-    prefixes = []
-    for _, tree in parser.parse_files('common/governments/*'):
+def get_governments(governments, prefixes):
+    def transform(inpath, tree):
         for _, v in tree:
             for n2, v2 in v:
                 governments.append(n2.val)
@@ -118,14 +104,12 @@ def get_governments(parser):
                     continue
                 if prefix not in prefixes:
                     prefixes.append(prefix)
-    return governments, prefixes
+    return transform
 
-def get_unlanded_titles(parser):
-    ul_titles = []
-    for glob in ['common/job_titles/*', 'common/minor_titles/*']:
-        for _, tree in parser.parse_files(glob):
-            ul_titles.extend(n.val for n, v in tree)
-    return ul_titles
+def get_unlanded_titles(ul_titles):
+    def transform(inpath, tree):
+        ul_titles.extend(n.val for n, v in tree)
+    return transform
 
 def get_max_provinces(parser):
     return next(parser.parse_files('map/default.map'))[1]['max_provinces'].val
@@ -152,17 +136,17 @@ def main():
             pass
 
     max_provs = get_max_provinces(parser)
-    cultures, culture_groups = process_cultures(parser, build)
-    if not NUKE_IT_FROM_ORBIT:
-        religions, religion_groups = get_religions(parser)
-        governments, gov_prefixes = get_governments(parser)
-        ul_titles = get_unlanded_titles(parser)
-    parser.fq_keys = cultures
+    id_name = get_province_id_name_map(parser)
+    cultures, culture_groups = [], []
+    religions, religion_groups = [], []
+    governments, gov_prefixes = [], []
+    ul_titles = []
     lt_keys_to_remove = [
         'title', 'title_female', 'foa', 'title_prefix', 'short_name',
-        'name_tier', 'location_ruler_title', 'dynasty_title_names'] + cultures
+        'name_tier', 'location_ruler_title', 'dynasty_title_names']
     titles = set()
     extra_keys = set()
+    prov_title = {}
 
     def update_tree(tree):
         for n, v in tree:
@@ -178,16 +162,33 @@ def main():
                         v.contents.remove(p2)
                 update_tree(v)
 
-    # process landed_titles
-    for inpath, tree in parser.parse_files('common/landed_titles/*'):
-        outpath = make_outpath(build, inpath, vanilladir, *parser.moddirs)
-        update_tree(tree)
-        if not AUDIT:
-            with outpath.open('w', encoding='cp1252', newline='\r\n') as f:
-                f.write(tree.str(parser))
+    def start_landed_titles():
+        # the cultures are known once their stage is done
+        parser.fq_keys = cultures
+        lt_keys_to_remove.extend(cultures)
 
-    # process history
-    id_name, prov_title = process_history(parser, build, extra_keys)
+    # each file is parsed once, transformed and written back if it changed
+    def outpath(inpath):
+        return make_outpath(build, inpath, vanilladir, *parser.moddirs)
+    pipeline = Pipeline(parser, None if AUDIT else outpath, WORKERS)
+    pipeline.add('common/cultures/*',
+                 process_cultures(cultures, culture_groups))
+    if not NUKE_IT_FROM_ORBIT:
+        pipeline.add('common/religions/*.txt',
+                     lambda inpath, tree: add_religions(tree, religions,
+                                                        religion_groups))
+        pipeline.add('common/governments/*',
+                     get_governments(governments, gov_prefixes))
+        for glob in ['common/job_titles/*', 'common/minor_titles/*']:
+            pipeline.add(glob, get_unlanded_titles(ul_titles))
+    # landed titles are always written, as before
+    pipeline.add('common/landed_titles/*',
+                 lambda inpath, tree: update_tree(tree), rewrite=True,
+                 start=start_landed_titles)
+    pipeline.add('history/provinces/*',
+                 process_history(extra_keys, id_name, prov_title))
+    pipeline.add('history/titles/*', process_history(extra_keys))
+    pipeline.run()
 
     if NUKE_IT_FROM_ORBIT:
         outrows = [[''] * 15]